@@ -0,0 +1,432 @@
+import argparse
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from tools import *
+import instrument
+
+try:
+    import fcntl
+except ImportError:         # Windows
+    fcntl = None
+    import msvcrt
+
+
+PROGRESS_ROWS = 50_000      # Active list rows between progress callbacks
+MAGIC = b"PLUIDX01"         # First bytes of an exported active list index
+HEADER_BYTES = 4096         # MAGIC plus the JSON header, padded so the codes start page aligned
+ALIGN_BYTES = 64            # Alignment of the rows array
+
+# Delta workbook sheet names (normalized) -> whether their codes are added to or removed from the index
+DELTA_SHEETS = {"add": "added", "added": "added", "new": "added",
+                "remove": "removed", "removed": "removed", "retire": "removed", "retired": "removed"}
+
+
+class ActiveIndex:
+    """ Hash index over a column of the active list (PLU codes or style codes).
+        Built once from the list returned by read_column, then every lookup is O(1).
+        columns are the other columns read_columns returned with the codes (e.g. barcodes), each indexed the same way.
+        progress(stage, done, total) is called every PROGRESS_ROWS codes while building, if given.
+    """
+    @instrument.timed("build active index")
+    def __init__(self, codes: list, progress=None, columns: dict[str, list[str]] | None = None):
+        self.size = len(codes)
+        self.row_codes = []
+        self.first_rows = {}
+        self.all_rows = {}
+        for position, code in enumerate(codes):
+            if progress and position % PROGRESS_ROWS == 0:
+                progress("Indexing active list", position, self.size)
+            code = normalizer(code)
+            self.row_codes.append(code)
+            if code in self.first_rows:
+                self.all_rows[code].append(position)
+            else:
+                self.first_rows[code] = position
+                self.all_rows[code] = [position]
+
+        self.column_values = dict(columns or {})
+        self.columns = {}       # field -> {value: first row position holding it}
+        for field, values in self.column_values.items():
+            first = {}
+            for position, value in enumerate(values):
+                if value and value not in first:
+                    first[value] = position
+            self.columns[field] = first
+
+
+    def __repr__(self):
+        return f"ActiveIndex: {len(self.first_rows)} codes from {self.size} rows"
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __contains__(self, code):
+        return normalizer(code) in self.first_rows
+
+
+    def first(self, code) -> int | None:
+        """ Position of the first active list row holding this code, or None"""
+        return self.first_rows.get(normalizer(code))
+
+
+    @instrument.timed("probe active index")
+    def first_many(self, codes: list) -> np.ndarray:
+        """ first() for every code, -1 where a code isn't in the list"""
+        get = self.first_rows.get
+        return np.fromiter((get(normalizer(code), -1) for code in codes), dtype=np.int64, count=len(codes))
+
+
+    def positions(self, code) -> list[int]:
+        """ Every active list row position holding this code"""
+        return self.all_rows.get(normalizer(code), [])
+
+
+    def owners(self, field: str, values: list[str]) -> dict[str, tuple[int, str]]:
+        """ For each value (a catalogue_key) found in the field's column: the first active list row holding it and
+            that row's code. Empty when the list had no such column.
+        """
+        first = self.columns.get(field, {})
+        return {value: (first[value], self.row_codes[first[value]]) for value in values if value in first}
+
+
+    def export(self, path) -> "MappedActiveIndex":
+        """ This index, columns included, written to path as a MappedActiveIndex file"""
+        return MappedActiveIndex.build(self.row_codes, path, columns=self.column_values)
+
+
+class MappedActiveIndex:
+    """ Read-only ActiveIndex backed by one memory-mapped file, so every session and process shares one copy of its pages.
+        Holds every code sorted (fixed-width utf-8) next to its row position; lookups are binary searches.
+        File layout: MAGIC and a JSON header padded to HEADER_BYTES, the sorted codes, then the rows as int64.
+        Each other column (see ActiveIndex) follows as its non-blank values sorted, their rows, and the code on each row.
+        apply_delta adds and retires codes in place, bumping the header's version each time.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            head = f.read(HEADER_BYTES)
+        if not head.startswith(MAGIC):
+            raise ValueError(f"{self.path} is not an exported active list index")
+        self.header = json.loads(head[len(MAGIC):])
+        size, width = self.header["rows"], self.header["width"]
+        self.codes = self.mapped(f"S{width}", self.header["codes_offset"], size)
+        self.rows = self.mapped(np.int64, self.header["rows_offset"], size)
+        self.columns = {        # field -> (sorted values, their rows, the code on each row)
+            field: (self.mapped(f"S{spec['width']}", spec["values_offset"], spec["rows"]),
+                    self.mapped(np.int64, spec["rows_offset"], spec["rows"]),
+                    self.mapped(f"S{spec['owner_width']}", spec["owners_offset"], spec["rows"]))
+            for field, spec in self.header.get("columns", {}).items()     # Indexes exported before columns have none
+        }
+
+
+    def mapped(self, dtype, offset: int, size: int) -> np.ndarray:
+        if not size:                # np.memmap can't map zero bytes
+            return np.array([], dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=(size,))
+
+
+    @classmethod
+    @instrument.timed("build active index")
+    def build(cls, codes: list, path, message: str = "", msg_type: str = "skip", columns: dict[str, list[str]] | None = None):
+        """ Write the active list codes (read_column output, in row order) to path and map them.
+            message and msg_type are read_column's, kept so a later load can show them again.
+            columns are read_columns' other columns, aligned with codes.
+        """
+        encoded = encode_codes(codes)
+        order = np.argsort(encoded, kind="stable")     # Stable, so each code's rows stay in file order
+        header = {"message": message, "msg_type": msg_type, "version": 1, "next_row": len(encoded)}
+        rows = np.arange(len(encoded), dtype=np.int64)
+        sorted_columns = {field: column_arrays(values, rows, encoded) for field, values in (columns or {}).items()}
+        return cls.write(path, encoded[order], order.astype(np.int64), header, sorted_columns)
+
+
+    @classmethod
+    def write(cls, path, codes: np.ndarray, rows: np.ndarray, header: dict,
+              columns: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]] | None = None):
+        """ Write sorted codes and their rows to path with header, and map the result.
+            columns holds each other column as (sorted values, rows, owning codes), see column_arrays.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = [codes, rows.astype(np.int64)]
+        offsets = [HEADER_BYTES, aligned(HEADER_BYTES + codes.nbytes)]
+        specs = {}
+        for field, (values, value_rows, owners) in (columns or {}).items():
+            start = len(arrays)
+            for array in (values, value_rows.astype(np.int64), owners):
+                offsets.append(aligned(offsets[-1] + arrays[-1].nbytes))
+                arrays.append(array)
+            specs[field] = {"rows": len(values), "width": values.dtype.itemsize, "owner_width": owners.dtype.itemsize,
+                            "values_offset": offsets[start], "rows_offset": offsets[start + 1],
+                            "owners_offset": offsets[start + 2]}
+        header = json.dumps({**header, "rows": len(codes), "width": codes.dtype.itemsize, "codes_offset": offsets[0],
+                             "rows_offset": offsets[1], "columns": specs,
+                             "updated": time.strftime("%Y-%m-%dT%H:%M:%S")}).encode()
+        if len(MAGIC) + len(header) > HEADER_BYTES:
+            raise ValueError(f"Active list header is {len(header)} bytes, the format allows {HEADER_BYTES - len(MAGIC)}")
+
+        temp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp, "wb") as f:
+            f.write((MAGIC + header).ljust(HEADER_BYTES, b" "))
+            for array, offset in zip(arrays, offsets):
+                f.write(bytes(offset - f.tell()))
+                f.write(array.tobytes())
+        os.replace(temp, path)     # Atomic, so a session mapping this path never sees half a file
+        return cls(path)
+
+
+    @instrument.timed("apply active list delta")
+    def apply_delta(self, added: list = (), removed: list = (), added_columns: dict[str, list[str]] | None = None):
+        """ Retire every row holding a removed code, then add each added code as a new row after the last one.
+            added_columns gives the new rows' values for the index's other columns, aligned with added. A retired
+            row's values go with it. Columns the index doesn't hold are ignored.
+            Works from the file as it is now, under index_lock, so concurrent updates from other sessions and processes
+            are applied one after the other and none is lost.
+            Only the changed codes are searched and inserted, the active list itself is never re-read.
+            Returns the updated index, with its version bumped.
+        """
+        with index_lock(self.path):
+            return self.merge_delta(added, removed, added_columns)
+
+
+    def merge_delta(self, added: list, removed: list, added_columns: dict[str, list[str]] | None) -> "MappedActiveIndex":
+        """ apply_delta's read, merge and replace, for a caller holding index_lock"""
+        current = MappedActiveIndex(self.path)
+        codes, rows = np.asarray(current.codes), np.asarray(current.rows)
+
+        retired = [position for start, end in map(current._span, dict.fromkeys(removed)) for position in range(start, end)]
+        retired_rows = rows[retired]
+        codes, rows = np.delete(codes, retired), np.delete(rows, retired)
+
+        new_codes = encode_codes(added)
+        next_row = current.header["next_row"]
+        new_rows = np.arange(next_row, next_row + len(new_codes), dtype=np.int64)
+        codes, rows = merge_sorted(codes, rows, new_codes, new_rows)
+
+        columns = {}
+        for field, (values, value_rows, owners) in current.columns.items():
+            kept = ~np.isin(np.asarray(value_rows), retired_rows)
+            new_values, new_value_rows, new_owners = column_arrays((added_columns or {}).get(field, []), new_rows, new_codes)
+            values, value_rows, owners = merge_sorted(np.asarray(values)[kept], np.asarray(value_rows)[kept], new_values,
+                                                      new_value_rows, np.asarray(owners)[kept], new_owners)
+            columns[field] = (values, value_rows, owners)
+
+        header = {**current.header, "version": current.version + 1, "next_row": next_row + len(new_codes)}
+        return self.write(self.path, codes, rows, header, columns)
+
+
+    def __repr__(self):
+        return f"MappedActiveIndex: {len(self)} rows in {self.path}"
+
+
+    def __len__(self):
+        return len(self.rows)
+
+
+    def __contains__(self, code):
+        return self.first(code) is not None
+
+
+    @property
+    def message(self) -> str:
+        return self.header["message"]
+
+
+    @property
+    def msg_type(self) -> str:
+        return self.header["msg_type"]
+
+
+    @property
+    def version(self) -> int:
+        """ 1 when built from the active list, bumped by every apply_delta"""
+        return self.header["version"]
+
+
+    def _span(self, code) -> tuple[int, int]:
+        key = normalizer(code).encode()
+        if len(key) > self.codes.dtype.itemsize:      # Longer than any stored code, can't be there
+            return 0, 0
+        start = int(np.searchsorted(self.codes, key, side="left"))
+        end = int(np.searchsorted(self.codes, key, side="right"))
+        return start, end
+
+
+    def first(self, code) -> int | None:
+        """ Position of the first active list row holding this code, or None"""
+        start, end = self._span(code)
+        return int(self.rows[start]) if end > start else None
+
+
+    @instrument.timed("probe active index")
+    def first_many(self, codes: list) -> np.ndarray:
+        """ first() for every code in one vectorized binary search, -1 where a code isn't in the list.
+            Only the pages the search touches are read, the codes are never loaded as Python objects.
+        """
+        positions = np.full(len(codes), -1, dtype=np.int64)
+        hits, starts = search_sorted(self.codes, [normalizer(code) for code in codes])
+        positions[hits] = self.rows[starts]
+        return positions
+
+
+    def positions(self, code) -> list[int]:
+        """ Every active list row position holding this code"""
+        start, end = self._span(code)
+        return self.rows[start:end].tolist()
+
+
+    def owners(self, field: str, values: list[str]) -> dict[str, tuple[int, str]]:
+        """ ActiveIndex.owners, as one vectorized binary search over the field's mapped column"""
+        if field not in self.columns:
+            return {}
+        sorted_values, rows, owners = self.columns[field]
+        hits, starts = search_sorted(sorted_values, values)
+        return {values[i]: (int(rows[start]), owners[start].decode()) for i, start in zip(hits.tolist(), starts.tolist())}
+
+
+def encode_codes(codes: list) -> np.ndarray:
+    """ Normalized codes as fixed-width utf-8, at least one byte wide"""
+    encoded = np.array([normalizer(code).encode() for code in codes], dtype=bytes)
+    return encoded if encoded.size else encoded.astype("S1")
+
+
+def column_arrays(values: list[str], rows: np.ndarray, codes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ One other column's non-blank values sorted, with their rows and the encoded code on each, ready to write.
+        values, rows and codes are aligned. Stable, so rows sharing a value stay in file order.
+    """
+    kept = np.array([position for position, value in enumerate(values) if value], dtype=np.int64)
+    encoded = encode_codes([values[i] for i in kept])
+    order = np.argsort(encoded, kind="stable")
+    return encoded[order], rows[kept][order], codes[kept][order]
+
+
+def merge_sorted(keys: np.ndarray, rows: np.ndarray, new_keys: np.ndarray, new_rows: np.ndarray,
+                 owners: np.ndarray | None = None, new_owners: np.ndarray | None = None) -> tuple:
+    """ Insert new keys (and their rows and owners) into sorted keys, after existing entries with the same key"""
+    width = max(keys.dtype.itemsize, new_keys.dtype.itemsize)
+    keys, new_keys = keys.astype(f"S{width}"), new_keys.astype(f"S{width}")
+    order = np.argsort(new_keys, kind="stable")
+    slots = np.searchsorted(keys, new_keys[order], side="right")
+    merged = np.insert(keys, slots, new_keys[order]), np.insert(rows, slots, new_rows[order])
+    if owners is None:
+        return merged
+    owner_width = max(owners.dtype.itemsize, new_owners.dtype.itemsize)
+    return *merged, np.insert(owners.astype(f"S{owner_width}"), slots, new_owners.astype(f"S{owner_width}")[order])
+
+
+def search_sorted(keys: np.ndarray, values: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """ Binary search for every value in sorted fixed-width keys. Returns the positions in values that were found,
+        and where each was first found in keys
+    """
+    if not len(values) or not len(keys):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    encoded = [value.encode() for value in values]
+    width = keys.dtype.itemsize
+    fits = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)) <= width    # Longer values would be truncated
+    probes = np.array(encoded, dtype=f"S{width}")
+    starts = np.searchsorted(keys, probes, side="left")
+    candidates = np.flatnonzero(fits & (starts < len(keys)))
+    hits = candidates[keys[starts[candidates]] == probes[candidates]]
+    return hits, starts[hits]
+
+
+@contextmanager
+def index_lock(path):
+    """ Exclusive lock on a .lock file beside an index, held while it is read, merged and replaced.
+        Blocks until every other session and process updating the same index is done.
+    """
+    lock_path = Path(path).with_name(f"{Path(path).name}.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def aligned(offset: int) -> int:
+    return -(-offset // ALIGN_BYTES) * ALIGN_BYTES
+
+
+def is_index_file(file) -> bool:
+    """ Whether a path or file-like object holds an exported active list index rather than an xlsx"""
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file[:len(MAGIC)]) == MAGIC
+    if isinstance(file, (str, Path)):
+        with open(file, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    start = file.read(len(MAGIC))
+    file.seek(0)
+    return start == MAGIC
+
+
+def export_active_list(file, possible_names, path) -> MappedActiveIndex:
+    """ Read the code column (and ACTIVE_LIST_COLUMNS) of an active list xlsx and write it to path as a MappedActiveIndex file"""
+    codes, columns, message, msg_type = read_columns(file, possible_names, ACTIVE_LIST_COLUMNS)
+    if msg_type == "error":
+        raise ValueError(f"Couldn't read a code column from {file}: {message}")
+    return MappedActiveIndex.build(codes, path, message, msg_type, columns)
+
+
+def read_delta(file, possible_names) -> tuple[list[str], list[str]]:
+    """ Codes to add and to remove from a delta workbook: an Add sheet and/or a Remove sheet (see DELTA_SHEETS),
+        each holding the same code column as the active list.
+    """
+    expected = {normalize_header(name) for name in possible_names}
+    delta = {"added": [], "removed": []}
+    for sheet, df in pd.read_excel(file, sheet_name=None).items():
+        kind = DELTA_SHEETS.get(normalize_header(sheet))
+        if kind is None:
+            continue
+        column = next((col for col in df.columns if normalize_header(col) in expected), None)
+        if column is None:
+            raise ValueError(f"Sheet '{sheet}' has no code column, expected one of {list(possible_names)}")
+        delta[kind] += df[column].dropna().apply(normalizer).tolist()
+    return delta["added"], delta["removed"]
+
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Build and update the compact memory-mapped PLU Active List index")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write an index from a full active list")
+    export.add_argument("active", type=Path, help="PLU Active List .xlsx")
+    export.add_argument("out", type=Path, help="index file to write, e.g. active.pluidx")
+    apply = commands.add_parser("apply", help="add and retire codes from a delta workbook with Add/Remove sheets")
+    apply.add_argument("index", type=Path, help="index file to update")
+    apply.add_argument("delta", type=Path, help="delta .xlsx")
+    info = commands.add_parser("info", help="show an index's version and size")
+    info.add_argument("index", type=Path)
+    for command in (export, apply):
+        command.add_argument("--type", choices=["Product", "Clothing"], default="Product", help="code column to read")
+    args = arg_parser.parse_args()
+
+    if args.command == "export":
+        possible_names = POSSIBLE_PLU if args.type == "Product" else CLOTHING_HEADER_MAP["style_code"]
+        index = export_active_list(args.active, possible_names, args.out)
+        print(f"Wrote {len(index):,} codes to {args.out} ({args.out.stat().st_size:,} bytes), "
+              f"also indexing {', '.join(index.columns) or 'no other columns'}")
+    elif args.command == "apply":
+        possible_names = POSSIBLE_PLU if args.type == "Product" else CLOTHING_HEADER_MAP["style_code"]
+        added, removed = read_delta(args.delta, possible_names)
+        index = MappedActiveIndex(args.index).apply_delta(added, removed)
+        print(f"Added {len(added):,} and retired {len(removed):,} code(s): {len(index):,} rows, version {index.version}")
+    else:
+        index = MappedActiveIndex(args.index)
+        print(f"{index.path}: {len(index):,} rows, version {index.version}, updated {index.header['updated']}, "
+              f"columns {', '.join(f'{field} ({len(values):,})' for field, (values, _, _) in index.columns.items()) or 'none'}")
@@ -0,0 +1,300 @@
+""" Validate a whole directory of supplier uploads against one PLU Active List, without the Streamlit app.
+
+    python batch.py uploads/ --active "PLU-Active-List.xlsx" --type Product --out results/ [--workers 8] [--stream] [--csv]
+
+The active list is read and indexed once for the whole batch. --active also takes an index exported by
+active_index.py, which is mapped as it is instead of re-read. With --workers the uploads are spread over a
+process pool that shares one memory-mapped copy of the index, and results keep the sorted file order. For every upload this writes its checks
+and auto-fixes to results.json and results.csv in the output folder, plus Fixed-<name>.xlsx when auto-fixes applied:
+the upload itself with only the fixed cells rewritten, so its formatting and other sheets are kept.
+With --csv the fixed rows are written to Fixed-<name>.csv for the ERP import instead.
+With --stream each upload is read, checked and fixed in row batches, so memory stays flat on very large sheets.
+With --profile the time spent in every stage, and counters like rows and cache hits, go to profile.json per upload.
+With --pipeline the next upload is read and the last one's fixed file written while --workers uploads are checked
+(see pipeline.py). It reads each upload whole, so it can't be combined with --stream.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from parser import *
+from active_index import ActiveIndex, MappedActiveIndex, is_index_file
+from list_cache import read_columns_cached, appended_index
+from validation import FILE_TYPES
+from rules import run_rules, RuleStream
+from streaming import UploadStream, STREAM_BATCH_ROWS
+from export import fixed_workbook, fixed_csv, StreamedExport
+import instrument
+
+
+def read_active_index(path, file_type: str) -> ActiveIndex | MappedActiveIndex:
+    """ Read and index the active list once for every file in the batch: the code column and ACTIVE_LIST_COLUMNS,
+        from one parse. An exported index is mapped instead, as is the list's index in list_cache.INDEX_DIR when codes
+        were appended to it
+    """
+    if is_index_file(path):
+        return MappedActiveIndex(path)
+    _, _, possible_names, _, _ = FILE_TYPES[file_type]
+    appended = appended_index(path, possible_names)
+    if appended is not None:
+        return appended
+    codes, columns, message, msg_type = read_columns_cached(path, possible_names)
+    if msg_type == "error":
+        raise ValueError(f"Couldn't read a code column from {path}: {message}")
+    return ActiveIndex(codes, columns=columns)
+
+
+def fixed_file_path(path: Path, out_dir: Path, file_format: str) -> Path:
+    return out_dir / (f"Fixed-{path.stem}.csv" if file_format == "csv" else f"Fixed-{path.name}")
+
+
+def validate_file(path: Path, file_type: str, active_index: ActiveIndex | MappedActiveIndex, out_dir: Path | None = None,
+                  batch_rows: int | None = None, file_format: str = "xlsx") -> dict:
+    """ Run every check and auto-fix on one upload. Returns a JSON ready summary of the results.
+        With batch_rows the upload is streamed in batches of that many rows instead of read whole.
+    """
+    if batch_rows:
+        return validate_streamed(path, file_type, active_index, out_dir, batch_rows, file_format)
+    try:
+        data = path.read_bytes()
+    except OSError as e:
+        return {"file": path.name, "type": file_type, "status": "failed", "reason": f"{type(e).__name__}: {e}"}
+
+    result, fixed = validate_data(data, path.name, file_type, active_index, file_format, export=out_dir is not None)
+    if fixed is not None:
+        fixed_path = fixed_file_path(path, out_dir, file_format)
+        fixed_path.write_bytes(fixed)
+        result["fixed_file"] = fixed_path.name
+    return result
+
+
+def validate_data(data: bytes, name: str, file_type: str, active_index: ActiveIndex | MappedActiveIndex,
+                  file_format: str = "xlsx", export: bool = True) -> tuple[dict, bytes | None]:
+    """ validate_file for an upload already read into memory, which writes nothing. Returns the summary and the
+        fixed file's contents, None when no auto-fix applied or export is off.
+    """
+    *_, update_all = FILE_TYPES[file_type]
+    result = {"file": name, "type": file_type}
+    try:
+        upload = load_upload(io.BytesIO(data), file_type, name)
+        errors, rule_timings = run_rules(upload.items, active_index, file_type)
+        fixed_df, auto_changes = update_all(upload.df, upload.headers)
+    except Exception as e:
+        result.update(status="failed", reason=f"{type(e).__name__}: {e}")
+        return result, None
+
+    result.update(
+        status="passed" if not any(errors.values()) else "issues",
+        rows=len(upload.items),
+        header_row=upload.header_row,
+        column_messages=[{"type": msg_type, "message": message} for message, msg_type in upload.messages],
+        errors={title: found or [] for title, found in errors.items()},     # duplicate_barcodes returns None when clean
+        auto_fixes=auto_changes,
+        rule_timings={title: round(seconds, 6) for title, seconds in rule_timings.items()},
+    )
+
+    if not export or not any(auto_changes.values()):
+        return result, None
+    names = column_names(upload.grid.iloc[upload.header_row].tolist()) if not upload.grid.empty else None
+    if file_format == "csv":
+        return result, fixed_csv(fixed_df, names)
+    return result, fixed_workbook(data, upload.header_row, upload.df, fixed_df, names)
+
+
+def validate_streamed(path: Path, file_type: str, active_index: ActiveIndex | MappedActiveIndex, out_dir: Path | None,
+                      batch_rows: int = STREAM_BATCH_ROWS, file_format: str = "xlsx") -> dict:
+    """ validate_file for uploads too big to load whole. Only one batch of rows and the duplicate indexes are held.
+        Issues found in each batch are reported as it is checked, the fixed file is written as the batches go.
+    """
+    header_map, *_, update_all = FILE_TYPES[file_type]
+    result = {"file": path.name, "type": file_type}
+    auto_changes = {}
+    export = None
+    try:
+        upload = UploadStream(path, header_map)
+        checker = RuleStream(file_type, active_index)
+        if out_dir is not None:
+            export = StreamedExport(fixed_file_path(path, out_dir, file_format), upload.columns, file_format)
+        for batch in upload.batches(batch_rows):
+            table, _ = load_table(batch, file_type, upload.headers)
+            found = checker.feed(table)
+            fixed_batch, changes = update_all(batch, upload.headers)
+            for category, messages in changes.items():
+                auto_changes.setdefault(category, []).extend(messages)
+            if export is not None:
+                export.append(fixed_batch)
+            print(f"{path.name}: {checker.rows} rows checked, {sum(map(len, found.values()))} new issue(s)", file=sys.stderr)
+        checker.finish()
+    except Exception as e:
+        if export is not None:
+            export.discard()
+        result.update(status="failed", reason=f"{type(e).__name__}: {e}")
+        return result
+
+    errors = checker.results
+    result.update(
+        status="passed" if not any(errors.values()) else "issues",
+        rows=checker.rows,
+        header_row=upload.header_row,
+        column_messages=[{"type": msg_type, "message": message} for message, msg_type in upload.headers.messages],
+        errors={title: found or [] for title, found in errors.items()},
+        auto_fixes=auto_changes,
+        rule_timings={title: round(seconds, 6) for title, seconds in checker.timings.items()},
+    )
+
+    if export is not None and any(auto_changes.values()):
+        export.save()
+        result["fixed_file"] = export.path.name
+    elif export is not None:
+        export.discard()
+    return result
+
+
+# Set once per worker process by init_worker, so the index isn't pickled with every task
+worker_index = None
+
+
+def init_worker(index_path: str):
+    global worker_index
+    worker_index = MappedActiveIndex(index_path)
+
+
+def validate_profiled(path: Path, file_type: str, active_index: ActiveIndex | MappedActiveIndex, out_dir: Path | None,
+                      batch_rows: int | None, profile: bool, file_format: str = "xlsx") -> dict:
+    """ validate_file, with the upload's stage timings and counters under "profile" when profile is set"""
+    if not profile:
+        return validate_file(path, file_type, active_index, out_dir, batch_rows, file_format)
+    with instrument.profiling() as recorded:
+        result = validate_file(path, file_type, active_index, out_dir, batch_rows, file_format)
+    result["profile"] = recorded.as_dict()
+    return result
+
+
+def validate_in_worker(path: Path, file_type: str, out_dir: Path | None, batch_rows: int | None, profile: bool,
+                       file_format: str) -> dict:
+    return validate_profiled(path, file_type, worker_index, out_dir, batch_rows, profile, file_format)
+
+
+def shared_index_path(codes: list[str] | ActiveIndex | MappedActiveIndex, folder: Path) -> Path:
+    """ An index file worker processes can map: the exported index itself, or one built from codes in folder"""
+    if isinstance(codes, MappedActiveIndex):
+        return codes.path
+    if isinstance(codes, ActiveIndex):
+        return codes.export(folder / "active.pluidx").path
+    return MappedActiveIndex.build(codes, folder / "active.pluidx").path
+
+
+def validate_all(paths: list[Path], file_type: str, codes: list[str] | ActiveIndex | MappedActiveIndex, out_dir: Path | None,
+                 workers: int = 1, batch_rows: int | None = None, profile: bool = False, file_format: str = "xlsx"):
+    """ Yield results for every upload, in the order given. workers > 1 spreads them over a process pool"""
+    if workers <= 1:
+        active_index = codes if isinstance(codes, (ActiveIndex, MappedActiveIndex)) else ActiveIndex(codes)
+        for path in paths:
+            yield validate_profiled(path, file_type, active_index, out_dir, batch_rows, profile, file_format)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="plu-index-") as index_folder:
+        index_path = shared_index_path(codes, Path(index_folder))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(str(index_path),)) as pool:
+            yield from pool.map(validate_in_worker, paths, [file_type] * len(paths), [out_dir] * len(paths),
+                                [batch_rows] * len(paths), [profile] * len(paths), [file_format] * len(paths))
+
+
+def write_results(results: list[dict], out_dir: Path):
+    """ results.json holds everything, results.csv has one row per error or auto-fix"""
+    with open(out_dir / "results.json", "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+
+    with open(out_dir / "results.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "status", "kind", "category", "message"])
+        for result in results:
+            if result["status"] == "failed":
+                writer.writerow([result["file"], "failed", "failure", "", result["reason"]])
+                continue
+            rows_written = 0
+            for kind, groups in (("error", result["errors"]), ("auto_fix", result["auto_fixes"])):
+                for category, messages in groups.items():
+                    for message in messages:
+                        writer.writerow([result["file"], result["status"], kind, category, message])
+                        rows_written += 1
+            if not rows_written:
+                writer.writerow([result["file"], result["status"], "", "", ""])
+
+
+def write_profile(results: list[dict], setup: instrument.Profile, out_dir: Path):
+    """ profile.json: the active list read, each upload's profile, and every profile added up.
+        Moves each profile out of its result, so results.json stays the same with or without --profile.
+    """
+    total = instrument.Profile()
+    total.merge(setup.as_dict())
+    uploads = {}
+    for result in results:
+        if "profile" in result:
+            uploads[result["file"]] = result.pop("profile")
+            total.merge(uploads[result["file"]])
+    with open(out_dir / "profile.json", "w", encoding="utf-8") as f:
+        json.dump({"active_list": setup.as_dict(), "uploads": uploads, "total": total.as_dict()}, f, indent=2)
+
+
+def upload_paths(folder: Path) -> list[Path]:
+    """ Every xlsx upload in the folder, skipping Excel lock files and our own fixed copies"""
+    return sorted(
+        path for path in folder.glob("*.xlsx")
+        if not path.name.startswith(("~$", "Fixed-"))
+    )
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("uploads", type=Path, help="folder of supplier .xlsx uploads")
+    arg_parser.add_argument("--active", type=Path, required=True, help="PLU Active List .xlsx, or an index exported by active_index.py")
+    arg_parser.add_argument("--type", choices=list(FILE_TYPES), default="Product", help="file type of every upload")
+    arg_parser.add_argument("--out", type=Path, default=Path("results"), help="folder for results and fixed files")
+    arg_parser.add_argument("--workers", type=int, default=1, help="processes to validate uploads in (default 1)")
+    arg_parser.add_argument("--stream", type=int, nargs="?", const=STREAM_BATCH_ROWS, metavar="ROWS",
+                            help=f"read each upload in batches of ROWS rows (default {STREAM_BATCH_ROWS}) to bound memory")
+    arg_parser.add_argument("--profile", action="store_true", help="write stage timings and counters to profile.json")
+    arg_parser.add_argument("--csv", action="store_true", help="write fixed files as CSV for the ERP import instead of xlsx")
+    arg_parser.add_argument("--pipeline", action="store_true",
+                            help="overlap reading, checking and writing uploads, checking --workers at once")
+    args = arg_parser.parse_args(argv)
+    if args.pipeline and args.stream:
+        arg_parser.error("--pipeline reads each upload whole, it can't be combined with --stream")
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    with instrument.profiling() as setup:
+        codes = read_active_index(args.active, args.type)
+
+    file_format = "csv" if args.csv else "xlsx"
+    paths = upload_paths(args.uploads)
+
+    def report(result: dict):
+        print(f"{result['status']:<7} {result['file']}", file=sys.stderr)
+
+    if args.pipeline:
+        from pipeline import validate_pipelined
+        results = validate_pipelined(paths, args.type, codes, args.out, max(args.workers, 1), file_format=file_format,
+                                     profile=args.profile, on_result=report)
+    else:
+        results = []
+        for result in validate_all(paths, args.type, codes, args.out, args.workers, args.stream, args.profile, file_format):
+            results.append(result)
+            report(result)
+
+    if args.profile:
+        write_profile(results, setup, args.out)
+    write_results(results, args.out)
+    counts = Counter(result["status"] for result in results)
+    print(f"{len(results)} file(s): {counts['passed']} passed, {counts['issues']} with issues, {counts['failed']} failed. "
+          f"Results in {args.out}", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+""" Cold import time of every core module, each in a fresh interpreter, checked against a budget.
+
+    Run from the repo root:  python -m benchmarks.bench_import [--headroom 0.1] [--repeat 5]
+
+A batch worker or script pays this on every start. Times come from python -X importtime, the fastest of --repeat runs.
+Every module needs pandas, so the budget is a bare import pandas, timed the same way on this machine, plus --headroom.
+Exits 1 when a module is over budget, or when importing it loads a package the core must not need: Streamlit is only
+for interface.py, and openpyxl is imported by the functions that open or write a workbook.
+"""
+import argparse
+import subprocess
+import sys
+
+CORE_MODULES = (
+    "instrument", "tools", "active_index", "item_table", "product_class", "clothing_class", "fix_engine",
+    "fix_products", "fix_clothing", "parser", "rules", "validation", "streaming", "export", "list_cache",
+    "batch", "pipeline", "service",
+)
+FORBIDDEN = ("streamlit", "tornado", "openpyxl", "doctest")
+
+
+def import_profile(module: str) -> tuple[float, dict[str, float]]:
+    """ Seconds to import module in a new interpreter, and the cumulative seconds of every module that loaded"""
+    run = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, text=True, check=True)
+    loaded = {}
+    for line in run.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        loaded[name.strip()] = int(cumulative) / 1e6
+    return loaded[module], loaded
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--headroom", type=float, default=0.1,
+                            help="seconds any one module may take to import beyond a bare import pandas")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module, the fastest is kept")
+    arg_parser.add_argument("modules", nargs="*", default=CORE_MODULES, help="modules to time (default: the core)")
+    args = arg_parser.parse_args()
+
+    baseline = min(import_profile("pandas")[0] for _ in range(args.repeat))
+    budget = baseline + args.headroom
+    print(f"Budget {budget:.3f}s: import pandas {baseline:.3f}s + {args.headroom}s headroom")
+
+    failures = []
+    print(f"{'module':<16} {'seconds':>8}   heaviest packages")
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.repeat)]
+        seconds, loaded = min(runs, key=lambda run: run[0])
+        packages = {name: cumulative for name, cumulative in loaded.items() if "." not in name and name != module}
+        heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:3]
+        print(f"{module:<16} {seconds:8.3f}   " + ", ".join(f"{name} {cumulative:.3f}" for name, cumulative in heaviest))
+
+        forbidden = sorted({name.split(".")[0] for name in loaded} & set(FORBIDDEN))
+        if forbidden:
+            failures.append(f"{module} imports {', '.join(forbidden)}")
+        if seconds > budget:
+            failures.append(f"{module} took {seconds:.3f}s, over the {budget:.3f}s budget")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    print(f"{len(args.modules) - len({failure.split()[0] for failure in failures})}/{len(args.modules)} modules within budget",
+          file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
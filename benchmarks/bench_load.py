@@ -0,0 +1,48 @@
+""" Rows/sec of building Product/Clothing objects from a loaded DataFrame: the old iterrows path vs item_columns.
+
+    Run from the repo root:  python -m benchmarks.bench_load [--rows 100000]
+"""
+import argparse
+import time
+
+from benchmarks.synthetic import product_frame, clothing_frame, normalized
+from parser import load_products, load_clothing, find_column
+from product_class import Product
+from clothing_class import Clothing
+from tools import PRODUCT_HEADER_MAP, CLOTHING_HEADER_MAP
+
+
+def iterrows_build(df, header_map, cls):
+    """ The row-by-row construction load_products/load_clothing used before item_columns"""
+    col_map = {key: find_column(df, names)[0] for key, names in header_map.items()}
+    items = []
+    for idx, row in df.iterrows():
+        items.append(cls(*(row.get(col) for col in col_map.values()), idx=idx + 2))
+    return items
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=100_000)
+    args = arg_parser.parse_args()
+
+    cases = [
+        ("Product", normalized(product_frame(args.rows)), PRODUCT_HEADER_MAP, Product, load_products),
+        ("Clothing", normalized(clothing_frame(args.rows)), CLOTHING_HEADER_MAP, Clothing, load_clothing),
+    ]
+    for name, df, header_map, cls, loader in cases:
+        before, before_time = timed(iterrows_build, df, header_map, cls)
+        (after, _), after_time = timed(loader, df)
+        assert len(before) == len(after)
+        print(f"{name:<9} {args.rows} rows | iterrows {args.rows / before_time:>12,.0f} rows/s "
+              f"| columnar {args.rows / after_time:>12,.0f} rows/s | {before_time / after_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
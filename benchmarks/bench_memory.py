@@ -0,0 +1,63 @@
+""" Bytes per item held by Product/Clothing objects: per-instance __dict__ (before) vs __slots__ (after).
+    The old bad_char called vars() on every item, which materializes each instance dict, so that is measured too.
+
+    Run from the repo root:  python -m benchmarks.bench_memory [--rows 100000]
+"""
+import argparse
+import tracemalloc
+
+from benchmarks.synthetic import product_frame, clothing_frame, normalized
+from parser import item_columns
+from product_class import Product
+from clothing_class import Clothing
+from tools import PRODUCT_HEADER_MAP, CLOTHING_HEADER_MAP, HeaderResolution
+
+
+def dict_backed(cls):
+    """ Same constructor as cls but storing attributes in a __dict__, like the classes did before __slots__"""
+    return type(f"Dict{cls.__name__}", (), {"__init__": cls.__init__})
+
+
+def allocated(build):
+    """ Bytes still allocated after build() runs, and its result"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=100_000)
+    args = arg_parser.parse_args()
+
+    cases = [
+        ("Product", normalized(product_frame(args.rows)), PRODUCT_HEADER_MAP, Product),
+        ("Clothing", normalized(clothing_frame(args.rows)), CLOTHING_HEADER_MAP, Clothing),
+    ]
+    for name, df, header_map, cls in cases:
+        columns = item_columns(df, HeaderResolution(df, header_map).columns)       # Values are shared by every variant, so only the containers are measured
+        lines = (df.index + 2).tolist()
+
+        def build(item_cls, materialize=False):
+            items = [item_cls(*values, idx=line) for *values, line in zip(*columns.values(), lines)]
+            if materialize:
+                for item in items:
+                    vars(item)
+            return items
+
+        results = {}
+        for label, item_cls, materialize in [("__dict__", dict_backed(cls), False),
+                                             ("__dict__ after vars()", dict_backed(cls), True),
+                                             ("__slots__", cls, False)]:
+            size, items = allocated(lambda: build(item_cls, materialize))
+            results[label] = size / len(items)
+            del items
+
+        print(f"{name:<9} {args.rows} rows | " + " | ".join(f"{label} {per_item:,.0f} B/item" for label, per_item in results.items()))
+
+
+if __name__ == "__main__":
+    main()
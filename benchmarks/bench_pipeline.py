@@ -0,0 +1,163 @@
+""" Seconds per stage of the whole validation pipeline on synthetic supplier workbooks, written as JSON.
+
+    Run from the repo root:  python -m benchmarks.bench_pipeline [--type Clothing] [--rows 50000] [--out run.json]
+    Compare two runs, e.g. from two commits:  python -m benchmarks.bench_pipeline --compare before.json after.json
+
+Every stage is run --repeat times and its fastest time is kept. The workbooks are generated once per run (not timed)
+from the options below, so two runs with the same options time the same files.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from benchmarks.synthetic import product_frame, clothing_frame, supplier_sheet, active_list_frame, write_workbook
+from active_index import ActiveIndex
+from export import fixed_workbook, fixed_csv
+from parser import detect_header_row, frame_from_grid, column_names, load_products, load_clothing
+from rules import run_rules
+from tools import HeaderResolution, normalize_header, read_columns, ACTIVE_LIST_COLUMNS
+from validation import FILE_TYPES
+
+
+def git_commit() -> str | None:
+    """ Short hash of the checked out commit, with "-dirty" when the tree has changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def generate(args, folder: Path) -> tuple[Path, Path]:
+    """ Write the upload and active list workbooks the options describe. Returns their paths"""
+    if args.type == "Product":
+        df = product_frame(args.rows, args.duplicate_rate, args.seed, args.barcode_rate)
+        code_column = "PLU Code"
+    else:
+        df = clothing_frame(args.rows, args.duplicate_rate, args.seed, args.barcode_rate or 0.0)
+        code_column = "Style Code"
+    active = active_list_frame(args.active_size, df[code_column], args.active_overlap, args.seed, code_column, df["Barcode"])
+    upload_path, active_path = folder / "upload.xlsx", folder / "active.xlsx"
+    write_workbook(supplier_sheet(df, args.columns, args.messy, args.seed), upload_path, args.header_offset)
+    write_workbook(active, active_path)
+    return upload_path, active_path
+
+
+def run_stages(file_type: str, upload_path: Path, active_path: Path) -> tuple[dict[str, float], dict]:
+    """ One pass of every stage, the way interface.py runs them. Returns seconds per stage and result counts"""
+    header_map, _, possible_names, _, update_all = FILE_TYPES[file_type]
+    loader = load_products if file_type == "Product" else load_clothing
+    expected_headers = [name for names in header_map.values() for name in names]
+    timings = {}
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    grid = timed("read workbook", pd.read_excel, upload_path, header=None)
+    header_row = timed("header detection", detect_header_row, grid, expected_headers)
+    df = timed("frame", frame_from_grid, grid, header_row)
+    df.columns = [normalize_header(c) for c in df.columns]
+    headers = timed("header resolution", HeaderResolution, df, header_map)
+    items, _ = timed("load items", loader, df, headers)
+    codes, columns, _, _ = timed("active list read", read_columns, active_path, possible_names, ACTIVE_LIST_COLUMNS)
+    active_index = timed("active list index", ActiveIndex, codes, columns=columns)
+
+    start = time.perf_counter()
+    results, rule_timings = run_rules(items, active_index, file_type)
+    timings["checks"] = time.perf_counter() - start
+    timings.update({f"check: {title}": seconds for title, seconds in rule_timings.items()})
+
+    fixed_df, auto_changes = timed("auto-fix", update_all, df, headers)
+    names = column_names(grid.iloc[header_row].tolist())
+    timed("excel export", fixed_workbook, upload_path.read_bytes(), header_row, df, fixed_df, names)
+    timed("csv export", fixed_csv, fixed_df, names)
+
+    counts = {
+        "header_row": int(header_row),
+        "items": len(items),
+        "active_codes": len(codes),
+        "errors": {title: len(found or []) for title, found in results.items()},
+        "auto_fixes": {category: len(changes) for category, changes in auto_changes.items()},
+    }
+    return timings, counts
+
+
+def benchmark(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="plu-bench-") as folder:
+        upload_path, active_path = generate(args, Path(folder))
+        runs = []
+        for _ in range(args.repeat):
+            timings, counts = run_stages(args.type, upload_path, active_path)
+            runs.append(timings)
+
+    options = {name: value for name, value in vars(args).items() if name not in ("out", "compare")}
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                        "openpyxl": openpyxl.__version__, "platform": platform.platform()},
+        "options": options,
+        "counts": counts,
+        "stages": {stage: min(run[stage] for run in runs) for stage in runs[0]},
+        "runs": runs,
+    }
+
+
+def compare(before_path: Path, after_path: Path):
+    """ Print both runs' stage times side by side, with after as a multiple of before"""
+    before, after = (json.loads(Path(path).read_text()) for path in (before_path, after_path))
+    if before["options"] != after["options"]:
+        print("Warning: the runs used different options, their times aren't comparable", file=sys.stderr)
+    if before["counts"] != after["counts"]:
+        print("Warning: the runs found different errors or fixes", file=sys.stderr)
+    print(f"{'stage':<60} {before['commit'] or 'before':>14} {after['commit'] or 'after':>14}   ratio")
+    for stage in dict.fromkeys([*before["stages"], *after["stages"]]):
+        old, new = before["stages"].get(stage), after["stages"].get(stage)
+        ratio = f"{new / old:6.2f}x" if old and new is not None else ""
+        print(f"{stage:<60} {'' if old is None else f'{old:.4f}':>14} {'' if new is None else f'{new:.4f}':>14}   {ratio}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--type", choices=list(FILE_TYPES), default="Product")
+    arg_parser.add_argument("--rows", type=int, default=20_000, help="upload rows")
+    arg_parser.add_argument("--columns", type=int, default=None, help="upload columns: the template's first N, or padded with filler")
+    arg_parser.add_argument("--header-offset", type=int, default=0, help="title and blank rows above the headers (under 10)")
+    arg_parser.add_argument("--messy", type=float, default=0.0, help="share of headers with supplier spellings")
+    arg_parser.add_argument("--duplicate-rate", type=float, default=0.01, help="share of rows repeating another row's code")
+    arg_parser.add_argument("--barcode-rate", type=float, default=None, help="share of rows reusing another row's barcode")
+    arg_parser.add_argument("--active-size", type=int, default=100_000, help="active list rows")
+    arg_parser.add_argument("--active-overlap", type=float, default=0.01, help="share of upload codes already in the active list")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs of every stage, the fastest is kept")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--out", type=Path, default=None, help="JSON file to write, printed when not given")
+    arg_parser.add_argument("--compare", type=Path, nargs=2, metavar=("BEFORE", "AFTER"), help="compare two JSON runs instead")
+    args = arg_parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = json.dumps(benchmark(args), indent=2)
+    if args.out:
+        args.out.write_text(result)
+        print(f"Wrote {args.out}", file=sys.stderr)
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+""" Uploads per second through batch.validate_all one at a time, the process pool, and the asyncio pipeline.
+
+    Run from the repo root:  python -m benchmarks.bench_throughput [--files 16] [--rows 5000] [--concurrency 1 2 4]
+
+Every mode validates the same generated uploads against the same active list and writes its fixed files to its own
+folder. Their results must match the sequential run's (rule timings aside), or the benchmark fails.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_pipeline import git_commit
+from benchmarks.synthetic import product_frame, clothing_frame, supplier_sheet, active_list_frame, write_workbook
+from batch import validate_all
+from pipeline import validate_pipelined, DEFAULT_QUEUE_SIZE
+
+
+def generate(args, folder: Path) -> tuple[list[Path], list[str]]:
+    """ --files uploads with different codes and fixes, and the active list codes. Returns the upload paths and codes"""
+    code_column = "PLU Code" if args.type == "Product" else "Style Code"
+    frames = [
+        (product_frame if args.type == "Product" else clothing_frame)(args.rows, seed=seed)
+        for seed in range(args.files)
+    ]
+    paths = []
+    for seed, df in enumerate(frames):
+        paths.append(folder / f"upload-{seed:03}.xlsx")
+        write_workbook(supplier_sheet(df, seed=seed), paths[-1], header_offset=seed % 3)
+    active = active_list_frame(args.active_size, frames[0][code_column], seed=args.files, column=code_column)
+    return paths, active[code_column].astype(str).tolist()
+
+
+def comparable(results: list[dict]) -> list[dict]:
+    return [{key: value for key, value in result.items() if key != "rule_timings"} for result in results]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--type", choices=["Product", "Clothing"], default="Product")
+    arg_parser.add_argument("--files", type=int, default=16, help="uploads in the batch")
+    arg_parser.add_argument("--rows", type=int, default=5000, help="rows per upload")
+    arg_parser.add_argument("--active-size", type=int, default=100_000, help="active list rows")
+    arg_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4], help="workers to try")
+    arg_parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE_SIZE, help="pipeline queue size")
+    arg_parser.add_argument("--out", type=Path, default=None, help="JSON file for the results")
+    args = arg_parser.parse_args()
+
+    runs = {}
+    with tempfile.TemporaryDirectory(prefix="plu-throughput-") as folder:
+        folder = Path(folder)
+        paths, codes = generate(args, folder)
+        modes = [("sequential", 1, lambda out: list(validate_all(paths, args.type, codes, out)))]
+        for workers in args.concurrency:
+            if workers > 1:
+                modes.append((f"process pool x{workers}", workers,
+                              lambda out, workers=workers: list(validate_all(paths, args.type, codes, out, workers))))
+            modes.append((f"pipeline x{workers}", workers,
+                          lambda out, workers=workers: validate_pipelined(paths, args.type, codes, out, workers, args.queue)))
+
+        expected = None
+        print(f"{len(paths)} uploads x {args.rows} rows, {os.cpu_count()} CPUs", file=sys.stderr)
+        print(f"{'mode':<20} {'seconds':>8} {'files/s':>8} {'rows/s':>10}   speedup")
+        for name, workers, run in modes:
+            out = folder / name.replace(" ", "-")
+            out.mkdir()
+            start = time.perf_counter()
+            results = run(out)
+            seconds = time.perf_counter() - start
+
+            if expected is None:
+                expected = comparable(results)
+            elif comparable(results) != expected:
+                sys.exit(f"{name} gave different results from the sequential run")
+            runs[name] = {"workers": workers, "seconds": round(seconds, 4), "files_per_second": round(len(paths) / seconds, 3),
+                          "rows_per_second": round(len(paths) * args.rows / seconds)}
+            speedup = runs["sequential"]["seconds"] / seconds
+            print(f"{name:<20} {seconds:8.2f} {len(paths) / seconds:8.2f} {len(paths) * args.rows / seconds:10.0f}   {speedup:.2f}x")
+
+    if args.out:
+        options = {name: value for name, value in vars(args).items() if name != "out"}
+        args.out.write_text(json.dumps({"commit": git_commit(), "cpus": os.cpu_count(), "options": options, "runs": runs},
+                                       indent=2, default=str))
+        print(f"Wrote {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
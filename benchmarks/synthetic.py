@@ -0,0 +1,159 @@
+""" Synthetic supplier sheets for benchmarking. Headers follow the template spreadsheets."""
+import numpy as np
+import pandas as pd
+
+
+PRODUCT_TEMPLATE = ["PLU Code", "Description", "Subgroup", "3 Digit Supplier", "Season", "Main Supplier",
+                    "Cost Price", "Barcode", "VAT Rate", "RRP", "Selling Price", "STG Price", "Tarriff Code", "Web"]
+
+CLOTHING_TEMPLATE = ["Style Code", "Description", "Size", "Colour", "Subgroup", "Supplier Code", "Season",
+                     "Main Supplier", "Cost Price", "Barcode", "VAT Rate", "RRP", "Selling Price", "STG Retail Price",
+                     "Tariff", "Brand In Store", "Product Type", "Web", "Country of Origin", "Country Code"]
+
+
+# Ways suppliers misspell template headers. All of them still resolve: exactly once normalized, or by char_match
+HEADER_SPELLINGS = [
+    str.upper,
+    str.lower,
+    lambda name: name.replace(" ", "_"),
+    lambda name: name.replace(" ", "-"),
+    lambda name: f" {name}  ",
+    lambda name: name[:1] + name[2:3] + name[1:2] + name[3:] if len(name) > 3 else name,   # Two letters swapped
+]
+
+
+def product_frame(rows: int, duplicate_rate: float = 0.01, seed: int = 0, barcode_rate: float | None = None) -> pd.DataFrame:
+    """ Product upload with a share of repeated PLU codes and barcodes.
+        barcode_rate is the share of rows reusing another row's barcode, by default the rows with a repeated code.
+    """
+    rng = np.random.default_rng(seed)
+    codes = np.arange(100000, 100000 + rows)
+    repeats = rng.random(rows) < duplicate_rate
+    codes[repeats] = rng.choice(codes, repeats.sum())
+    cost = rng.uniform(0.5, 50, rows).round(3)
+    barcodes = np.where(repeats, 5000000000000, 5000000000000 + np.arange(rows))
+    if barcode_rate is not None:
+        barcodes = colliding_barcodes(5000000000000, rows, barcode_rate, rng)
+
+    return pd.DataFrame({
+        "PLU Code": codes,
+        "Description": [f"Item {i}, size {i % 7}" if i % 25 == 0 else f"Item {i}" for i in range(rows)],
+        "Subgroup": rng.choice(["GARDEN", "HOME", "PETS"], rows),
+        "3 Digit Supplier": "ABC",
+        "Season": "SS25",
+        "Main Supplier": "Supplier Ltd",
+        "Cost Price": cost,
+        "Barcode": barcodes,
+        "VAT Rate": rng.choice([0.0, 13.5, 23.0], rows),
+        "RRP": (cost * 2.5).round(2),
+        "Selling Price": (cost * 2.2).round(2),
+        "STG Price": (cost * 2).round(2),
+        "Tarriff Code": "0602",
+        "Web": rng.choice(["Y", "N"], rows),
+    })[PRODUCT_TEMPLATE]
+
+
+def clothing_frame(rows: int, duplicate_rate: float = 0.01, seed: int = 0, barcode_rate: float = 0.0) -> pd.DataFrame:
+    """ Clothing upload with three sizes per style and a share of repeated style/size/colour rows.
+        barcode_rate is the share of rows reusing another row's barcode.
+    """
+    rng = np.random.default_rng(seed)
+    styles = np.array([f"ST{i // 3:07d}" for i in range(rows)])
+    sizes = np.array(["S", "M", "L"])[np.arange(rows) % 3]
+    repeats = rng.random(rows) < duplicate_rate
+    styles[repeats] = styles[np.maximum(np.flatnonzero(repeats) - 3, 0)]
+    cost = rng.uniform(2, 80, rows).round(3)
+    barcodes = 6000000000000 + np.arange(rows)
+    if barcode_rate:
+        barcodes = colliding_barcodes(6000000000000, rows, barcode_rate, rng)
+
+    return pd.DataFrame({
+        "Style Code": styles,
+        "Description": [f"Shirt {i}" for i in range(rows)],
+        "Size": sizes,
+        "Colour": rng.choice(["Red", "Navy", "Forest Green Check"], rows),
+        "Subgroup": "TOPS",
+        "Supplier Code": "XYZ",
+        "Season": "AW25",
+        "Main Supplier": "Clothing Ltd",
+        "Cost Price": cost,
+        "Barcode": barcodes,
+        "VAT Rate": 23.0,
+        "RRP": (cost * 2.5).round(2),
+        "Selling Price": (cost * 2.2).round(2),
+        "STG Retail Price": (cost * 2).round(2),
+        "Tariff": "6205",
+        "Brand In Store": "House",
+        "Product Type": "Shirt",
+        "Web": "Y",
+        "Country of Origin": "Ireland",
+        "Country Code": "IE",
+    })[CLOTHING_TEMPLATE]
+
+
+def colliding_barcodes(start: int, rows: int, rate: float, rng) -> np.ndarray:
+    """ Consecutive barcodes, with a share of rows reusing the barcode of another row"""
+    barcodes = start + np.arange(rows)
+    collide = rng.random(rows) < rate
+    if collide.any():
+        barcodes[collide] = rng.choice(barcodes, collide.sum())
+    return barcodes
+
+
+def supplier_sheet(df: pd.DataFrame, columns: int | None = None, messy: float = 0.0, seed: int = 0) -> pd.DataFrame:
+    """ Template frame as a supplier sends it: cut to its first columns columns (the code and description columns
+        come first) or padded with filler columns, and a share (messy) of headers respelled like HEADER_SPELLINGS.
+    """
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    if columns is not None:
+        df = df.iloc[:, :columns]
+        for extra in range(len(df.columns), columns):
+            df[f"Extra {extra + 1}"] = f"filler {extra}"
+    respell = rng.random(len(df.columns)) < messy
+    spellings = rng.integers(len(HEADER_SPELLINGS), size=len(df.columns))
+    df.columns = [HEADER_SPELLINGS[s](name) if r else name for name, r, s in zip(df.columns, respell, spellings)]
+    return df
+
+
+def active_list_frame(size: int, upload_codes, overlap: float = 0.01, seed: int = 0, column: str = "PLU Code",
+                      upload_barcodes=None) -> pd.DataFrame:
+    """ Active list of size rows holding a share (overlap) of upload_codes, which the upload then reports as
+        already in the system. The other codes never clash with the upload's.
+        Every row has a barcode and supplier code. With upload_barcodes, the same share of rows owns one of them,
+        which the upload then reports as already in the catalogue.
+    """
+    rng = np.random.default_rng(seed)
+    upload_codes = pd.unique(np.asarray(upload_codes))
+    clashing = rng.choice(upload_codes, min(int(len(upload_codes) * overlap), size), replace=False)
+    others = size - len(clashing)
+    if upload_codes.dtype.kind in "iu":
+        fresh = 90_000_000 + np.arange(others)
+    else:
+        fresh = np.array([f"AL{i:08d}" for i in range(others)], dtype=object)
+    codes = np.concatenate([fresh, clashing])
+    rng.shuffle(codes)
+
+    barcodes = 7000000000000 + np.arange(size)
+    if upload_barcodes is not None:
+        upload_barcodes = pd.unique(np.asarray(upload_barcodes))
+        taken = rng.choice(upload_barcodes, min(int(len(upload_barcodes) * overlap), size), replace=False)
+        barcodes[rng.choice(size, len(taken), replace=False)] = taken
+    suppliers = np.array([f"S{i:02d}" for i in range(50)], dtype=object)[rng.integers(0, 50, size)]
+    return pd.DataFrame({column: codes, "Description": "Active item", "Barcode": barcodes, "3 Digit Supplier": suppliers})
+
+
+def write_workbook(df: pd.DataFrame, path, header_offset: int = 0):
+    """ Save df as an xlsx with header_offset rows above its headers: a title, then blank rows"""
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, startrow=header_offset)
+        if header_offset:
+            writer.sheets["Sheet1"]["A1"] = "Supplier price file"
+
+
+def normalized(df: pd.DataFrame) -> pd.DataFrame:
+    """ Same header normalization read_upload applies"""
+    from tools import normalize_header
+    df = df.copy()
+    df.columns = [normalize_header(c) for c in df.columns]
+    return df
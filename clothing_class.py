@@ -1,12 +1,16 @@
 from decimal import Decimal
 from collections import Counter, defaultdict
-import streamlit as st
 from tools import *
 
 
 
 
 class Clothing:
+    # Slots instead of a per-instance __dict__, see Product. Use tools.item_fields(item) in place of vars(item).
+    __slots__ = ("style_code", "description", "size", "colour", "subgroup", "supplier_code", "season",
+                 "main_supplier", "cost", "barcode", "vat_rate", "rrp", "sell_price", "stg_price", "tarriff",
+                 "brand", "product_type", "web", "country", "country_code", "excel_line")
+
     def __init__(self, code, description, size, colour, subgroup, supplier_code, season, 
                  main_supplier, cost_price, barcode, vat_rate, rrp, sell_price, stg_price, 
                  tarriff, brand, product_type, web, country, country_code, idx=None):
@@ -46,7 +50,7 @@ class Clothing:
     def style_len(self):
         """ Checks if any products have a style code length over 12"""
         if len(str(self.style_code)) > 12:
-            return f"Line {self.excel_line} \u00A0\u00A0|\u00A0\u00A0 Clothing item: {self.style_code} has Style Code length of {len(str(self.style_code))}. Must be under 10."
+            return style_len_message(self.style_code, self.excel_line)
             # print(f"Product: {self.style_code} has Style Code length of {len(str(self.style_code))}. Must be under 12.")
             # st.write(f"Product: {self.style_code} has Style Code length of {len(str(self.style_code))}. Must be under 12.")
 
@@ -72,7 +76,11 @@ class Clothing:
     #             # st.write(f"Product: {self.plu_code} has description length of {len(str(self.plu_code))}. Must be under 15.")
 
 
+def style_len_message(code, line) -> str:
+    return f"Line {line} \u00A0\u00A0|\u00A0\u00A0 Clothing item: {code} has Style Code length of {len(str(code))}. Must be under 10."
 
 
-
-
+def style_len_errors(table) -> list[str]:
+    """ Clothing.style_len run over the whole style_code column of an ItemTable"""
+    codes = table.column("style_code")
+    return [style_len_message(codes[i], table.lines[i]) for i in table.length_over("style_code", 12)]
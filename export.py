@@ -0,0 +1,238 @@
+""" The auto-fixed upload as a file to download or import.
+
+DataFrame.to_excel writes every cell again through openpyxl and drops the supplier's formatting, title rows and other
+sheets. patch_workbook instead copies the original xlsx and rewrites only the cells the auto-fixes changed, straight
+in the first sheet's XML. Rows without a change are copied as they are, every other part of the file byte for byte.
+When a sheet can't be patched safely the fixed DataFrame goes to a streaming write-only workbook instead.
+openpyxl is only imported by the functions that need it, so a CSV export never loads it.
+fixed_csv is the cheapest output of all, for the ERP import. StreamedExport writes either one batch at a time.
+"""
+import csv
+import io
+import os
+import posixpath
+import re
+import zipfile
+from collections import defaultdict
+from pathlib import Path
+from xml.sax.saxutils import escape
+import numpy as np
+import pandas as pd
+import instrument
+
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIME = "text/csv"
+
+ROW_PATTERN = re.compile(rb"<row\b([^>]*?)(/>|>(.*?)</row>)", re.S)
+CELL_PATTERN = re.compile(rb"<c\b([^>]*?)(/>|>(.*?)</c>)", re.S)
+CELL_STYLE = re.compile(rb'\bs="\d+"')
+RELATIONSHIP = re.compile(rb"<Relationship\b[^>]*/>")
+ATTRIBUTE = re.compile(rb'\b(Id|Type|Target)="([^"]*)"')
+SHEET_ID = re.compile(rb'<sheet\b[^>]*\br:id="([^"]+)"')
+
+
+def frame_rows(df: pd.DataFrame) -> list[list]:
+    """ DataFrame rows as plain values for an openpyxl sheet, blanks as empty cells"""
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+def changed_cells(df: pd.DataFrame, fixed_df: pd.DataFrame, header_row: int) -> dict[int, dict[int, object]]:
+    """ Excel row -> {Excel column number: fixed value} for every cell the fixes changed.
+        df is read_upload's DataFrame, whose row i is sheet row header_row + i + 2 and column j sheet column j + 1.
+    """
+    if df.shape != fixed_df.shape:
+        raise ValueError(f"Fixed data is {fixed_df.shape}, the upload {df.shape}")
+    changes = defaultdict(dict)
+    for position in range(df.shape[1]):
+        before = df.iloc[:, position].to_numpy(dtype=object)
+        after = fixed_df.iloc[:, position].to_numpy(dtype=object)
+        same = (before == after) | (pd.isna(before) & pd.isna(after))
+        for i in np.flatnonzero(~same).tolist():
+            changes[header_row + i + 2][position + 1] = after[i]
+    return changes
+
+
+def cell_xml(ref: bytes, style: bytes, value) -> bytes:
+    """ One <c> element holding value, keeping the original cell's style. Text is written inline,
+        so the shared strings table doesn't change.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return b'<c r="%s"%s/>' % (ref, style)
+    if isinstance(value, bool):
+        return b'<c r="%s"%s t="b"><v>%d</v></c>' % (ref, style, value)
+    if isinstance(value, (int, float)):
+        if not np.isfinite(value):
+            raise ValueError(f"{value} can't be written to a cell")
+        return b'<c r="%s"%s><v>%s</v></c>' % (ref, style, repr(value).encode())
+    if isinstance(value, str):
+        space = b' xml:space="preserve"' if value != value.strip() else b""
+        return b'<c r="%s"%s t="inlineStr"><is><t%s>%s</t></is></c>' % (ref, style, space, escape(value).encode("utf-8"))
+    raise TypeError(f"Can't patch a {type(value).__name__} value into the sheet")
+
+
+def patch_row(body: bytes, row_number: int, changes: dict[int, object]) -> tuple[bytes, bool]:
+    """ The row's cells with the changed ones rewritten. Also says whether a formula was overwritten.
+        Each changed cell is found by its reference, the rest of the row is never parsed.
+    """
+    from openpyxl.utils import get_column_letter
+    formulas = False
+    for column, value in changes.items():
+        ref = b"%s%d" % (get_column_letter(column).encode(), row_number)
+        at = body.find(b' r="%s"' % ref)
+        match = CELL_PATTERN.match(body, body.rfind(b"<c", 0, at)) if at >= 0 else None
+        if match is None:
+            raise ValueError(f"Cell {ref.decode()} isn't in the sheet")
+        content = match.group(3) or b""
+        if b"<f" in content:
+            if b"ref=" in content:
+                raise ValueError(f"Cell {ref.decode()} holds a shared or array formula")
+            formulas = True
+        style = CELL_STYLE.search(match.group(1))
+        body = body[:match.start()] + cell_xml(ref, b" " + style.group(0) if style else b"", value) + body[match.end():]
+    return body, formulas
+
+
+def first_sheet_part(book: zipfile.ZipFile) -> str:
+    """ Zip path of the first worksheet, the one pd.read_excel reads"""
+    def relationships(path: str) -> list[dict[bytes, str]]:
+        xml = book.read(path)
+        return [
+            {key: value.decode() for key, value in ATTRIBUTE.findall(element)}
+            for element in RELATIONSHIP.findall(xml)
+        ]
+
+    workbook_path = next(rel[b"Target"] for rel in relationships("_rels/.rels") if rel[b"Type"].endswith("/officeDocument"))
+    workbook_path = workbook_path.lstrip("/")
+    folder, name = posixpath.split(workbook_path)
+    targets = {
+        rel[b"Id"]: rel[b"Target"] for rel in relationships(posixpath.join(folder, "_rels", f"{name}.rels"))
+        if rel[b"Type"].endswith("/worksheet")
+    }
+    for sheet_id in SHEET_ID.findall(book.read(workbook_path)):
+        target = targets.get(sheet_id.decode())
+        if target is not None:
+            return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+    raise ValueError("The workbook has no worksheet")
+
+
+def without_calc_chain(name: str, data: bytes) -> bytes:
+    """ Drop calcChain.xml from the content types and workbook relationships, so Excel rebuilds it"""
+    if name == "[Content_Types].xml":
+        return re.sub(rb'<Override\b[^>]*PartName="[^"]*calcChain\.xml"[^>]*/>', b"", data)
+    if name.endswith("workbook.xml.rels"):
+        return re.sub(rb'<Relationship\b[^>]*Target="[^"]*calcChain\.xml"[^>]*/>', b"", data)
+    return data
+
+
+@instrument.timed("patch workbook")
+def patch_workbook(data: bytes, header_row: int, df: pd.DataFrame, fixed_df: pd.DataFrame) -> bytes:
+    """ Copy of the original workbook with only the fixed cells rewritten. Formatting, the rows above the headers and
+        every other sheet stay as the supplier sent them. Raises ValueError when the sheet can't be patched safely.
+    """
+    changes = changed_cells(df, fixed_df, header_row)
+    instrument.count("export cells patched", sum(map(len, changes.values())))
+    with zipfile.ZipFile(io.BytesIO(data)) as book:
+        sheet_part = first_sheet_part(book)
+        sheet = book.read(sheet_part)
+
+        pieces, last, formulas = [], 0, False
+        for row_number in sorted(changes):
+            start = sheet.find(b'<row r="%d"' % row_number, last)     # Excel and openpyxl write r first
+            match = ROW_PATTERN.match(sheet, start) if start >= 0 else None
+            if match is None or match.group(3) is None:
+                raise ValueError(f"Row {row_number} has no cells in the sheet")
+            body, replaced = patch_row(match.group(3), row_number, changes[row_number])
+            formulas |= replaced
+            pieces += [sheet[last:match.start(3)], body]
+            last = match.end(3)
+        pieces.append(sheet[last:])
+
+        out = io.BytesIO()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as patched:
+            for info in book.infolist():
+                if info.filename == sheet_part:
+                    patched.writestr(info, b"".join(pieces), compress_type=zipfile.ZIP_DEFLATED)
+                elif formulas and info.filename.endswith("calcChain.xml"):
+                    continue     # Lists the formula cells, a stale entry makes Excel repair the file
+                elif formulas:
+                    patched.writestr(info, without_calc_chain(info.filename, book.read(info)))
+                else:
+                    patched.writestr(info, book.read(info))
+    return out.getvalue()
+
+
+@instrument.timed("write-only workbook")
+def write_only_workbook(df: pd.DataFrame, columns: list | None = None) -> bytes:
+    """ The DataFrame as a new single sheet workbook, streamed row by row through openpyxl's write-only mode"""
+    from openpyxl import Workbook
+    book = Workbook(write_only=True)
+    sheet = book.create_sheet()
+    sheet.append(list(df.columns) if columns is None else columns)
+    for row in frame_rows(df):
+        sheet.append(row)
+    out = io.BytesIO()
+    book.save(out)
+    return out.getvalue()
+
+
+def fixed_workbook(data: bytes, header_row: int, df: pd.DataFrame, fixed_df: pd.DataFrame,
+                   columns: list | None = None) -> bytes:
+    """ The fixed upload as xlsx: the patched original when possible, else a new write-only workbook"""
+    try:
+        return patch_workbook(data, header_row, df, fixed_df)
+    except (ValueError, TypeError, KeyError, StopIteration, zipfile.BadZipFile):
+        instrument.count("export fallbacks")
+        return write_only_workbook(fixed_df, columns)
+
+
+@instrument.timed("csv export")
+def fixed_csv(fixed_df: pd.DataFrame, columns: list | None = None) -> bytes:
+    """ The fixed rows as UTF-8 CSV, for the ERP import"""
+    return fixed_df.to_csv(index=False, header=columns if columns is not None else True).encode("utf-8")
+
+
+class StreamedExport:
+    """ Fixed rows written batch by batch, for streamed uploads: to a write-only workbook, or as CSV straight to disk.
+        Nothing is left at path unless save() is called.
+    """
+    def __init__(self, path: Path, columns: list, file_format: str = "xlsx"):
+        self.path = Path(path)
+        self.file_format = file_format
+        if file_format == "csv":
+            self.partial = self.path.with_name(f"{self.path.name}.part")
+            self.file = open(self.partial, "w", newline="", encoding="utf-8")
+            csv.writer(self.file).writerow(columns)
+        else:
+            from openpyxl import Workbook
+            self.book = Workbook(write_only=True)
+            self.sheet = self.book.create_sheet()
+            self.sheet.append(columns)
+
+
+    def __repr__(self):
+        return f"StreamedExport: {self.file_format} to {self.path}"
+
+
+    def append(self, df: pd.DataFrame):
+        if self.file_format == "csv":
+            df.to_csv(self.file, header=False, index=False)
+        else:
+            for row in frame_rows(df):
+                self.sheet.append(row)
+
+
+    def save(self):
+        if self.file_format == "csv":
+            self.file.close()
+            os.replace(self.partial, self.path)
+        else:
+            self.book.save(self.path)
+
+
+    def discard(self):
+        if self.file_format == "csv":
+            self.file.close()
+            self.partial.unlink(missing_ok=True)
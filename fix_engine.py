@@ -0,0 +1,91 @@
+import re
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from tools import BAD_CHARS
+import instrument
+
+
+# Matches any one of the bad characters, for whole column str.replace
+BAD_CHAR_PATTERN = "[" + re.escape("".join(sorted(BAD_CHARS))) + "]"
+
+
+def holds_text(column: pd.Series) -> bool:
+    """ Only object and string columns can hold str values, numeric columns never need text fixes"""
+    return column.dtype == object or pd.api.types.is_string_dtype(column)
+
+
+@instrument.timed()
+def fix_text_column(df: pd.DataFrame, col: str, max_len: int, label: str) -> list[str]:
+    """ Remove bad characters from every str value in the column and cut them to max_len, in place.
+        Non-str values are left alone. Messages are only built for the rows that change.
+    """
+    column = df[col]
+    if not holds_text(column):
+        return []
+
+    cleaned = column.str.replace(BAD_CHAR_PATTERN, "", regex=True)    # NaN wherever the value isn't a str
+    is_text = cleaned.notna().to_numpy(dtype=bool)
+    had_bad = is_text & (cleaned != column).fillna(True).to_numpy(dtype=bool)
+    too_long = is_text & (cleaned.str.len() > max_len).fillna(False).to_numpy(dtype=bool)
+    final = cleaned.str.slice(0, max_len)
+
+    changed = had_bad | too_long
+    if not changed.any():
+        return []
+    df.loc[changed, col] = final[changed]
+
+    changes = []
+    for i, og, clean, short, bad, long in zip(column.index[changed], column[changed], cleaned[changed], final[changed],
+                                              had_bad[changed], too_long[changed]):
+        if bad:
+            changes.append(f"Line {i+2} \u00A0\u00A0|\u00A0\u00A0 Bad characters removed from {label}: '{og}', updated to '{clean}'")
+        if long:
+            changes.append(f"Line {i+2} \u00A0\u00A0|\u00A0\u00A0 Long {label}: '{og}' shortened to '{short}'")
+    return changes
+
+
+@instrument.timed()
+def round_column(df: pd.DataFrame, col: str, places: int = 2) -> list[str]:
+    """ Round numbers with more than `places` decimal places, in place.
+        Whole column np.round finds the candidates. Only those go through the exact Decimal check and round()
+        the per-cell loop used, so results and messages are unchanged.
+    """
+    column = df[col]
+    if pd.api.types.is_float_dtype(column):
+        positions = np.arange(len(column))
+    elif column.dtype == object:
+        is_number = column.map(lambda value: isinstance(value, (int, float)) and not isinstance(value, bool))
+        positions = np.flatnonzero(is_number.to_numpy(dtype=bool))
+    else:
+        return []   # Integer columns never have decimal places, text columns are never rounded
+
+    values = column.iloc[positions].to_numpy(dtype=float)
+    with np.errstate(invalid="ignore"):
+        candidates = ~np.isnan(values) & (np.round(values, places) != values)
+    if not candidates.any():
+        return []
+
+    updated = column.to_numpy(copy=True)
+    changes = []
+    for position, (i, num) in zip(positions[candidates], column.iloc[positions[candidates]].items()):
+        if -Decimal(str(num)).as_tuple().exponent > places:
+            new_num = round(num, places)
+            updated[position] = new_num
+            changes.append(f"Line {i+2} \u00A0\u00A0|\u00A0\u00A0 {col} of {num} rounded to {new_num}")
+    if changes:
+        df[col] = updated     # One write for the whole column, per cell df.at was most of the cost
+    return changes
+
+
+@instrument.timed()
+def map_vat_column(df: pd.DataFrame, col: str, vat_codes: dict[float, int]) -> list[str]:
+    """ Replace VAT percentages with their VAT codes, in place"""
+    column = df[col]
+    matches = column.isin(list(vat_codes)).to_numpy(dtype=bool)
+    if not matches.any():
+        return []
+
+    old_values = column[matches]
+    df.loc[matches, col] = old_values.map(vat_codes)
+    return [f"Line {i+2} \u00A0\u00A0|\u00A0\u00A0 VAT Rate {vat} updated to code {vat_codes[vat]}" for i, vat in old_values.items()]
@@ -0,0 +1,121 @@
+""" Stage timers and counters for finding where a slow validation spends its time.
+
+Nothing is recorded unless a Profile is active (see profiling). Timers and counters look the active profile up in a
+ContextVar, so with none active each one costs a single lookup, and two sessions or worker threads never mix results.
+Stage times are inclusive: a stage that calls another timed stage counts that time too.
+"""
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+
+
+ACTIVE = ContextVar("plu_profile", default=None)
+NO_STAGE = nullcontext()
+
+
+class Profile:
+    """ Seconds and calls per stage, and named counters (rows, cache hits, fuzzy matches)"""
+    def __init__(self):
+        self.stages = {}        # name -> [seconds, calls]
+        self.counters = Counter()
+
+
+    def __repr__(self):
+        return f"Profile: {len(self.stages)} stages, {sum(self.counters.values())} counted"
+
+
+    def add(self, name: str, seconds: float):
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+    def merge(self, other: dict):
+        """ Add in another profile's as_dict(), e.g. one sent back from a worker process"""
+        for name, entry in other["stages"].items():
+            mine = self.stages.setdefault(name, [0.0, 0])
+            mine[0] += entry["seconds"]
+            mine[1] += entry["calls"]
+        self.counters.update(other["counters"])
+
+
+    def as_dict(self) -> dict:
+        """ JSON ready: stages slowest first, then counters"""
+        stages = sorted(self.stages.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            "stages": {name: {"seconds": round(seconds, 6), "calls": calls} for name, (seconds, calls) in stages},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+
+class StageTimer:
+    def __init__(self, profile: Profile, name: str):
+        self.profile = profile
+        self.name = name
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.profile.add(self.name, time.perf_counter() - self.start)
+
+
+@contextmanager
+def profiling(profile: Profile | None = None):
+    """ Record into profile (a new one if not given) for the duration of the block"""
+    profile = profile if profile is not None else Profile()
+    token = ACTIVE.set(profile)
+    try:
+        yield profile
+    finally:
+        ACTIVE.reset(token)
+
+
+def activate(profile: Profile | None):
+    """ Make profile (or None, for no recording) active for the rest of this context.
+        For a Streamlit script, which can't wrap its whole body in profiling() and reruns in the same thread.
+    """
+    ACTIVE.set(profile)
+
+
+def stage(name: str):
+    """ with stage("name"): adds the block's time to the active profile, if there is one"""
+    profile = ACTIVE.get()
+    return NO_STAGE if profile is None else StageTimer(profile, name)
+
+
+def timed(name: str | None = None):
+    """ Decorator timing every call of a function as a stage, named after the function by default"""
+    def decorate(func):
+        label = name or func.__name__
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = ACTIVE.get()
+            if profile is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.add(label, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def count(name: str, amount: int = 1):
+    """ Add amount to a counter of the active profile, if there is one"""
+    profile = ACTIVE.get()
+    if profile is not None:
+        profile.counters[name] += amount
+
+
+def record(name: str, seconds: float):
+    """ Add an already measured time to the active profile, if there is one"""
+    profile = ACTIVE.get()
+    if profile is not None:
+        profile.add(name, seconds)
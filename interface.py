@@ -5,29 +5,25 @@ from product_class import Product  # Make sure this is in the same folder or Pyt
 from parser import * 
 from fix_products import update_all_products
 from fix_clothing import update_all_clothing
+from list_cache import mapped_index_cached, append_codes
+from active_index import MappedActiveIndex
+from validation import FILE_TYPES, success_message
+from rules import ValidationCancelled, RuleStream
+from streaming import read_upload_with_progress, sheet_row_count, UploadStream, STREAM_BATCH_ROWS
+from export import fixed_workbook, fixed_csv, StreamedExport, XLSX_MIME, CSV_MIME
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+import contextvars
+import instrument
 import io
+import os
+import queue
+import tempfile
+import threading
 from tools import *
 
 
-ERROR_TYPES = {
-    # Product checks
-    "Duplicate PLU Code Errors": "PLU Codes are all valid.", 
-    "Duplicate PLUs Within Uploaded File": "No Duplicate PLU Codes.",
-    "PLU Code Length Errors": "PLU Code lengths are all valid.",
-    "Product Description Length Errors": "Product descriptions are all valid.",
-    "Decimal Formatting Errors": "All numbers rounded correctly.",
-
-    # Shared
-    "Unusable Character Errors": "No unusable characters found.",
-    "Duplicate Barcode Errors": "All barcodes are valid.",
-
-    # Clothing checks
-    "Duplicate Style Code Code Errors": "Style Codes are all valid.",
-    "Duplicate Style Codes Within Uploaded File": "No Duplicate Style Codes.",
-    "Style Code Length Errors": "Style Code lengths are all valid.",
-    "Clothing Item Description Length Errors": "Descriptions are all valid.",
-}
-
 def display_results(title: str, errors: list[str]):
     if errors: 
         expander_title = f"{title} — {len(errors)} issue(s)"
@@ -35,38 +31,380 @@ def display_results(title: str, errors: list[str]):
             for err in errors:
                 st.markdown(f"- {err}")
     else:
-        success_msg = ERROR_TYPES.get(title, f"{title} passed all checks.")
-        st.success(success_msg)
+        st.success(success_message(title))
+
+
+# Cached stages ----------
+# Streamlit re-runs this whole script on every widget change, so each stage is cached on the uploaded bytes.
+# Reruns that don't change either upload then skip loading, indexing, fixing and checking entirely.
+# _progress(stage, done, total) and _on_result(title, messages) aren't hashed by Streamlit (leading underscore),
+# they only report a cache miss's work back to LiveRun below.
+
+CACHE_ENTRIES = 16          # Uploads kept per cached stage
+CACHE_TTL = 60 * 60         # Seconds before a cached stage is recomputed
+STREAM_ROWS = int(os.environ.get("PLU_STREAM_ROWS", 100_000))    # Bigger uploads are read, checked and fixed in batches
+
+
+def no_progress(stage: str, done: int, total: int):
+    pass
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def load_new_file(data: bytes, file_type: str, _progress=no_progress):
+    """ Read the upload once, find missing columns and resolve every header for the later stages.
+        Also returns the header row and the headers as written, for exporting the fixed file.
+    """
+    instrument.count("cache misses: load_new_file")
+    header_map, *_ = FILE_TYPES[file_type]
+    grid, header_row, df = read_upload_with_progress(io.BytesIO(data), header_map, _progress)
+    names = column_names(grid.iloc[header_row].tolist()) if not grid.empty else list(df.columns)
+    return df, check_missing_columns(df, header_map), HeaderResolution(df, header_map), header_row, names
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def fix_new_file(data: bytes, file_type: str, _progress=no_progress):
+    """ Auto-fixed copy of the DataFrame from load_new_file, and the changes made"""
+    instrument.count("cache misses: fix_new_file")
+    df, _, headers, *_ = load_new_file(data, file_type, _progress)
+    _progress("Applying auto-fixes", 0, 1)
+    *_, update_all = FILE_TYPES[file_type]
+    return update_all(df, headers)
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def load_items(data: bytes, file_type: str, _progress=no_progress):
+    """ Product/Clothing objects and column messages, built from the DataFrame of load_new_file"""
+    instrument.count("cache misses: load_items")
+    df, _, headers, *_ = load_new_file(data, file_type, _progress)
+    _progress(f"Loading {file_type} items", 0, 1)
+    loader = load_products if file_type == "Product" else load_clothing
+    return loader(df, headers)
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def export_fixed(data: bytes, file_type: str, file_format: str) -> bytes:
+    """ The auto-fixed upload to download: the original workbook with only the fixed cells rewritten, or CSV"""
+    instrument.count("cache misses: export_fixed")
+    df, _, _, header_row, names = load_new_file(data, file_type)
+    fixed_df, _ = fix_new_file(data, file_type)
+    if file_format == "csv":
+        return fixed_csv(fixed_df, names)
+    return fixed_workbook(data, header_row, df, fixed_df, names)
+
+
+@st.cache_resource(max_entries=4, ttl=CACHE_TTL, show_spinner=False)
+def load_active_index(data: bytes, possible_names: tuple[str, ...], _progress=no_progress):
+    """ Indexed active list, shared across reruns and sessions. The memory-mapped index file in the list cache
+        is shared with every other session and process validating against the same list.
+    """
+    instrument.count("cache misses: load_active_index")
+    _progress("Reading active list", 0, 1)
+    return mapped_index_cached(io.BytesIO(data), list(possible_names))
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def run_checks(new_data: bytes, list_data: bytes, file_type: str, _progress=no_progress, _on_result=None) -> dict[str, list[str]]:
+    """ Every check from validation.py for this pair of uploads, keyed by results title"""
+    instrument.count("cache misses: run_checks")
+    _, _, possible_names, checks, _ = FILE_TYPES[file_type]
+    items, _ = load_items(new_data, file_type, _progress)
+    active_index, *_ = load_active_index(list_data, tuple(possible_names), _progress)
+    return checks(items, active_index, _progress, _on_result)
+
+
+# Streamed stages ----------
+# For uploads over STREAM_ROWS rows. Only one batch of rows is held at a time and only messages are cached,
+# so the app's memory doesn't grow with the upload like load_new_file's grid and DataFrame do.
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def stream_checks(new_data: bytes, list_data: bytes, file_type: str, _progress=no_progress, _on_result=None):
+    """ load_new_file, fix_new_file and run_checks in one pass over the upload's row batches.
+        Each batch's issues go to _on_result(title, messages) as soon as it is checked.
+        Returns the missing columns, the column messages, the auto-fixes made and every check's results.
+    """
+    instrument.count("cache misses: stream_checks")
+    header_map, _, possible_names, _, update_all = FILE_TYPES[file_type]
+    active_index, *_ = load_active_index(list_data, tuple(possible_names), _progress)
+    _progress("Scanning upload", 0, 1)
+    upload = UploadStream(io.BytesIO(new_data), header_map)
+    checker = RuleStream(file_type, active_index)
+    auto_changes = {}
+
+    def report(found: dict[str, list[str]]):
+        for title, messages in found.items():
+            if messages and _on_result:
+                _on_result(title, messages)
+
+    for batch in upload.batches():
+        _progress("Checking rows", checker.rows, upload.rows)
+        table, _ = load_table(batch, file_type, upload.headers)
+        report(checker.feed(table))
+        _, changes = update_all(batch, upload.headers)
+        for category, messages in changes.items():
+            auto_changes.setdefault(category, []).extend(messages)
+    report(checker.finish())
+    missing = check_missing_columns(pd.DataFrame(columns=upload.columns), header_map)
+    return missing, upload.headers.messages, auto_changes, checker.results
+
+
+def export_streamed(new_data: bytes, file_type: str, file_format: str) -> bytes:
+    """ export_fixed for a streamed upload: every batch is fixed again and written out as it goes.
+        Not cached, so the file is only held while it is downloaded.
+    """
+    header_map, *_, update_all = FILE_TYPES[file_type]
+    upload = UploadStream(io.BytesIO(new_data), header_map)
+    with tempfile.TemporaryDirectory(prefix="plu-export-") as folder:
+        export = StreamedExport(Path(folder) / f"fixed.{file_format}", upload.columns, file_format)
+        for batch in upload.batches():
+            fixed_batch, _ = update_all(batch, upload.headers)
+            export.append(fixed_batch)
+        export.save()
+        return export.path.read_bytes()
+
+
+def streamed_barcodes(new_data: bytes, file_type: str) -> dict[str, str]:
+    """ first_barcodes for a streamed upload, read batch by batch when its codes are added to the index"""
+    header_map, id_attr, *_ = FILE_TYPES[file_type]
+    upload = UploadStream(io.BytesIO(new_data), header_map)
+    barcodes = {}
+    for batch in upload.batches():
+        table, _ = load_table(batch, file_type, upload.headers)
+        for code, barcode in first_barcodes(table, id_attr).items():
+            barcodes.setdefault(code, barcode)
+    return barcodes
+
+
+# Live progress ----------
+
+POLL_SECONDS = 0.2          # How often the progress bar is refreshed while a stage runs
+
+
+class LiveRun:
+    """ Runs each cached stage in a worker thread while the script thread shows its progress and early results.
+        Streamlit stops the script thread when the user swaps files or presses Cancel. The worker then raises
+        ValidationCancelled at its next progress callback, so a validation nobody waits for doesn't keep the server busy.
+    """
+    def __init__(self, run_key: tuple):
+        self.run_key = run_key
+        self.cancelled = threading.Event()
+        self.state = ("Starting", 0, 1)
+        self.results = queue.Queue()
+        self.shown = {}         # title -> (placeholder, messages shown so far)
+        self.bar = st.empty()
+        self.controls = st.empty()
+        if self.controls.button("Cancel validation"):
+            st.session_state["cancelled_run"] = run_key
+            st.rerun()
+
+
+    def progress(self, stage: str, done: int, total: int):
+        """ Called from the worker thread"""
+        if self.cancelled.is_set():
+            raise ValidationCancelled(stage)
+        self.state = (stage, done, total)
+
+
+    def result(self, title: str, messages: list[str]):
+        """ Called from the worker thread as each check finishes"""
+        self.results.put((title, messages))
+
+
+    def refresh(self):
+        stage, done, total = self.state
+        text = f"{stage} ({done:,} of {total:,})" if total > 1 else stage
+        self.bar.progress(min(done / total, 1.0) if total else 0.0, text=text)
+        changed = set()
+        while not self.results.empty():
+            title, messages = self.results.get()
+            if title not in self.shown:
+                self.shown[title] = (st.empty(), [])
+            self.shown[title][1].extend(messages or [])      # Streamed checks report each batch's messages
+            changed.add(title)
+        for title in changed:
+            placeholder, messages = self.shown[title]
+            with placeholder.container():
+                display_results(title, messages)
+
+
+    def run(self, stage, *args, **kwargs):
+        """ stage(*args, **kwargs) in the worker thread, polled here until it finishes. Returns its result or raises its error"""
+        executor = ThreadPoolExecutor(max_workers=1)
+        instrument.count(f"cache lookups: {stage.__name__}")
+        try:
+            with instrument.stage(f"ui: {stage.__name__}"):
+                context = contextvars.copy_context()        # Carries the active Profile into the worker
+                future = executor.submit(context.run, stage, *args, _progress=self.progress, **kwargs)
+                while not wait([future], timeout=POLL_SECONDS).done:
+                    self.refresh()          # Streamlit raises here once the script is stopped or rerun
+                self.refresh()
+                return future.result()
+        except BaseException:
+            self.cancelled.set()
+            raise
+        finally:
+            executor.shutdown(wait=False)
+
+
+    def finish(self, results: dict[str, list[str]]):
+        """ Clear the progress bar and show the results the worker didn't report (all of them on a cache hit)"""
+        self.bar.empty()
+        self.controls.empty()
+        for title, errors in results.items():
+            if title not in self.shown:
+                display_results(title, errors)
+
+
+def first_barcodes(items: list | ItemTable, id_attr: str) -> dict[str, str]:
+    """ Code -> barcode of its first item, so later uploads are checked against both"""
+    barcodes = {}
+    for code, barcode in zip(item_values(items, id_attr)[0], item_values(items, "barcode")[0]):
+        if not pd.isna(code):
+            barcodes.setdefault(normalizer(code), catalogue_key(barcode))
+    return barcodes
+
+
+def offer_append(active_index, code_barcodes):
+    """ Button to add a passing upload's codes to the persisted active list index, so the next upload is checked
+        against them without the full active list being uploaded and parsed again. The codes go to the list's
+        index in list_cache.INDEX_DIR, which the cache never evicts and batch.py and service.py also read.
+        code_barcodes() gives the codes and barcodes to add (see first_barcodes), only once the button is pressed.
+    """
+    if not isinstance(active_index, MappedActiveIndex):     # The list's code column couldn't be read
+        return
+    if st.button("Add these codes to the active list index"):
+        barcodes = code_barcodes()
+        codes = list(barcodes)
+        index = append_codes(active_index, codes, {"barcode": list(barcodes.values())})
+        load_active_index.clear()       # All hold results from the index before these codes were added
+        run_checks.clear()
+        stream_checks.clear()
+        st.success(f"Added {len(codes)} code(s) to the active list index {index.path} (version {index.version}). "
+                   f"Checking this file again will report them as already in the system.")
+
+
+def offer_downloads(new_data: bytes, file_type: str, file_name: str, export=export_fixed):
+    """ Download buttons for the fixed file. Each file is only written when its button is clicked"""
+    stem = Path(file_name).stem
+    excel, csv = st.columns(2)
+    excel.download_button(
+        label="Download Fixed Version",
+        data=partial(export, new_data, file_type, "xlsx"),
+        file_name=f"Fixed-{stem}.xlsx",
+        mime=XLSX_MIME)
+    csv.download_button(
+        label="Download Fixed CSV (ERP import)",
+        data=partial(export, new_data, file_type, "csv"),
+        file_name=f"Fixed-{stem}.csv",
+        mime=CSV_MIME)
+
+
+def show_outcome(results: dict[str, list[str]], auto_changes: dict[str, list[str]], active_index, code_barcodes,
+                 new_data: bytes, file_type: str, file_name: str, export=export_fixed):
+    """ What to do next once every check has run: add a passing upload's codes, or get its auto-fixed file"""
+    if not any(results.values()):
+        st.success("All checks passed. File is ready for upload.")
+        offer_append(active_index, code_barcodes)
+
+    elif any(auto_changes.values()):
+        st.write("\n")
+        st.title("Automatically Fixed Errors:")
+
+        for category, changes in auto_changes.items():
+            if changes:
+                with st.expander(f"{category} ({len(changes)} fixes)", expanded=False):
+                    for change in changes:
+                        st.markdown(f"- {change}")
+
+        offer_downloads(new_data, file_type, file_name, export)
+    else:
+        st.title("No Auto-fixes Found")
+
+
+def stream_upload(live: LiveRun, file_type: str, new_data: bytes, list_data: bytes, file_name: str):
+    """ The whole validation of an upload over STREAM_ROWS rows, read, checked and fixed one batch at a time.
+        Issues are shown batch by batch as they are found.
+    """
+    _, _, possible_names, *_ = FILE_TYPES[file_type]
+    try:
+        active_index, message, msg_type = live.run(load_active_index, list_data, tuple(possible_names))
+    except Exception as e:
+        st.error(f"Error reading the active list: {e}")
+        st.stop()
+    if message and msg_type == "alert":
+        st.success(message)
+    elif message:
+        st.warning(message)
 
+    st.info(f"Large upload: reading and checking it {STREAM_BATCH_ROWS:,} rows at a time.")
+    try:
+        missing, messages, auto_changes, results = live.run(stream_checks, new_data, list_data, file_type,
+                                                            _on_result=live.result)
+    except Exception as e:
+        st.error(f"Error checking new {file_type.lower()} file: {e}")
+        st.stop()
+    if missing:
+        st.warning(f"Columns not found in new file: {', '.join(missing)}")
+    for message, msg_type in messages:
+        if msg_type == "alert":
+            st.success(message)
+
+    live.finish(results)
+    show_outcome(results, auto_changes, active_index, partial(streamed_barcodes, new_data, file_type),
+                 new_data, file_type, file_name, export_streamed)
+
+
+def show_profile(profile: instrument.Profile | None):
+    """ Collapsible table of where this run's time went, when timings are switched on in the sidebar"""
+    if profile is None:
+        return
+    recorded = profile.as_dict()
+    with st.expander("Timings", expanded=False):
+        stages = pd.DataFrame([{"stage": name, **entry} for name, entry in recorded["stages"].items()])
+        st.dataframe(stages, hide_index=True, width="stretch")
+        st.json(recorded["counters"])
+
+
+def start_run(file_type: str, new_file, full_list_file) -> LiveRun:
+    """ LiveRun for this pair of uploads, or stop here if the user cancelled it and hasn't changed either file"""
+    run_key = (file_type, new_file.file_id, full_list_file.file_id)
+    if st.session_state.get("cancelled_run") == run_key:
+        st.info("Validation cancelled. Upload a different file to check it, or run these files again.")
+        if st.button("Run validation again"):
+            del st.session_state["cancelled_run"]
+            st.rerun()
+        st.stop()
+    return LiveRun(run_key)
 
 
 st.title("New Product File Validation")
 file_type = st.selectbox("Select File Type", ["Product", "Clothing"])
+profile = instrument.Profile() if st.sidebar.checkbox("Show timings", help="Time each stage of this run") else None
+instrument.activate(profile)
 
 # File uploads
 new_file = st.file_uploader(f"Upload New {file_type} File", type=["xlsx"])
-full_list_file = st.file_uploader("Upload PLU Active List", type=["xlsx"])
+full_list_file = st.file_uploader("Upload PLU Active List", type=["xlsx", "pluidx"])     # .pluidx from active_index.py
 
 
 # Proceed only if both files uploaded
 if file_type == "Product" and new_file and full_list_file:
 
 # Step 1: Read and normalize new product file for auto fixes ---------
+    new_data = new_file.getvalue()
+    list_data = full_list_file.getvalue()
+    live = start_run("Product", new_file, full_list_file)
+    if sheet_row_count(new_data) > STREAM_ROWS:
+        stream_upload(live, "Product", new_data, list_data, new_file.name)
+        show_profile(profile)
+        st.stop()
     try:
-        df = pd.read_excel(new_file)                                            # Read in file
-
-        expected_headers = [name for sublist in PRODUCT_HEADER_MAP.values() for name in sublist]
-        header_row = detect_header_row(new_file, expected_headers)
-        df = pd.read_excel(new_file, header=header_row)
-        df.columns = [normalize_header(c) for c in df.columns]
-
-        missing = check_missing_columns(df, PRODUCT_HEADER_MAP)                         # Check missing columns
+        df, missing, *_ = live.run(load_new_file, new_data, "Product")                 # Read in file once
         if missing:
             st.warning(f"Columns not found in new file: {','.join(missing)}")
         else:
-            st.success(f"All expected columns found in new file.")
-        
-        fixed_df, auto_changes = update_all_products(df)                        # Apply auto-changes
+            st.success("All expected columns found in new file.")
+
+        fixed_df, auto_changes = live.run(fix_new_file, new_data, file_type)      # Apply auto-changes
 
     except Exception as e:
         st.error(f"Error reading or fixing new product file: {e}")
@@ -74,7 +412,7 @@ if file_type == "Product" and new_file and full_list_file:
 
 # Step 2: Load as Product class objects ----------
     try:
-        products, messages = load_products(new_file) # was new file
+        products, messages = live.run(load_items, new_data, "Product")   # Reuses the DataFrame read in step 1
         missing = []
         for message, type in messages:
             if type == "alert":
@@ -91,7 +429,7 @@ if file_type == "Product" and new_file and full_list_file:
 
 # Step 3: Load PLU list ---------
     try:
-        full_list, message, type = read_column(full_list_file, POSSIBLE_PLU)
+        plu_index, message, type = live.run(load_active_index, list_data, tuple(POSSIBLE_PLU))
         missing = []
         if message:
             if type == "alert":
@@ -110,91 +448,45 @@ if file_type == "Product" and new_file and full_list_file:
     
 
 # Error collection ---------
-# duplicate_plu_dict = check_duplicates(products, all_plu)
-    duplicate_plu_dict = check_duplicates(products, full_list, "plu_code")
-    duplicate_plu_errors = [
-        f"Line: {line + 2} \u00A0\u00A0|\u00A0\u00A0 Product {plu} is already in the system."  # +2 to match Excel row (header + 0-indexed)
-        for plu, line in duplicate_plu_dict.items()
-    ]
-    internal_duplicates = check_internal_duplicates(products, "plu_code")
-    plu_errors = []
-    prod_desc_errors = []
-    prod_bad_char_errors = []
-    decimal_errors =[]
-    prod_barcode_errors = duplicate_barcodes(products, "plu_code")
-    
+    results = live.run(run_checks, new_data, list_data, "Product", _on_result=live.result)
 
-# Check all products and store in proper lists
-    for product in products:
-        if (e := product.plu_len()):
-            plu_errors.append(e)
-        # if (e := product.desc_len()):
-        #     prod_desc_errors.append(e)
-        if (e := bad_char(product, "plu_code")):
-            prod_bad_char_errors.append(e)
-        # if (e := product.decimal_format()):
-        #     decimal_errors.append(e)
-        
-# Display errors
-    display_results("Duplicate PLU Code Errors", duplicate_plu_errors)
-    display_results("Duplicate PLUs Within Uploaded File", internal_duplicates)
-    display_results("PLU Code Length Errors", plu_errors)
-    # display_results("Product Description Length Errors", prod_desc_errors)
-    display_results("Unusable Character Errors", prod_bad_char_errors)
-    # display_results("Decimal Formatting Errors", decimal_errors)
-    display_results("Duplicate Barcode Errors", prod_barcode_errors)
-
-
-# If no errors
-    if not any([duplicate_plu_errors, internal_duplicates, plu_errors, 
-                prod_desc_errors, prod_bad_char_errors, decimal_errors, prod_barcode_errors]):
-        st.success("All checks passed. File is ready for upload.")
+# Display errors (each check's were shown as soon as it finished, this adds any cached ones)
+    live.finish(results)
 
-    elif len(auto_changes.items()) > len(auto_changes.keys()):
-        st.write("\n")
-        st.title("Automatically Fixed Errors:")
 
-        for category, changes in auto_changes.items():
-            if changes:
-                with st.expander(f"{category} ({len(changes)} fixes)", expanded=False):
-                    for change in changes:
-                        st.markdown(f"- {change}")
+# Add the codes, or offer the fixed file
+    show_outcome(results, auto_changes, plu_index, partial(first_barcodes, products, "plu_code"),
+                 new_data, file_type, new_file.name)
 
-        # Convert to Excel in memory
-        buffer = io.BytesIO()
-        fixed_df.to_excel(buffer, index=False)
-        st.download_button(
-            label="Download Fixed Version",
-            data=buffer.getvalue(),
-            file_name= f"Fixed-{new_file.name}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    else:
-        st.title("No Auto-fixes Found")
+    show_profile(profile)
 
 
 elif file_type == "Clothing" and new_file and full_list_file:
 # Step 1: Read and normalize new clothing file for auto fixes ---------
 
+    new_data = new_file.getvalue()
+    list_data = full_list_file.getvalue()
+    live = start_run("Clothing", new_file, full_list_file)
+    if sheet_row_count(new_data) > STREAM_ROWS:
+        stream_upload(live, "Clothing", new_data, list_data, new_file.name)
+        show_profile(profile)
+        st.stop()
     try:
-        expected_headers = [name for sublist in CLOTHING_HEADER_MAP.values() for name in sublist]
-        header_row = detect_header_row(new_file, expected_headers)
-        df = pd.read_excel(new_file, header=header_row)
-        df.columns = df.columns.str.lower().str.strip().str.replace(" ", "")
-
-        missing = check_missing_columns(df, CLOTHING_HEADER_MAP)                         # Check missing columns
+        df, missing, *_ = live.run(load_new_file, new_data, "Clothing")                 # Read in file once
         if missing:
             st.warning(f"Columns not found in new file: {', '.join(missing)}")
         else:
-            st.success(f"All expected columns found in new file.")
-        
-        fixed_df, auto_changes = update_all_clothing(df)         
+            st.success("All expected columns found in new file.")
+
+        fixed_df, auto_changes = live.run(fix_new_file, new_data, file_type)      # Apply auto-changes
+
     except Exception as e:
         st.error(f"Error reading or fixing new clothing file: {e}")
         st.stop()
 
 # Step 2: Load as Product class objects ----------
     try:
-        clothes, messages = load_clothing(new_file)
+        clothes, messages = live.run(load_items, new_data, "Clothing")
         for message, type, in messages:
             if type == "alert":
                 st.success(message)
@@ -207,7 +499,7 @@ elif file_type == "Clothing" and new_file and full_list_file:
 
 # Step 3: Load Clothing list ---------
     try:
-        all_style_codes, message, type = read_column(full_list_file, CLOTHING_HEADER_MAP["style_code"])
+        style_index, message, type = live.run(load_active_index, list_data, tuple(CLOTHING_HEADER_MAP["style_code"]))
         if message:
             if type == "alert":
                 st.success(message)
@@ -234,68 +526,17 @@ elif file_type == "Clothing" and new_file and full_list_file:
 
 
 
-    duplicate_styles = check_duplicates(clothes, all_style_codes, "style_code")
-    duplicate_style_errors = [
-        f"Line: {line + 2} \u00A0\u00A0|\u00A0\u00A0 Item {style_code} is already in the system."  # +2 to match Excel row (header + 0-indexed)
-        for style_code, line in duplicate_styles.items()
-    ]
-    internal_duplicates = check_clothing_duplicates(clothes)
-    style_len_errors = []
-    colour_len_errors = []
-    clothing_bad_char_errors =[]
-    clothing_decsc_errors =[]
-    clothing_barcode_errors = duplicate_barcodes(clothes, "style_code")
-    
+    results = live.run(run_checks, new_data, list_data, "Clothing", _on_result=live.result)
 
-# Check all items and store in proper lists
-    for item in clothes:
-        if (e := item.style_len()):
-            style_len_errors.append(e)
-        # if (e := item.colour_len()):
-            colour_len_errors.append(e)
-        if (e := bad_char(item, "style_code")):
-            clothing_bad_char_errors.append(e)
-        # if (e := item.desc_len()):
-            clothing_decsc_errors.append(e)
-
-            
-# Display Errors
-    display_results("All Duplicate Style Code Code Errors", duplicate_style_errors)
-    display_results("Duplicate Style Codes Within Uploaded File", internal_duplicates)
-    display_results("All Style Code Length Errors", style_len_errors)
-    # display_results("All Clothing Item Description Length Errors", clothing_decsc_errors)
-    # display_results("All Color Length Description Errors", colour_len_errors)
-    display_results("All Unusable Character Errors", clothing_bad_char_errors)
-    display_results("All Duplicate Barcode Errors", clothing_barcode_errors)
-
-
-# If no errors
-    if not any([duplicate_style_errors, internal_duplicates, style_len_errors, clothing_decsc_errors, 
-    clothing_bad_char_errors, clothing_barcode_errors]):
-        st.success("All checks passed. File is ready for upload.")
+# Display Errors (each check's were shown as soon as it finished, this adds any cached ones)
+    live.finish(results)
 
-# Auto fixing ------------------
-    elif len(auto_changes.items()) > len(auto_changes.keys()):
-        st.write("\n")
-        st.title("Automatically Fixed Errors:")
 
-        for category, changes in auto_changes.items():
-            if changes:
-                with st.expander(f"{category} ({len(changes)} fixes)", expanded=False):
-                    for change in changes:
-                        st.markdown(f"- {change}")
+# Add the codes, or offer the fixed file ------------------
+    show_outcome(results, auto_changes, style_index, partial(first_barcodes, clothes, "style_code"),
+                 new_data, file_type, new_file.name)
 
-        # Convert to Excel in memory
-        buffer = io.BytesIO()
-        fixed_df.to_excel(buffer, index=False)
-        st.download_button(
-            label="Download Fixed Version",
-            data=buffer.getvalue(),
-            file_name= f"Fixed-{new_file.name}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-    else:
-        st.title("No Auto-fixes Found")
+    show_profile(profile)
 
 
 
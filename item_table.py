@@ -0,0 +1,83 @@
+from operator import attrgetter
+import numpy as np
+import pandas as pd
+from tools import *
+
+
+# Product/Clothing attribute names that differ from their HEADER_MAP field
+ATTR_FIELDS = {"cost": "cost_price"}
+
+# infer_dtype results for object columns that may hold strings
+STR_INFERRED = {"string", "mixed", "mixed-integer", "empty"}
+
+
+class ItemTable:
+    """ Column store for an upload: one array per HEADER_MAP field plus the Excel line numbers.
+        Numeric columns keep their numpy dtype, text and mixed columns are object arrays.
+        Validators can run on whole columns instead of a list of Product/Clothing objects.
+    """
+    def __init__(self, columns: dict[str, np.ndarray], lines: np.ndarray, id_attr: str):
+        self.columns = columns
+        self.lines = lines
+        self.id_attr = id_attr
+
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, col_map: dict[str, str | None], id_attr: str):
+        """ Build the table from a loaded DataFrame and its resolved columns (col_map from the loaders)"""
+        missing = np.full(len(df), None, dtype=object)
+        columns = {key: df[col].to_numpy() if col is not None else missing for key, col in col_map.items()}
+        lines = (df.index + 2).to_numpy()
+        return cls(columns, lines, id_attr)
+
+
+    @classmethod
+    def from_items(cls, items: list, id_attr: str):
+        """ Build the table from Product/Clothing objects. Each attribute is read with a C-level map(attrgetter),
+            about 3x quicker than transposing attrgetter tuples of every attribute with zip.
+        """
+        if not items:
+            header_map = PRODUCT_HEADER_MAP if id_attr == "plu_code" else CLOTHING_HEADER_MAP
+            return cls({key: np.array([], dtype=object) for key in header_map}, np.array([], dtype=np.int64), id_attr)
+        names = [name for name in type(items[0]).__slots__ if name != "excel_line"]
+        columns = {
+            ATTR_FIELDS.get(name, name): np.fromiter(map(attrgetter(name), items), dtype=object, count=len(items))
+            for name in names
+        }
+        lines = np.fromiter(map(attrgetter("excel_line"), items), dtype=object, count=len(items))
+        return cls(columns, lines, id_attr)
+
+
+    def __repr__(self):
+        return f"ItemTable: {len(self)} rows x {len(self.columns)} columns"
+
+
+    def __len__(self):
+        return len(self.lines)
+
+
+    def column(self, attr: str) -> np.ndarray:
+        """ Column for a HEADER_MAP field or a Product/Clothing attribute name"""
+        return self.columns[ATTR_FIELDS.get(attr, attr)]
+
+
+    def codes(self, attr: str) -> list[str]:
+        """ Column values passed through normalizer, the form used for duplicate checks"""
+        return [normalizer(value) for value in self.column(attr).tolist()]
+
+
+    def text_columns(self) -> dict[str, pd.Series]:
+        """ Columns that can hold strings, as object Series ready for .str operations"""
+        text = {}
+        for key, values in self.columns.items():
+            if values.dtype == object:
+                series = pd.Series(values, dtype=object)
+                if pd.api.types.infer_dtype(series, skipna=True) in STR_INFERRED:     # All numbers can't be .str-ed
+                    text[key] = series
+        return text
+
+
+    def length_over(self, attr: str, limit: int) -> np.ndarray:
+        """ Row positions where len(str(value)) is over the limit"""
+        lengths = pd.Series(self.column(attr), dtype=object).astype(str).str.len().to_numpy()
+        return np.flatnonzero(lengths > limit)
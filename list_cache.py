@@ -0,0 +1,212 @@
+import argparse
+import hashlib
+import io
+import os
+import time
+from pathlib import Path
+import numpy as np
+from active_index import ActiveIndex, MappedActiveIndex, is_index_file, index_lock
+from tools import *
+import instrument
+
+
+CACHE_DIR = Path(os.environ.get("PLU_CACHE_DIR", ".plu_cache"))
+MAX_CACHE_BYTES = 256 * 1024 * 1024   # Oldest entries are evicted past this size
+SEPARATOR = "\x00"                     # Can't appear in an xlsx cell, so it is safe to join codes with
+ENTRY_SUFFIXES = (".npz", ".pluidx")   # Column lists from read_columns_cached, mapped indexes from mapped_index_cached
+# Mapped indexes that codes were appended to, named like their cache entries. Kept outside CACHE_DIR, so evict and
+# clear_cache never delete them
+INDEX_DIR = Path(os.environ.get("PLU_INDEX_DIR", "plu_indexes"))
+
+
+def file_bytes(file) -> bytes:
+    """ Raw bytes of a path, a Streamlit upload or any other file-like object"""
+    if isinstance(file, (str, Path)):
+        return Path(file).read_bytes()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    data = file.read()
+    file.seek(0)
+    return data
+
+
+def cache_key(data: bytes, possible_names, columns: dict[str, list[str]] | None = None) -> str:
+    """ Content hash of the active list plus the columns being read from it"""
+    if isinstance(possible_names, str):
+        possible_names = [possible_names]
+    digest = hashlib.sha256(data)
+    digest.update(SEPARATOR.join(possible_names).encode())
+    for field, names in (columns or {}).items():
+        digest.update(SEPARATOR.join([field, *names]).encode())
+    return digest.hexdigest()
+
+
+def read_columns_cached(file, possible_names, columns: dict[str, list[str]] = ACTIVE_LIST_COLUMNS, cache_dir: Path = CACHE_DIR,
+                        max_bytes: int = MAX_CACHE_BYTES) -> tuple[list, dict[str, list[str]], str, str]:
+    """ Drop-in for read_columns that keeps the normalized columns on disk, keyed by the file's content hash.
+        A later upload of the same active list loads from the cache instead of re-parsing the xlsx.
+    """
+    data = file_bytes(file)
+    path = Path(cache_dir) / f"{cache_key(data, possible_names, columns)}.npz"
+
+    if path.exists():
+        try:
+            codes, found, message, msg_type = load_entry(path)
+            os.utime(path)     # Mark as recently used for eviction
+            instrument.count("list cache hits")
+            return codes, found, message, msg_type
+        except Exception:
+            path.unlink(missing_ok=True)   # Corrupt or partly written entry, rebuild it below
+
+    instrument.count("list cache misses")
+    codes, found, message, msg_type = read_columns(io.BytesIO(data), possible_names, columns)
+    if msg_type != "error":    # Don't keep failed reads, the next upload should try again
+        save_entry(path, codes, found, message, msg_type)
+        evict(cache_dir, max_bytes)
+    return codes, found, message, msg_type
+
+
+def mapped_index_cached(file, possible_names, columns: dict[str, list[str]] = ACTIVE_LIST_COLUMNS, cache_dir: Path = CACHE_DIR,
+                        max_bytes: int = MAX_CACHE_BYTES, index_dir: Path = INDEX_DIR) -> tuple[ActiveIndex | MappedActiveIndex, str, str]:
+    """ The active list as a MappedActiveIndex file in the cache, keyed like read_columns_cached.
+        Every session and process asking for the same list maps the same file, so the OS holds its pages once.
+        file can also be an index written by active_index.export_active_list, which is copied in as it is.
+        A list that codes were appended to (see append_codes) gives its index in index_dir instead.
+        A list whose column can't be read gives an empty in-memory ActiveIndex with read_column's error.
+    """
+    data = file_bytes(file)
+    key = cache_key(data, possible_names, columns)
+    appended = Path(index_dir) / f"{key}.pluidx"
+    if appended.exists():
+        index = MappedActiveIndex(appended)
+        return index, index.message, index.msg_type
+
+    path = Path(cache_dir) / f"{key}.pluidx"
+    if path.exists():
+        try:
+            index = MappedActiveIndex(path)
+            os.utime(path)     # Mark as recently used for eviction
+            instrument.count("list cache hits")
+            return index, index.message, index.msg_type
+        except Exception:
+            path.unlink(missing_ok=True)   # Corrupt or partly written entry, rebuild it below
+
+    instrument.count("list cache misses")
+    if is_index_file(data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_suffix(f".{os.getpid()}.tmp")
+        temp.write_bytes(data)
+        MappedActiveIndex(temp)     # Raises on a damaged export before it is cached
+        os.replace(temp, path)
+        index = MappedActiveIndex(path)
+    else:
+        codes, found, message, msg_type = read_columns(io.BytesIO(data), possible_names, columns)
+        if msg_type == "error":    # Don't keep failed reads, the next upload should try again
+            return ActiveIndex(codes), message, msg_type
+        index = MappedActiveIndex.build(codes, path, message, msg_type, found)
+    evict(cache_dir, max_bytes)
+    return index, index.message, index.msg_type
+
+
+def appended_index_path(file, possible_names, columns: dict[str, list[str]] = ACTIVE_LIST_COLUMNS,
+                        index_dir: Path = INDEX_DIR) -> Path:
+    """ Where append_codes keeps this active list plus the codes appended to it"""
+    return Path(index_dir) / f"{cache_key(file_bytes(file), possible_names, columns)}.pluidx"
+
+
+def appended_index(file, possible_names, columns: dict[str, list[str]] = ACTIVE_LIST_COLUMNS,
+                   index_dir: Path = INDEX_DIR) -> MappedActiveIndex | None:
+    """ The index in index_dir holding this active list plus the codes appended to it, or None if there is none"""
+    path = appended_index_path(file, possible_names, columns, index_dir)
+    return MappedActiveIndex(path) if path.exists() else None
+
+
+def append_codes(index: MappedActiveIndex, added: list, added_columns: dict[str, list[str]] | None = None,
+                 index_dir: Path = INDEX_DIR) -> MappedActiveIndex:
+    """ Add codes to a cached index's copy in index_dir, made from the cache entry the first time.
+        The copy is what mapped_index_cached and appended_index return for the list from then on.
+    """
+    path = Path(index_dir) / index.path.name
+    with index_lock(path):
+        if not path.exists():       # Written from the mapped arrays, in case eviction removed the entry's file
+            columns = {field: tuple(map(np.asarray, arrays)) for field, arrays in index.columns.items()}
+            MappedActiveIndex.write(path, np.asarray(index.codes), np.asarray(index.rows), index.header, columns)
+    return MappedActiveIndex(path).apply_delta(added, added_columns=added_columns)
+
+
+def save_entry(path: Path, codes: list[str], columns: dict[str, list[str]], message: str, msg_type: str):
+    """ Codes and each other column in row order are stored as NUL separated utf-8 blobs, so row positions survive
+        the round trip
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    blobs = {f"column_{field}": text_blob(values) for field, values in columns.items()}
+    temp = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temp, "wb") as f:
+        np.savez(f, codes=text_blob(codes), rows=np.array(len(codes)), message=np.array(message),
+                 msg_type=np.array(msg_type), **blobs)
+    os.replace(temp, path)     # Atomic, so other sessions never see half an entry
+
+
+def load_entry(path: Path) -> tuple[list[str], dict[str, list[str]], str, str]:
+    with np.load(path, allow_pickle=False) as entry:
+        rows = int(entry["rows"])
+        blobs = {"codes": entry["codes"], **{name: entry[name] for name in entry.files if name.startswith("column_")}}
+        found = {name: blob.tobytes().decode().split(SEPARATOR) if rows else [] for name, blob in blobs.items()}
+        for name, values in found.items():
+            if len(values) != rows:
+                raise ValueError(f"Cache entry {path.name} holds {len(values)} {name}, expected {rows}")
+        codes = found.pop("codes")
+        return codes, {name.removeprefix("column_"): values for name, values in found.items()}, str(entry["message"]), str(entry["msg_type"])
+
+
+def text_blob(values: list[str]) -> np.ndarray:
+    return np.frombuffer(SEPARATOR.join(values).encode(), dtype=np.uint8)
+
+
+def cache_entries(cache_dir: Path = CACHE_DIR) -> list[dict]:
+    """ Every cached active list, most recently used first"""
+    entries = []
+    for path in Path(cache_dir).glob("*"):
+        if path.suffix not in ENTRY_SUFFIXES:
+            continue
+        stat = path.stat()
+        entries.append({"key": path.stem, "bytes": stat.st_size, "last_used": stat.st_mtime, "path": str(path)})
+    return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+
+def evict(cache_dir: Path = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES) -> int:
+    """ Delete least recently used entries until the cache fits in max_bytes. Returns how many were removed"""
+    entries = cache_entries(cache_dir)
+    total = sum(entry["bytes"] for entry in entries)
+    removed = 0
+    while entries and total > max_bytes:
+        oldest = entries.pop()
+        Path(oldest["path"]).unlink(missing_ok=True)
+        total -= oldest["bytes"]
+        removed += 1
+    return removed
+
+
+def clear_cache(cache_dir: Path = CACHE_DIR) -> int:
+    """ Delete every cached active list. Returns how many were removed"""
+    entries = cache_entries(cache_dir)
+    for entry in entries:
+        Path(entry["path"]).unlink(missing_ok=True)
+    return len(entries)
+
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Inspect or clear the cached PLU Active Lists")
+    arg_parser.add_argument("--dir", type=Path, default=CACHE_DIR)
+    arg_parser.add_argument("--clear", action="store_true", help="delete every cached list")
+    args = arg_parser.parse_args()
+
+    if args.clear:
+        print(f"Removed {clear_cache(args.dir)} cached list(s) from {args.dir}")
+    else:
+        entries = cache_entries(args.dir)
+        for entry in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))
+            print(f"{entry['key'][:16]}  {entry['bytes']:>12,} bytes  last used {last_used}")
+        print(f"{len(entries)} cached list(s), {sum(entry['bytes'] for entry in entries):,} bytes in {args.dir}")
@@ -1,12 +1,19 @@
+import csv
+import io
+from pathlib import Path
+import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
 from product_class import Product
 from decimal import Decimal
 from collections import Counter, defaultdict
-import streamlit as st
 from fix_products import update_all_products
 from clothing_class import Clothing
 from fix_clothing import update_all_clothing
+from active_index import ActiveIndex, MappedActiveIndex
+from item_table import ItemTable
 from tools import *
+import instrument
 
 
 NEW_PRODUCTS_GARDEN = "Spreadsheets/0107025 GARDEN FRESH.xlsx" 
@@ -16,184 +23,342 @@ CLOTHING_UPLOAD = "Spreadsheets/lothing upload example.xlsx"
 FULL_CLOTHING = "Spreadsheets/full_clothing_listing.xlsx"
 BAD_PROD_UPLOAD = "Spreadsheets/NG New Product 080425.xlsx"
 
+WORKBOOK_MAGIC = (b"PK\x03\x04", b"\xd0\xcf\x11\xe0")     # xlsx (a zip) and old binary xls
+WORKBOOK_SUFFIXES = (".xlsx", ".xlsm", ".xls")
+CSV_SUFFIXES = (".csv", ".txt")
+CSV_ENCODINGS = ("utf-8-sig", "cp1252")                      # UTF-8 with or without BOM, then Excel's "CSV" on Windows
 
-def load_products(path: str) -> tuple[list[Product], list[tuple[str, str]]]:
-    """Load the new product file into a list of Product class objects"""
-    expected_headers = [name for sublist in PRODUCT_HEADER_MAP.values() for name in sublist]
-    header_row = detect_header_row(path, expected_headers)
-    df = pd.read_excel(path, header=header_row)
+
+class LoadedFile:
+    """ Everything read from a single upload: the raw cell grid, the detected header row,
+        the normalized DataFrame and the Product/Clothing objects built from it.
+    """
+    def __init__(self, grid: pd.DataFrame, header_row: int, df: pd.DataFrame, headers: HeaderResolution,
+                 items: list, messages: list[tuple[str, str]]):
+        self.grid = grid
+        self.header_row = header_row
+        self.df = df
+        self.headers = headers
+        self.items = items
+        self.messages = messages
+
+
+    def __repr__(self):
+        return f"LoadedFile: {len(self.items)} items, header on row {self.header_row}"
+
+
+@instrument.timed()
+def read_upload(path, header_map: dict[str, list[str]]) -> tuple[pd.DataFrame, int, pd.DataFrame]:
+    """ Parse the workbook once and return the raw cell grid, the detected header row
+        and the DataFrame with normalized headers.
+    """
+    with instrument.stage("read workbook"):
+        grid = pd.read_excel(path, header=None)
+    instrument.count("upload rows", len(grid))
+    expected_headers = [name for sublist in header_map.values() for name in sublist]
+    header_row = detect_header_row(grid, expected_headers)
+    df = frame_from_grid(grid, header_row)
     df.columns = [normalize_header(c) for c in df.columns]
+    return grid, header_row, df
+
 
+def is_csv_upload(file, name: str | None = None) -> bool:
+    """ Whether a path, bytes or file-like upload is CSV text rather than an Excel workbook.
+        The extension of a path (or of name, for bytes and file-likes) decides when it is one of either,
+        otherwise the first bytes do.
+    """
+    suffix = Path(name if name is not None else file if isinstance(file, (str, Path)) else "").suffix.lower()
+    if suffix in CSV_SUFFIXES + WORKBOOK_SUFFIXES:
+        return suffix in CSV_SUFFIXES
+    if isinstance(file, (bytes, bytearray)):
+        start = bytes(file[:4])
+    elif isinstance(file, (str, Path)):
+        with open(file, "rb") as f:
+            start = f.read(4)
+    else:
+        start = file.read(4)
+        file.seek(0)
+    return start not in WORKBOOK_MAGIC
+
+
+def csv_text(data: bytes) -> str:
+    for encoding in CSV_ENCODINGS[:-1]:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return data.decode(CSV_ENCODINGS[-1], errors="replace")
+
+
+@instrument.timed()
+def read_csv_upload(path, header_map: dict[str, list[str]]) -> tuple[pd.DataFrame, int, pd.DataFrame]:
+    """ read_upload for a CSV copy of the supplier sheet. Title rows above the headers can be shorter than the data,
+        so rows are padded to the widest one. The grid is read as text to find the header row, then the rows below it
+        are read again so pandas types each column from its values alone, as read_excel's data columns are.
+    """
+    data = path if isinstance(path, (bytes, bytearray)) else path.read() if hasattr(path, "read") else Path(path).read_bytes()
+    text = csv_text(bytes(data))
+    width = max(map(len, csv.reader(io.StringIO(text))), default=0)
+    if not width:
+        return pd.DataFrame(), 0, pd.DataFrame()
+
+    with instrument.stage("read csv"):
+        grid = pd.read_csv(io.StringIO(text), header=None, names=range(width), dtype=str, skip_blank_lines=False)
+        filled = np.flatnonzero(grid.notna().any(axis=1).to_numpy())
+        grid = grid.iloc[:filled[-1] + 1] if len(filled) else grid.iloc[:0]      # pandas drops trailing blank rows
+    instrument.count("upload rows", len(grid))
+    expected_headers = [name for sublist in header_map.values() for name in sublist]
+    header_row = detect_header_row(grid, expected_headers)
+    df = pd.read_csv(io.StringIO(text), header=None, names=range(width), skiprows=header_row + 1, skip_blank_lines=False,
+                     nrows=max(len(grid) - header_row - 1, 0))
+    df.columns = [normalize_header(c) for c in column_names(grid.iloc[header_row].tolist())]
+    return grid, header_row, df
+
+
+def frame_from_grid(grid: pd.DataFrame, header_row: int) -> pd.DataFrame:
+    """ Same result as pd.read_excel(path, header=header_row), built from the already read cell grid.
+        The rows go through the TextParser read_excel itself uses, so numeric text like "0123" is typed
+        from the data rows alone, as it is when the header row is read as the header.
+    """
+    if grid.empty:
+        return pd.DataFrame()
+
+    return TextParser(grid.astype(object).where(grid.notna(), "").values.tolist()[header_row:], header=0,
+                      skip_blank_lines=False).read()
+
+
+def column_names(header_values: list) -> list:
+    """ DataFrame column names for a header row, as pd.read_excel names them"""
+    headers = []
+    seen = Counter()
+    for i, value in enumerate(header_values):
+        name = f"Unnamed: {i}" if pd.isna(value) else value
+        headers.append(name if seen[name] == 0 else f"{name}.{seen[name]}")   # Mirror pandas renaming of repeated headers
+        seen[name] += 1
+    return headers
+
+
+def load_upload(path, file_type: str, name: str | None = None) -> LoadedFile:
+    """ Read a Product or Clothing upload exactly once and build its objects from the same DataFrame.
+        path can be an xlsx or a CSV file, as a path or a file-like object. name is the file name of a file-like.
+    """
+    if file_type == "Product":
+        header_map, loader = PRODUCT_HEADER_MAP, load_products
+    elif file_type == "Clothing":
+        header_map, loader = CLOTHING_HEADER_MAP, load_clothing
+    else:
+        raise ValueError(f"Unknown file type: {file_type}")
+
+    reader = read_csv_upload if is_csv_upload(path, name) else read_upload
+    grid, header_row, df = reader(path, header_map)
+    headers = HeaderResolution(df, header_map)      # Resolved once, reused by the loader and the fixers
+    items, messages = loader(df, headers)
+    return LoadedFile(grid, header_row, df, headers, items, messages)
+
+
+@instrument.timed()
+def load_products(path, headers: HeaderResolution | None = None) -> tuple[list[Product], list[tuple[str, str]]]:
+    """ Load the new product file into a list of Product class objects.
+        path can also be a DataFrame already returned by read_upload, which skips reading the file again.
+        Pass the DataFrame's HeaderResolution if it has one, otherwise the columns are resolved here.
+    """
+    if isinstance(path, pd.DataFrame):
+        df = path
+    else:
+        _, _, df = read_upload(path, PRODUCT_HEADER_MAP)
 
-    print(df.head(5))
-    print(df.columns.tolist())
-    messages = []
-    
     # Pre-resolve all needed column names
-    col_map = {}
-    for key in PRODUCT_HEADER_MAP:
-        col, msg, msg_type = find_column(df, PRODUCT_HEADER_MAP[key])
-        col_map[key] = col  # May be None if not found
-        if msg:
-            messages.append((msg, msg_type))
-
-    # print("\n=== Final resolved columns ===")
-    # for key, val in col_map.items():    
-    #     print(f"{key}: {val}")
-
-
-    # Build Product objects using resolved column names
-    products = []
-    for idx, row in df.iterrows():
-        line_number = idx + 2
-        product = Product(
-            code = row.get(col_map["plu_code"]),
-            description = row.get(col_map["description"]),
-            subgroup = row.get(col_map["subgroup"]),
-            supplier_code = row.get(col_map["supplier_code"]),
-            season = row.get(col_map["season"]),
-            main_supplier = row.get(col_map["main_supplier"]),
-            cost_price = row.get(col_map["cost_price"]),
-            barcode = row.get(col_map["barcode"]),
-            vat_rate = row.get(col_map["vat_rate"]),
-            rrp = row.get(col_map["rrp"]),
-            sell_price = row.get(col_map["sell_price"]),
-            stg_price = row.get(col_map["stg_price"]),
-            tarriff = row.get(col_map["tarriff"]),
-            web = row.get(col_map["web"]),
-            idx = line_number
-        )
-        products.append(product)
-
-    return products, messages
-
-
-def load_clothing(path: str) -> tuple[list[Clothing], list[tuple[str, str]]]:
-    """Load the new clothing file into a list of Clothing class objects"""
-    expected_headers = [name for sublist in CLOTHING_HEADER_MAP.values() for name in sublist]
-    header_row = detect_header_row(df, expected_headers)  # <- use your existing detection function
-    df = pd.read_excel(path, header=header_row)
-    df.columns = df.columns.str.lower().str.strip().str.replace(" ", "")
-    df.columns = [normalize_header(col) for col in df.columns]
-
-    messages = []
-    col_map = {}
+    if headers is None:
+        headers = HeaderResolution(df, PRODUCT_HEADER_MAP)
+
+    # Build Product objects column by column: each resolved column is pulled out once, then zipped together
+    columns = item_columns(df, headers.columns)
+    lines = (df.index + 2).tolist()
+    products = [
+        Product(*values, idx=line)     # PRODUCT_HEADER_MAP keys are listed in Product constructor order
+        for *values, line in zip(*columns.values(), lines)
+    ]
+    instrument.count("items loaded", len(products))
+
+    return products, headers.messages
+
+
+@instrument.timed()
+def load_clothing(path, headers: HeaderResolution | None = None) -> tuple[list[Clothing], list[tuple[str, str]]]:
+    """ Load the new clothing file into a list of Clothing class objects.
+        path can also be a DataFrame already returned by read_upload, which skips reading the file again.
+        Pass the DataFrame's HeaderResolution if it has one, otherwise the columns are resolved here.
+    """
+    if isinstance(path, pd.DataFrame):
+        df = path
+    else:
+        _, _, df = read_upload(path, CLOTHING_HEADER_MAP)
 
     # Step 1: Resolve headers
-    for key, possible_names in CLOTHING_HEADER_MAP.items():
-        col, msg, msg_type = find_column(df, possible_names)
-        if msg:
-            messages.append((msg, msg_type))
-        col_map[key] = col
+    if headers is None:
+        headers = HeaderResolution(df, CLOTHING_HEADER_MAP)
 
     # Step 2: Check for required columns
+    check_required_columns(headers.columns)
+
+    # Step 3: Build clothing objects column by column
+    columns = item_columns(df, headers.columns)
+    lines = (df.index + 2).tolist()
+    clothes = [
+        Clothing(*values, idx=line)    # CLOTHING_HEADER_MAP keys are listed in Clothing constructor order
+        for *values, line in zip(*columns.values(), lines)
+    ]
+    instrument.count("items loaded", len(clothes))
+
+    return clothes, headers.messages
+
+
+
+
+@instrument.timed()
+def load_table(path, file_type: str, headers: HeaderResolution | None = None) -> tuple[ItemTable, list[tuple[str, str]]]:
+    """ Load an upload into a column-backed ItemTable instead of Product/Clothing objects.
+        path can also be a DataFrame already returned by read_upload, with its HeaderResolution if it has one.
+    """
+    if file_type == "Product":
+        header_map, id_attr = PRODUCT_HEADER_MAP, "plu_code"
+    elif file_type == "Clothing":
+        header_map, id_attr = CLOTHING_HEADER_MAP, "style_code"
+    else:
+        raise ValueError(f"Unknown file type: {file_type}")
+
+    if isinstance(path, pd.DataFrame):
+        df = path
+    else:
+        _, _, df = read_upload(path, header_map)
+
+    if headers is None:
+        headers = HeaderResolution(df, header_map)
+    if file_type == "Clothing":
+        check_required_columns(headers.columns)
+    return ItemTable.from_frame(df, headers.columns, id_attr), headers.messages
+
+
+def check_required_columns(col_map: dict[str, str | None]):
+    """ Clothing uploads can't be checked without these columns"""
     for key, col in col_map.items():
         if col is None and key in ["style_code", "description"]:  # Add more keys if needed
             raise ValueError(f"Missing required column: {key}")
 
-    # Step 3: Build clothing objects
-    clothes = []
-    for idx, row in df.iterrows():
-        line_number = idx + 2
-        clothing = Clothing(
-            code=row.get(col_map["style_code"]),
-            description=row.get(col_map["description"]),
-            size=row.get(col_map["size"]),
-            colour=row.get(col_map["colour"]),
-            subgroup=row.get(col_map["subgroup"]),
-            supplier_code=row.get(col_map["supplier_code"]),
-            season=row.get(col_map["season"]),
-            main_supplier=row.get(col_map["main_supplier"]),
-            cost_price=row.get(col_map["cost_price"]),
-            barcode=row.get(col_map["barcode"]),
-            vat_rate=row.get(col_map["vat_rate"]),
-            rrp=row.get(col_map["rrp"]),
-            sell_price=row.get(col_map["sell_price"]),
-            stg_price=row.get(col_map["stg_price"]),
-            tarriff=row.get(col_map["tarriff"]),
-            brand=row.get(col_map["brand"]),
-            product_type=row.get(col_map["product_type"]),
-            web=row.get(col_map["web"]),
-            country=row.get(col_map["country"]),
-            country_code=row.get(col_map["country_code"]),
-            idx=line_number
-        )
-        clothes.append(clothing)
-
-    return clothes, messages
-
-
-
-
-def check_duplicates(items: list[Product | Clothing], full_list: list, attr: str) -> dict[int, int]:
+
+def item_values(items: list[Product | Clothing] | ItemTable, attr: str) -> tuple[list, list[int]]:
+    """ Values of one attribute and the matching Excel lines, from either a list of objects or an ItemTable"""
+    if isinstance(items, ItemTable):
+        return items.column(attr).tolist(), items.lines.tolist()
+    return [getattr(item, attr, None) for item in items], [item.excel_line for item in items]
+
+
+def item_columns(df: pd.DataFrame, col_map: dict[str, str | None]) -> dict[str, list]:
+    """ Pull every resolved column out of the DataFrame once as a plain list, keyed like col_map.
+        Columns that weren't found are filled with None, the same as row.get gave for them.
+    """
+    missing = [None] * len(df)
+    return {key: df[col].tolist() if col is not None else missing for key, col in col_map.items()}
+
+
+@instrument.timed()
+def check_duplicates(items: list[Product | Clothing] | ItemTable, full_list: list | ActiveIndex | MappedActiveIndex, attr: str) -> dict[int, int]:
     """ Returns dictionary of what item codes are already used in the full list.
-        attr should be entered as the class variable name 
+        attr should be entered as the class variable name.
+        full_list can be the list from read_column or a prebuilt ActiveIndex/MappedActiveIndex (preferred, avoids rebuilding).
     """
-    duplicates = {}
-    for item in items:
-        value = normalizer((getattr(item, attr, None)))
-        if value in full_list:
-            duplicates[value] = full_list.index(value)
-    return duplicates
+    if not isinstance(full_list, (ActiveIndex, MappedActiveIndex)):
+        full_list = ActiveIndex(full_list)
 
+    values, _ = item_values(items, attr)
+    codes = [normalizer(value) for value in values]
+    positions = full_list.first_many(codes)     # One probe over the whole column, vectorized for MappedActiveIndex
+    return {codes[i]: int(positions[i]) for i in np.flatnonzero(positions >= 0)}
 
-def duplicate_barcodes(items: list[Product | Clothing], attr:str) -> list[str]:
-    """ Checks to see if any products in new product file has the same barcodes."""
-    barcode_to_code = defaultdict(list)
-    error_list = []
 
-    for item in items:
-        if item.barcode:  # Skip empty or None
-            id = normalizer(getattr(item, attr, None))
-            barcode_to_code[item.barcode].append((id, item.excel_line))
+def group_positions(keys: list) -> dict[object, list[int]]:
+    """ Single pass grouping index: key -> every position it appears at, in file order"""
+    groups = defaultdict(list)
+    for position, key in enumerate(keys):
+        groups[key].append(position)
+    return groups
+
+
+def duplicate_lines(items: list[Product | Clothing] | ItemTable, attr: str) -> dict[str, list[int]]:
+    """ Normalized code -> Excel lines, for every code that appears on more than one line.
+        This is what check_internal_duplicates reports, in a form the UI can render directly.
+    """
+    values, lines = item_values(items, attr)
+    groups = group_positions([normalizer(value) for value in values])
+    return {code: [lines[i] for i in positions] for code, positions in groups.items() if len(positions) > 1}
+
 
-    for barcode, codes in barcode_to_code.items():
-        if len(codes) > 1:
-            detail = ", ".join([f"{code} (line {line})" for code, line in codes])
-            error_list.append(f"Barcode {barcode} is shared by: {detail}")
-            # print(f"Barcode {barcode} is shared by Products: {plu_list}")
-            # st.write(f"Barcode {barcode} is shared by Products: {plu_list}")
+def barcode_groups(items: list[Product | Clothing] | ItemTable, attr: str) -> dict[object, list[tuple[str, int]]]:
+    """ Barcode -> (code, Excel line) of every item sharing it, for barcodes used more than once.
+        attr is the code shown for each item.
+    """
+    barcodes, lines = item_values(items, "barcode")
+    ids, _ = item_values(items, attr)
+    groups = group_positions(barcodes)
+    return {
+        barcode: [(normalizer(ids[i]), lines[i]) for i in positions]
+        for barcode, positions in groups.items()
+        if barcode and len(positions) > 1  # Skip empty or None
+    }
+
+
+def clothing_duplicate_lines(items: list[Clothing] | ItemTable) -> dict[tuple, list[int]]:
+    """ (style code, size, colour) -> Excel lines, for every combination that appears on more than one line"""
+    styles, lines = item_values(items, "style_code")
+    sizes, _ = item_values(items, "size")
+    colours, _ = item_values(items, "colour")
+    groups = group_positions(list(zip(styles, sizes, colours)))
+    return {key: [lines[i] for i in positions] for key, positions in groups.items() if len(positions) > 1}
+
+
+def duplicate_barcodes(items: list[Product | Clothing] | ItemTable, attr:str) -> list[str]:
+    """ Checks to see if any products in new product file has the same barcodes."""
+    error_list = []
+    for barcode, codes in barcode_groups(items, attr).items():
+        detail = ", ".join([f"{code} (line {line})" for code, line in codes])
+        error_list.append(f"Barcode {barcode} is shared by: {detail}")
 
     if len(error_list) > 0:
         return error_list
     return None
 
 
-def check_internal_duplicates(items: list[Product | Clothing], attr:str) -> dict[int, int]:
+def check_internal_duplicates(items: list[Product | Clothing] | ItemTable, attr:str) -> list[str]:
     """ Checks if there are any duplicate codes within the new file
         attr should be entered as the class variable name """
-    errors = []
-    values = [normalizer(getattr(item, attr, None)) for item in items]
-    counts = Counter(values)
-    for code, count in counts.items():
-        if count > 1:
-            lines = [item.excel_line for item in items if normalizer(getattr(item, attr, None)) == code]
-            errors.append(f"Code: {code} appears {count} times on lines {lines}")
-    return errors
+    return [f"Code: {code} appears {len(lines)} times on lines {lines}" for code, lines in duplicate_lines(items, attr).items()]
 
 
-def check_clothing_duplicates(items: list[Clothing]):
+def check_clothing_duplicates(items: list[Clothing] | ItemTable):
     """ Check if there are duplicate clothing items within a new file. 
         Clothing is done differently since there can be multiple style codes with different sizes.
+        Every repeat after the first is reported, in line order.
     """
-    exists = set()
-    errors = []
-
-    for item in items:
-        key = (item.style_code, item.size, item.colour)
-        if key in exists:
-            errors.append(f"Duplicate Style {item.style_code} with size {item.size} on line {item.excel_line}")
-        else:
-            exists.add(key)
-    return errors
+    repeats = sorted(
+        (line, style_code, size)
+        for (style_code, size, _), lines in clothing_duplicate_lines(items).items()
+        for line in lines[1:]
+    )
+    return [f"Duplicate Style {style_code} with size {size} on line {line}" for line, style_code, size in repeats]
 
 
 
+@instrument.timed()
 def detect_header_row(file_path, expected_headers, max_rows=10):
-    preview_df = pd.read_excel(file_path, header=None, nrows=max_rows)
+    """ Find the row holding the column headers. file_path can also be a grid already read with header=None"""
+    if isinstance(file_path, pd.DataFrame):
+        preview_df = file_path.head(max_rows)
+    else:
+        preview_df = pd.read_excel(file_path, header=None, nrows=max_rows)
 
     best_row = 0
     best_score = 0
+    matcher = header_matcher(tuple(expected_headers))
 
     # print("===== SCANNING HEADER CANDIDATES =====")
     for i in range(min(max_rows, len(preview_df))):
@@ -203,13 +368,9 @@ def detect_header_row(file_path, expected_headers, max_rows=10):
         # print(f"\nRow {i}: {row}")
         # print(f"Normalized: {normalized_row}")
 
-        matches = 0
-        for header in expected_headers:
-            norm_header = normalize_header(header)
-            best_header_score = max(char_match(norm_header, col) for col in normalized_row)
-            if best_header_score >= THRESHOLD:
-                matches += 1
-            # print(f"→ Checking header '{header}' (normalized: '{norm_header}') → best score: {best_header_score:.2f}")
+        # Score every cell against every expected header at once, then take each header's best cell
+        best_header_scores = matcher.scores(normalized_row).max(axis=0)
+        matches = int((best_header_scores >= THRESHOLD).sum())
 
         match_ratio = matches / len(expected_headers)
         # print(f"Match ratio for row {i}: {match_ratio:.2f}")
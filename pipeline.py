@@ -0,0 +1,118 @@
+""" Validate many uploads with reading, checking and writing overlapped, instead of one upload after another.
+
+batch.validate_all works through each upload start to finish: read the file, parse it, check it, fix it, write the
+fixed copy, then the next. Here those run as three asyncio stages joined by bounded queues:
+
+    read (I/O thread)  ->  parse, check, fix, export (worker processes)  ->  write (I/O thread)
+
+While one upload is checked, the next is read from disk and the previous one's fixed file is written. concurrency is
+how many uploads are checked at once, each in its own worker process sharing one memory-mapped active list index.
+The queues hold at most queue_size uploads, so a slow stage holds back the ones before it and memory stays bounded.
+The stages run in one TaskGroup: when one fails (a worker process dies, a fixed file can't be written) the others are
+cancelled and its error is raised, instead of the rest waiting forever on a queue nobody empties.
+Results are the same as validate_all's, in the same order.
+"""
+import asyncio
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+import batch
+from active_index import ActiveIndex, MappedActiveIndex
+import instrument
+
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_QUEUE_SIZE = 4
+IO_THREADS = 2          # Disk reads and writes, which release the GIL
+
+
+def check_in_worker(data: bytes, name: str, file_type: str, file_format: str, export: bool,
+                    profile: bool) -> tuple[dict, bytes | None]:
+    """ batch.validate_data in a worker process, against the index init_worker mapped there"""
+    with instrument.profiling() if profile else nullcontext() as recorded:
+        result, fixed = batch.validate_data(data, name, file_type, batch.worker_index, file_format, export)
+    if profile:
+        result["profile"] = recorded.as_dict()
+    return result, fixed
+
+
+async def read_stage(paths: list[Path], io_pool: ThreadPoolExecutor, uploads: asyncio.Queue, checkers: int):
+    loop = asyncio.get_running_loop()
+    for position, path in enumerate(paths):
+        try:
+            data = await loop.run_in_executor(io_pool, path.read_bytes)
+        except OSError as e:
+            data = e
+        await uploads.put((position, path, data))      # Waits here while the check stage is queue_size behind
+    for _ in range(checkers):
+        await uploads.put(None)
+
+
+async def check_stage(uploads: asyncio.Queue, checked: asyncio.Queue, cpu_pool: ProcessPoolExecutor, file_type: str,
+                      file_format: str, export: bool, profile: bool):
+    loop = asyncio.get_running_loop()
+    while (upload := await uploads.get()) is not None:
+        position, path, data = upload
+        if isinstance(data, OSError):
+            result = {"file": path.name, "type": file_type, "status": "failed", "reason": f"{type(data).__name__}: {data}"}
+            fixed = None
+        else:
+            result, fixed = await loop.run_in_executor(cpu_pool, check_in_worker, data, path.name, file_type,
+                                                       file_format, export, profile)
+        await checked.put((position, path, result, fixed))
+
+
+async def write_stage(checked: asyncio.Queue, io_pool: ThreadPoolExecutor, out_dir: Path | None, file_format: str,
+                      results: list, on_result=None):
+    loop = asyncio.get_running_loop()
+    while (item := await checked.get()) is not None:
+        position, path, result, fixed = item
+        if fixed is not None:
+            fixed_path = batch.fixed_file_path(path, out_dir, file_format)
+            await loop.run_in_executor(io_pool, fixed_path.write_bytes, fixed)
+            result["fixed_file"] = fixed_path.name
+        results[position] = result
+        if on_result is not None:
+            on_result(result)
+
+
+async def close_stage(checkers: list[asyncio.Task], checked: asyncio.Queue):
+    """ Tell the write stage there is nothing more once every check stage is done"""
+    await asyncio.wait(checkers)
+    await checked.put(None)
+
+
+async def run_pipeline(paths: list[Path], file_type: str, index_path: Path, out_dir: Path | None,
+                       concurrency: int = DEFAULT_CONCURRENCY, queue_size: int = DEFAULT_QUEUE_SIZE,
+                       file_format: str = "xlsx", profile: bool = False, on_result=None) -> list[dict]:
+    """ Every upload's result, in the order of paths. on_result(result) is called as each one is written.
+        The first stage to fail stops the others, and its error is raised.
+    """
+    results = [None] * len(paths)
+    uploads, checked = asyncio.Queue(maxsize=queue_size), asyncio.Queue(maxsize=queue_size)
+    with (ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="pipeline-io") as io_pool,
+          ProcessPoolExecutor(max_workers=concurrency, initializer=batch.init_worker, initargs=(str(index_path),)) as cpu_pool):
+        try:
+            async with asyncio.TaskGroup() as stages:
+                stages.create_task(write_stage(checked, io_pool, out_dir, file_format, results, on_result))
+                checkers = [
+                    stages.create_task(check_stage(uploads, checked, cpu_pool, file_type, file_format,
+                                                   out_dir is not None, profile))
+                    for _ in range(concurrency)
+                ]
+                stages.create_task(read_stage(paths, io_pool, uploads, concurrency))
+                stages.create_task(close_stage(checkers, checked))
+        except ExceptionGroup as failed:
+            raise failed.exceptions[0]      # The stage failure that cancelled the others
+    return results
+
+
+def validate_pipelined(paths: list[Path], file_type: str, codes: list[str] | ActiveIndex | MappedActiveIndex, out_dir: Path | None,
+                       concurrency: int = DEFAULT_CONCURRENCY, queue_size: int = DEFAULT_QUEUE_SIZE,
+                       file_format: str = "xlsx", profile: bool = False, on_result=None) -> list[dict]:
+    """ validate_all's results for whole-file uploads, from the overlapped pipeline"""
+    with tempfile.TemporaryDirectory(prefix="plu-index-") as index_folder:
+        index_path = batch.shared_index_path(codes, Path(index_folder))
+        return asyncio.run(run_pipeline(paths, file_type, index_path, out_dir, concurrency, queue_size, file_format,
+                                        profile, on_result))
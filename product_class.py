@@ -1,6 +1,5 @@
 from decimal import Decimal
 from collections import Counter, defaultdict
-import streamlit as st
 from tools import *
 
 
@@ -11,6 +10,11 @@ VAT_CODES = {0.0: 0,
 
 
 class Product:
+    # Slots instead of a per-instance __dict__: big catalogue loads hold hundreds of thousands of these.
+    # Use tools.item_fields(product) where vars(product) would have been used.
+    __slots__ = ("plu_code", "description", "subgroup", "supplier_code", "season", "main_supplier", "cost",
+                 "barcode", "vat_rate", "rrp", "sell_price", "stg_price", "tarriff", "web", "excel_line")
+
     def __init__(self, code, description, subgroup, supplier_code, season, 
                  main_supplier, cost_price, barcode, vat_rate, rrp, sell_price, stg_price, tarriff, web, idx=None):
         self.plu_code = code
@@ -41,7 +45,7 @@ class Product:
     def plu_len(self):
         """ Checks if any products have a PLU Code length over 15"""
         if len(str(self.plu_code)) > 15:
-            return f"Line {self.excel_line} \u00A0\u00A0|\u00A0\u00A0 Product: {self.plu_code} has PLU Code length of {len(str(self.plu_code))}. Must be under 15."
+            return plu_len_message(self.plu_code, self.excel_line)
             # print(f"Product: {self.plu_code} has PLU Code length of {len(str(self.plu_code))}. Must be under 15.")
             # st.write(f"Product: {self.plu_code} has PLU Code length of {len(str(self.plu_code))}. Must be under 15.")
 
@@ -85,11 +89,11 @@ class Product:
     #         # st.write(f"Product: {self.plu_code} has decimal place error in {errors}. Must be 2 decimal places or less")
 
 
+def plu_len_message(code, line) -> str:
+    return f"Line {line} \u00A0\u00A0|\u00A0\u00A0 Product: {code} has PLU Code length of {len(str(code))}. Must be under 15."
 
 
-
-
-
-
-
-
+def plu_len_errors(table) -> list[str]:
+    """ Product.plu_len run over the whole plu_code column of an ItemTable"""
+    codes = table.column("plu_code")
+    return [plu_len_message(codes[i], table.lines[i]) for i in table.length_over("plu_code", 15)]
@@ -0,0 +1,190 @@
+""" Registry of the checks run on every upload, and the executor that runs them in one pass over the data.
+
+Rules don't walk the items themselves. They read what they need (normalized codes, groupings, bad character flags)
+from a shared ItemScan, which builds each piece once from whole columns the first time a rule asks for it.
+A new rule that reads columns already in use adds no extra pass over the upload.
+"""
+import time
+from collections import defaultdict
+from parser import *
+from item_table import ItemTable
+import instrument
+
+
+# File type -> [(results title, check, stream factory or None)], in the order results are shown
+RULES = defaultdict(list)
+
+# Code column every rule for a file type reports items by
+ID_ATTRS = {"Product": "plu_code", "Clothing": "style_code"}
+
+
+class ValidationCancelled(Exception):
+    """ Raised from a progress callback to stop a running validation, e.g. when the user swaps files"""
+
+
+def rule(file_type: str, title: str, stream=None):
+    """ Register check(scan) -> messages as a rule for file_type, shown under title.
+        Rules that compare rows across the whole upload also need stream: a factory for an object with
+        feed(scan) -> messages and finish() -> messages, used when the upload is checked batch by batch.
+        Rules that only look at each row on its own just run their check on every batch.
+    """
+    def register(check):
+        RULES[file_type].append((title, check, stream))
+        return check
+    return register
+
+
+class ItemScan:
+    """ Column data shared by every rule in one run. Each piece is built once, on first use, and timed."""
+    def __init__(self, items: list[Product | Clothing] | ItemTable, active_index: ActiveIndex | MappedActiveIndex, id_attr: str):
+        self.active_index = active_index
+        self.id_attr = id_attr
+        self.cache = {}
+        self.timings = {}
+        self.table = self.shared("item table", lambda: items if isinstance(items, ItemTable) else ItemTable.from_items(items, id_attr))
+
+
+    def __repr__(self):
+        return f"ItemScan: {len(self.table)} rows, built {list(self.cache)}"
+
+
+    def shared(self, name: str, build):
+        """ Result of build(), computed the first time name is asked for"""
+        if name not in self.cache:
+            start = time.perf_counter()
+            self.cache[name] = build()
+            self.timings[name] = time.perf_counter() - start
+        return self.cache[name]
+
+
+    def shared_seconds(self) -> float:
+        return sum(self.timings.values())
+
+
+    def lines(self) -> list[int]:
+        return self.shared("lines", lambda: self.table.lines.tolist())
+
+
+    def values(self, attr: str) -> list:
+        """ Raw column values as Python objects"""
+        return self.shared(f"values {attr}", lambda: self.table.column(attr).tolist())
+
+
+    def codes(self, attr: str) -> list[str]:
+        """ Column values passed through normalizer"""
+        return self.shared(f"codes {attr}", lambda: [normalizer(value) for value in self.values(attr)])
+
+
+    def catalogue_keys(self, attr: str) -> list[str]:
+        """ Column values passed through catalogue_key, the form the active list's other columns are indexed in"""
+        return self.shared(f"catalogue keys {attr}", lambda: [catalogue_key(value) for value in self.values(attr)])
+
+
+    def code_groups(self, attr: str) -> dict[str, list[int]]:
+        """ Normalized code -> row positions, in file order"""
+        return self.shared(f"code groups {attr}", lambda: group_positions(self.codes(attr)))
+
+
+    def groups(self, *attrs: str) -> dict[object, list[int]]:
+        """ Raw value (or tuple of values for several attrs) -> row positions, in file order"""
+        def build():
+            keys = self.values(attrs[0]) if len(attrs) == 1 else list(zip(*(self.values(attr) for attr in attrs)))
+            return group_positions(keys)
+        return self.shared(f"groups {', '.join(attrs)}", build)
+
+
+def run_rules(items: list[Product | Clothing] | ItemTable, active_index: ActiveIndex | MappedActiveIndex,
+              file_type: str, progress=None, on_result=None) -> tuple[dict[str, list[str]], dict[str, float]]:
+    """ Run every registered rule for file_type over one shared scan.
+        Returns results keyed by title, and seconds per rule. Column work shared between rules is timed on its own
+        under "shared: <name>", so a rule's time is only its own work.
+        progress(stage, done, total) is called before each rule and may raise ValidationCancelled.
+        on_result(title, messages) is called as each rule finishes, so its results can be shown straight away.
+    """
+    scan = ItemScan(items, active_index, ID_ATTRS[file_type])
+    results, timings = {}, {}
+    rules = RULES[file_type]
+    for done, (title, check, _) in enumerate(rules):
+        if progress:
+            progress(f"Checking {title}", done, len(rules))
+        shared_before = scan.shared_seconds()
+        start = time.perf_counter()
+        results[title] = check(scan)
+        timings[title] = time.perf_counter() - start - (scan.shared_seconds() - shared_before)
+        instrument.record(f"check: {title}", timings[title])
+        if on_result:
+            on_result(title, results[title])
+
+    for name, seconds in scan.timings.items():
+        timings[f"shared: {name}"] = seconds
+        instrument.record(f"check shared: {name}", seconds)
+    return results, timings
+
+
+class RowStream:
+    """ Streamed form of a rule that only looks at each row on its own"""
+    def __init__(self, check):
+        self.check = check
+
+
+    def feed(self, scan: ItemScan) -> list[str]:
+        return self.check(scan) or []
+
+
+    def finish(self) -> list[str]:
+        return []
+
+
+class RuleStream:
+    """ Every registered rule for file_type, run batch by batch over a streamed upload.
+        feed() returns the messages each batch adds straight away. finish() adds what only the whole upload can
+        show (internal duplicates, shared barcodes). Afterwards results matches run_rules on the whole upload.
+    """
+    def __init__(self, file_type: str, active_index: ActiveIndex | MappedActiveIndex):
+        self.active_index = active_index
+        self.id_attr = ID_ATTRS[file_type]
+        self.rules = [(title, stream() if stream else RowStream(check)) for title, check, stream in RULES[file_type]]
+        self.results = {title: [] for title, _ in self.rules}
+        self.timings = dict.fromkeys(self.results, 0.0)
+        self.rows = 0
+
+
+    def __repr__(self):
+        return f"RuleStream: {self.rows} rows, {sum(map(len, self.results.values()))} messages so far"
+
+
+    def feed(self, items: list[Product | Clothing] | ItemTable) -> dict[str, list[str]]:
+        """ Check one batch. Returns the new messages per title"""
+        scan = ItemScan(items, self.active_index, self.id_attr)
+        self.rows += len(scan.table)
+        found = {}
+        for title, stream in self.rules:
+            shared_before = scan.shared_seconds()
+            start = time.perf_counter()
+            found[title] = stream.feed(scan)
+            seconds = time.perf_counter() - start - (scan.shared_seconds() - shared_before)
+            self.timings[title] += seconds
+            instrument.record(f"check: {title}", seconds)
+            self.results[title] += found[title]
+        for name, seconds in scan.timings.items():
+            self.timings[f"shared: {name}"] = self.timings.get(f"shared: {name}", 0.0) + seconds
+            instrument.record(f"check shared: {name}", seconds)
+        return found
+
+
+    def finish(self) -> dict[str, list[str]]:
+        """ Messages that needed every batch. Returns them per title, and completes results"""
+        found = {}
+        for title, stream in self.rules:
+            start = time.perf_counter()
+            found[title] = stream.finish()
+            seconds = time.perf_counter() - start
+            self.timings[title] += seconds
+            instrument.record(f"check: {title}", seconds)
+            if found[title] is None:        # duplicate_barcodes style None for nothing found
+                found[title] = []
+                if not self.results[title]:
+                    self.results[title] = None
+            else:
+                self.results[title] += found[title]
+        return found
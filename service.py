@@ -0,0 +1,328 @@
+""" Local HTTP service that validates supplier uploads against active lists kept indexed in memory.
+
+    python service.py --plu-list PLU-Active-List.xlsx --style-list full_clothing_listing.xlsx [--port 8765] [--workers 2]
+
+    curl --data-binary @upload.xlsx "http://127.0.0.1:8765/validate/Product?name=upload.xlsx"
+    curl http://127.0.0.1:8765/health
+
+Each list (an xlsx, or an index exported by active_index.py) is read and indexed once, then watched. When its file
+changes it is re-read in the background and swapped in, and requests use the old index until the new one is ready.
+The upload is the raw request body, xlsx or CSV. The JSON response has every check under the titles interface.py
+shows (see ERROR_TYPES), each passed with its message or failed with its issues, plus the auto-fixes that would apply.
+An upload with no code column or no rows is answered with 422, never reported as passing.
+Add ?profile=1 for the request's stage timings. Uploads are validated by a bounded pool of worker threads. When every
+worker is busy and the queue is full, a request is turned away at once with 503 and Retry-After, not left waiting.
+"""
+import argparse
+import io
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from parser import *
+from validation import FILE_TYPES, success_message
+from rules import run_rules
+from batch import read_active_index
+from active_index import is_index_file
+from list_cache import appended_index_path
+import instrument
+
+
+DEFAULT_PORT = 8765
+RELOAD_SECONDS = 2.0            # How often list files are checked for changes
+REQUEST_SECONDS = 300           # Longest a request waits for its result
+MAX_UPLOAD_MB = 50
+BUSY = "All workers are busy, try again shortly"
+
+
+class WarmList:
+    """ One active list, indexed in memory and re-read whenever its file changes"""
+    def __init__(self, path: Path, file_type: str):
+        self.path = Path(path)
+        self.file_type = file_type
+        self.index = None
+        self.stamp = None           # (mtime, size) of the files the index was read from
+        self.appended_path = None   # The list's index in list_cache.INDEX_DIR, which the app appends codes to
+        self.loaded_at = None
+        self.loads = 0
+        self.error = None
+        self.lock = threading.Lock()
+        if not self.refresh():
+            raise ValueError(f"Couldn't load {self.path}: {self.error}")
+
+
+    def __repr__(self):
+        return f"WarmList: {self.file_type} from {self.path}, loaded {self.loads} time(s)"
+
+
+    def refresh(self) -> bool:
+        """ Re-read the list if its file changed since the last load. Returns whether a new index was swapped in.
+            A failed read (e.g. a file caught half written) keeps the current index and is tried again next time.
+        """
+        with self.lock:
+            try:
+                stamp = self.file_stamp()
+                if stamp == self.stamp:
+                    return False
+                if self.stamp is None or stamp[0] != self.stamp[0]:     # A changed list file has a different appended index
+                    self.appended_path = None if is_index_file(self.path) else appended_index_path(
+                        self.path, FILE_TYPES[self.file_type][2])
+                    stamp = self.file_stamp()
+                index = read_active_index(self.path, self.file_type)
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                return False
+            self.index, self.stamp, self.error = index, stamp, None
+            self.loaded_at = time.time()
+            self.loads += 1
+            return True
+
+
+    def file_stamp(self) -> tuple:
+        """ (mtime, size) of the list file, then of its appended index (None until codes are first appended)"""
+        stamps = []
+        for path in (self.path, self.appended_path):
+            stat = path.stat() if path is not None and path.exists() else None
+            stamps.append((stat.st_mtime_ns, stat.st_size) if stat else None)
+        return tuple(stamps)
+
+
+    def status(self) -> dict:
+        return {
+            "path": str(self.path),
+            "codes": len(self.index),
+            "columns": list(self.index.columns),
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "loads": self.loads,
+            "error": self.error,
+        }
+
+
+class ValidationPool:
+    """ Worker threads with a bounded queue. submit returns None rather than queue past the bound"""
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="validate")
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+
+    def __repr__(self):
+        return f"ValidationPool: {self.in_flight} in flight, {self.workers} workers + {self.queue_size} queued"
+
+
+    def full(self) -> bool:
+        return self.in_flight >= self.workers + self.queue_size
+
+
+    def submit(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            self.turned_away()
+            return None
+        with self.lock:
+            self.in_flight += 1
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self.release)
+        return future
+
+
+    def turned_away(self):
+        with self.lock:
+            self.rejected += 1
+
+
+    def release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+
+    def status(self) -> dict:
+        return {"workers": self.workers, "queue": self.queue_size, "in_flight": self.in_flight, "rejected": self.rejected}
+
+
+def validate_upload(data: bytes, name: str, file_type: str, active_list: WarmList, profile: bool = False) -> dict:
+    """ Every check and auto-fix on one upload, as the JSON response"""
+    _, code_attr, *_, update_all = FILE_TYPES[file_type]
+    active_index = active_list.index        # The index at the start of this request, even if a reload swaps it
+    with instrument.profiling() if profile else nullcontext() as recorded:
+        upload = load_upload(io.BytesIO(data), file_type, name)
+        if upload.headers[code_attr] is None:     # Anything that isn't a zip or xls parses as CSV, even garbage
+            raise ValueError(f"No {code_attr} column found, {name} doesn't look like a {file_type} upload")
+        if not upload.items:
+            raise ValueError(f"No rows found under the headers of {name}")
+        errors, _ = run_rules(upload.items, active_index, file_type)
+        _, auto_changes = update_all(upload.df, upload.headers)
+
+    result = {
+        "file": name,
+        "type": file_type,
+        "format": "csv" if is_csv_upload(data, name) else "xlsx",
+        "status": "passed" if not any(errors.values()) else "issues",
+        "rows": len(upload.items),
+        "header_row": upload.header_row,
+        "column_messages": [{"type": msg_type, "message": message} for message, msg_type in upload.messages],
+        "checks": {
+            title: {"passed": not found, "message": success_message(title) if not found else f"{len(found)} issue(s)",
+                    "issues": found or []}
+            for title, found in errors.items()
+        },
+        "auto_fixes": auto_changes,
+        "active_list": active_list.status(),
+    }
+    if profile:
+        result["profile"] = recorded.as_dict()
+    return result
+
+
+class ValidationHandler(BaseHTTPRequestHandler):
+    server: "ValidationServer"
+
+    def do_GET(self):
+        if urlparse(self.path).path.rstrip("/") == "/health":
+            self.send_json(200, self.server.status())
+        else:
+            self.send_json(404, {"error": "GET /health, or POST an upload to /validate/<type>"})
+
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        file_type = {name.lower(): name for name in FILE_TYPES}.get(parts[-1].lower()) if len(parts) == 2 else None
+        if parts[0] != "validate" or file_type is None:
+            return self.reject(404, f"POST an upload to /validate/<type>, type one of {list(FILE_TYPES)}")
+        if file_type not in self.server.lists:
+            return self.reject(404, f"No {file_type} active list is loaded")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return self.reject(400, "The request body should be the xlsx or CSV upload")
+        if length > self.server.max_bytes:
+            return self.reject(413, f"Uploads are limited to {self.server.max_bytes // 2**20} MB")
+        if self.server.pool.full():     # Checked before reading the body too, so a busy server doesn't take it in
+            self.server.pool.turned_away()
+            return self.reject(503, BUSY, {"Retry-After": "1"})
+
+        query = parse_qs(url.query)
+        data = self.rfile.read(length)
+        future = self.server.pool.submit(validate_upload, data, query.get("name", ["upload"])[0], file_type,
+                                         self.server.lists[file_type], "profile" in query)
+        if future is None:
+            return self.send_json(503, {"error": BUSY}, {"Retry-After": "1"})
+        try:
+            self.send_json(200, future.result(timeout=self.server.request_seconds))
+        except TimeoutError:
+            self.send_json(504, {"error": f"Validation took over {self.server.request_seconds}s"})
+        except Exception as e:
+            self.send_json(422, {"error": f"{type(e).__name__}: {e}"})
+
+
+    def reject(self, status: int, message: str, headers: dict | None = None):
+        """ Error response without reading the body, so the connection can't be reused"""
+        self.close_connection = True
+        self.send_json(status, {"error": message}, headers)
+
+
+    def send_json(self, status: int, body: dict, headers: dict | None = None):
+        payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class ValidationServer(ThreadingHTTPServer):
+    """ The service. Lists are watched from a background thread until server_close()"""
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], lists: dict[str, WarmList], workers: int = 2, queue_size: int = 8,
+                 reload_seconds: float = RELOAD_SECONDS, request_seconds: float = REQUEST_SECONDS,
+                 max_bytes: int = MAX_UPLOAD_MB * 2**20, quiet: bool = False):
+        super().__init__(address, ValidationHandler)
+        self.lists = lists
+        self.pool = ValidationPool(workers, queue_size)
+        self.request_seconds = request_seconds
+        self.max_bytes = max_bytes
+        self.quiet = quiet
+        self.stopping = threading.Event()
+        self.watcher = threading.Thread(target=self.watch, args=(reload_seconds,), name="list-watcher", daemon=True)
+        self.watcher.start()
+
+
+    def __repr__(self):
+        return f"ValidationServer: {self.url} with {list(self.lists)} lists"
+
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def watch(self, seconds: float):
+        while not self.stopping.wait(seconds):
+            for active_list in self.lists.values():
+                if active_list.refresh():
+                    print(f"Reloaded {active_list.file_type} list: {len(active_list.index)} codes", file=sys.stderr)
+
+
+    def status(self) -> dict:
+        return {"status": "ok", "lists": {name: active_list.status() for name, active_list in self.lists.items()},
+                "pool": self.pool.status()}
+
+
+    def server_close(self):
+        self.stopping.set()
+        super().server_close()
+        self.pool.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--plu-list", type=Path, help="PLU Active List .xlsx or exported index, for Product uploads")
+    arg_parser.add_argument("--style-list", type=Path, help="clothing listing .xlsx or exported index, for Clothing uploads")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="0 picks a free port")
+    arg_parser.add_argument("--workers", type=int, default=2, help="uploads validated at once")
+    arg_parser.add_argument("--queue", type=int, default=8, help="uploads waiting for a worker before 503s")
+    arg_parser.add_argument("--reload-seconds", type=float, default=RELOAD_SECONDS, help="how often list files are checked")
+    arg_parser.add_argument("--max-mb", type=int, default=MAX_UPLOAD_MB, help="largest upload accepted")
+    args = arg_parser.parse_args(argv)
+
+    sources = {"Product": args.plu_list, "Clothing": args.style_list}
+    if not any(sources.values()):
+        arg_parser.error("give --plu-list, --style-list or both")
+    lists = {file_type: WarmList(path, file_type) for file_type, path in sources.items() if path}
+
+    server = ValidationServer((args.host, args.port), lists, args.workers, args.queue, args.reload_seconds,
+                              max_bytes=args.max_mb * 2**20)
+    print(f"Serving on {server.url} ({', '.join(f'{name}: {len(active_list.index)} codes' for name, active_list in lists.items())})",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+""" Read a large upload in row batches with openpyxl's read-only mode, instead of pd.read_excel's whole sheet.
+
+UploadStream makes two passes over the sheet. The first finds the header row and settles each column's dtype from
+the dtypes TextParser gives it batch by batch. The second yields DataFrame batches typed the same way, so numeric text
+like "0123" and every other code normalizes as it does in read_upload's DataFrame. Peak memory is one batch plus
+openpyxl's shared strings table, whatever the row count. sheet_row_count tells the app when an upload is big enough
+to need this.
+"""
+import io
+import re
+import zipfile
+from itertools import chain, islice
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+from parser import detect_header_row, column_names, frame_from_grid
+from export import first_sheet_part
+from tools import *
+import instrument
+
+
+STREAM_BATCH_ROWS = 5000    # Rows per DataFrame batch
+HEADER_SCAN_ROWS = 10       # Rows detect_header_row looks at, as in read_upload
+DIMENSION = re.compile(rb'<dimension\b[^>]*\bref="[A-Z]*\d*:?[A-Z]*(\d+)"')
+
+# pandas' default na_values, and openpyxl's ERROR_CODES. Spelled out so importing this module doesn't load openpyxl
+NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+    "#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!",
+})
+
+
+def cell_value(value):
+    """ A cell as pd.read_excel sees it: whole numbers become ints, NA strings and Excel errors become NaN"""
+    if value is None:
+        return np.nan
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str) and value in NA_STRINGS:
+        return np.nan
+    return value
+
+
+def row_values(raw_row: tuple) -> list:
+    """ Converted cells of one sheet row, with trailing empty cells dropped like pandas does"""
+    end = len(raw_row)
+    while end and (raw_row[end - 1] is None or raw_row[end - 1] == ""):
+        end -= 1
+    return [cell_value(value) for value in raw_row[:end]]
+
+
+def sheet_row_count(data: bytes) -> int:
+    """ Rows in an xlsx upload's first sheet as its dimension tag gives them, without reading a cell.
+        0 when the file isn't an xlsx or its sheet has no dimension tag.
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as book, book.open(first_sheet_part(book)) as sheet:
+            match = DIMENSION.search(sheet.read(4096))      # The tag comes before the sheet data
+    except (zipfile.BadZipFile, KeyError, ValueError, StopIteration):
+        return 0
+    return int(match.group(1)) if match else 0
+
+
+def parsed_rows(rows: list[list], width: int) -> pd.DataFrame:
+    """ Rows padded to width and typed by the TextParser read_excel uses, columns numbered from 0"""
+    padded = [["" if isinstance(value, float) and np.isnan(value) else value for value in row] + [""] * (width - len(row))
+              for row in rows]
+    return TextParser(padded, header=None, names=range(width), skip_blank_lines=False).read()
+
+
+def combined_dtype(dtypes: set, missing: bool):
+    """ The dtype pandas gives a whole column, from the dtypes TextParser gave each batch holding values in it"""
+    if not dtypes:
+        return np.dtype(float)         # Nothing but blanks
+    if len(dtypes) == 1:
+        (dtype,) = dtypes
+        if missing and dtype.kind in "iu":
+            return np.dtype(float)
+        if missing and dtype.kind == "b":
+            return np.dtype(object)
+        return dtype
+    if all(dtype.kind in "iuf" for dtype in dtypes):
+        return np.result_type(*dtypes)
+    return np.dtype(object)
+
+
+def worksheet_rows(sheet):
+    """ Converted values of every sheet row, read the way pandas' openpyxl reader reads them"""
+    sheet.reset_dimensions()
+    for raw_row in sheet.iter_rows(values_only=True):
+        yield row_values(raw_row)
+
+
+@instrument.timed("read_upload")
+def read_upload_with_progress(path, header_map: dict[str, list[str]], progress=None) -> tuple[pd.DataFrame, int, pd.DataFrame]:
+    """ Same as read_upload, in one openpyxl pass that calls progress(stage, done, total) every STREAM_BATCH_ROWS rows.
+        The total comes from the sheet's dimension tag, so it is only an estimate.
+    """
+    from openpyxl import load_workbook
+    if hasattr(path, "seek"):
+        path.seek(0)
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        estimate = sheet.max_row or 0
+        rows = []
+        with instrument.stage("read workbook"):
+            for position, values in enumerate(worksheet_rows(sheet)):
+                if progress and position % STREAM_BATCH_ROWS == 0:
+                    progress("Reading upload", position, max(estimate, position))
+                rows.append(values)
+    finally:
+        workbook.close()
+    instrument.count("upload rows", len(rows))
+    while rows and not rows[-1]:
+        rows.pop()              # pandas drops trailing blank rows
+    width = max(map(len, rows), default=0)
+    grid = pd.DataFrame([row + [np.nan] * (width - len(row)) for row in rows])
+    expected_headers = [name for sublist in header_map.values() for name in sublist]
+    header_row = detect_header_row(grid, expected_headers) if rows else 0
+    df = frame_from_grid(grid, header_row)
+    df.columns = [normalize_header(c) for c in df.columns]
+    return grid, header_row, df
+
+
+class UploadStream:
+    """ A Product/Clothing upload read batch by batch. The first pass runs on creation, batches() runs the second."""
+    def __init__(self, path, header_map: dict[str, list[str]]):
+        from openpyxl import load_workbook
+        self.path = path
+        if hasattr(path, "seek"):
+            path.seek(0)
+        self.workbook = load_workbook(path, read_only=True, data_only=True)
+        self.sheet = self.workbook.worksheets[0]       # pd.read_excel reads the first sheet
+        self.header_row = 0
+        self.width = 0
+        self.rows = 0
+        self.dtypes = []
+        self.columns = []
+        self.scan(header_map)
+        self.headers = HeaderResolution(pd.DataFrame(columns=self.columns), header_map)
+
+
+    def __repr__(self):
+        return f"UploadStream: {self.rows} rows x {self.width} columns, header on row {self.header_row}"
+
+
+    def sheet_rows(self):
+        """ Converted values of every sheet row"""
+        return worksheet_rows(self.sheet)
+
+
+    @instrument.timed("scan upload")
+    def scan(self, header_map: dict[str, list[str]]):
+        """ First pass: header row, sheet width, data row count and a dtype per column"""
+        expected_headers = [name for sublist in header_map.values() for name in sublist]
+        rows = self.sheet_rows()
+        preview = list(islice(rows, HEADER_SCAN_ROWS))
+        self.width = max((len(row) for row in preview), default=0)
+        scanned = preview[:]
+        while scanned and not scanned[-1]:
+            scanned.pop()       # pandas drops trailing blank rows, detect_header_row never sees them
+        if scanned:             # All blank scores nothing, detect_header_row would give row 0 too
+            grid = pd.DataFrame([row + [np.nan] * (self.width - len(row)) for row in scanned], dtype=object)
+            self.header_row = detect_header_row(grid, expected_headers, max_rows=HEADER_SCAN_ROWS)
+        header_values = preview[self.header_row] if preview else []
+
+        batch_dtypes = {}       # column -> dtypes TextParser gave it in batches where it held a value
+        missing = set()         # columns holding at least one NaN
+        blank_rows = 0          # Blank rows so far that more data followed
+        pending_blank = 0       # Blank rows that only count if more data follows
+        min_width = None
+        batch = []
+        for values in chain(preview[self.header_row + 1:], rows, [None]):
+            if batch and (values is None or len(batch) == STREAM_BATCH_ROWS):
+                self.add_batch_dtypes(batch, batch_dtypes, missing)
+                batch = []
+            if values is None:
+                break
+            if not values:
+                pending_blank += 1
+                continue
+            self.rows += pending_blank + 1
+            blank_rows += pending_blank
+            pending_blank = 0
+            self.width = max(self.width, len(values))
+            min_width = len(values) if min_width is None else min(min_width, len(values))
+            batch.append(values)
+
+        for column in range(self.width):
+            if blank_rows or min_width is None or column >= min_width:
+                missing.add(column)     # Blank and short rows are padded with NaN
+            self.dtypes.append(combined_dtype(batch_dtypes.get(column, set()), column in missing))
+        header_values = header_values + [np.nan] * (self.width - len(header_values))
+        self.columns = [normalize_header(c) for c in column_names(header_values)]
+        instrument.count("upload rows", self.rows)
+
+
+    @staticmethod
+    def add_batch_dtypes(rows: list[list], batch_dtypes: dict[int, set], missing: set):
+        """ Record the dtype TextParser gives each column of one batch of scanned rows"""
+        df = parsed_rows(rows, max(map(len, rows)))
+        for column in df.columns:
+            blanks = df[column].isna()
+            if blanks.any():
+                missing.add(column)
+            if not blanks.all():        # An all blank batch says nothing of the column's type
+                batch_dtypes.setdefault(column, set()).add(df[column].dtype)
+
+
+    def frame(self, rows: list[list], start: int) -> pd.DataFrame:
+        """ One batch of data rows as a DataFrame, indexed by row position under the header like read_upload.
+            Text and object columns keep the cells as read, as pandas does when a column doesn't convert as a whole:
+            a batch holding only "0012" style codes would otherwise parse them as numbers.
+        """
+        instrument.count("upload batches")
+        parsed = parsed_rows(rows, self.width)
+        raw = pd.DataFrame([row + [np.nan] * (self.width - len(row)) for row in rows], columns=range(self.width), dtype=object)
+        df = pd.DataFrame({
+            column: raw[column].astype(dtype) if dtype.kind == "O" else parsed[column].astype(dtype)
+            for column, dtype in enumerate(self.dtypes)
+        })
+        df.index = pd.RangeIndex(start, start + len(rows))
+        df.columns = self.columns
+        return df
+
+
+    def batches(self, batch_rows: int = STREAM_BATCH_ROWS):
+        """ Second pass: yield the data rows as DataFrames of up to batch_rows rows"""
+        try:
+            rows, start, position = [], 0, 0
+            for values in islice(self.sheet_rows(), self.header_row + 1, self.header_row + 1 + self.rows):
+                rows.append(values)
+                position += 1
+                if len(rows) == batch_rows:
+                    yield self.frame(rows, start)
+                    rows, start = [], position
+            if rows:
+                yield self.frame(rows, start)
+        finally:
+            self.close()
+
+
+    def close(self):
+        self.workbook.close()
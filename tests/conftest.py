@@ -0,0 +1,26 @@
+import io
+import sys
+from pathlib import Path
+import pytest
+from openpyxl import Workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))     # The modules live at the repo root
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """ list_cache.CACHE_DIR and INDEX_DIR are relative, so every test runs in its own folder and the repo's
+        .plu_cache and plu_indexes are never written
+    """
+    monkeypatch.chdir(tmp_path)
+
+
+def xlsx_bytes(rows: list[list]) -> bytes:
+    """ A one sheet workbook holding rows exactly as given, so text stays text"""
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
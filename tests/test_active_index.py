@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+from conftest import xlsx_bytes
+from active_index import MappedActiveIndex
+from list_cache import mapped_index_cached, append_codes, clear_cache
+from batch import read_active_index
+from tools import POSSIBLE_PLU
+from test_parser import ACTIVE_LIST
+
+
+def test_concurrent_deltas_all_kept(tmp_path):
+    index = MappedActiveIndex.build(["100", "200"], tmp_path / "active.pluidx")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda code: MappedActiveIndex(index.path).apply_delta(added=[code]), [str(code) for code in range(1000, 1040)]))
+    updated = MappedActiveIndex(index.path)
+    assert len(updated) == 42 and updated.version == 41
+    assert all(str(code) in updated for code in range(1000, 1040))
+
+
+def test_appended_codes_survive_cache_clear(tmp_path):
+    (tmp_path / "active.xlsx").write_bytes(xlsx_bytes(ACTIVE_LIST))
+    index, *_ = mapped_index_cached(tmp_path / "active.xlsx", POSSIBLE_PLU)
+    append_codes(index, ["4242"])
+    clear_cache()
+
+    index, *_ = mapped_index_cached(tmp_path / "active.xlsx", POSSIBLE_PLU)
+    assert "4242" in index and "123" in index
+    assert "4242" in read_active_index(tmp_path / "active.xlsx", "Product")
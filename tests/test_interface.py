@@ -0,0 +1,27 @@
+from pathlib import Path
+import pytest
+from streamlit.testing.v1 import AppTest
+from conftest import xlsx_bytes
+from test_parser import UPLOAD, ACTIVE_LIST
+
+
+APP = str(Path(__file__).resolve().parent.parent / "interface.py")
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@pytest.mark.parametrize("stream_rows", ["100000", "2"])     # Read whole, and streamed in batches
+def test_fixed_file_downloads_offered(stream_rows, monkeypatch):
+    monkeypatch.setenv("PLU_STREAM_ROWS", stream_rows)
+    upload = [row[:] for row in UPLOAD]
+    upload[2][1] = "Gardener's, 50% off"        # Unusable characters the Description fix removes
+    app = AppTest.from_file(APP, default_timeout=60).run()
+    app.file_uploader[0].set_value(("upload.xlsx", xlsx_bytes(upload), XLSX))
+    app.file_uploader[1].set_value(("active.xlsx", xlsx_bytes(ACTIVE_LIST), XLSX))
+    app.run()
+
+    assert not app.exception
+    assert any("Large upload" in info.value for info in app.info) == (stream_rows == "2")
+    assert "Duplicate PLU Code Errors — 3 issue(s)" in [expander.label for expander in app.expander]
+    assert "Automatically Fixed Errors:" in [title.value for title in app.title]
+    assert [button.label for button in app.get("download_button")] == [
+        "Download Fixed Version", "Download Fixed CSV (ERP import)"]
@@ -0,0 +1,44 @@
+import io
+from conftest import xlsx_bytes
+from parser import load_upload, check_duplicates, read_upload
+from tools import read_column, PRODUCT_HEADER_MAP, POSSIBLE_PLU
+import pandas as pd
+
+
+UPLOAD = [
+    ["New product upload"],
+    ["PLU Code", "Description", "Subgroup", "Season", "Cost Price", "VAT Rate", "Barcode"],
+    ["0123", "Text stored code", "Garden", "SS25", 1.5, 23, "5000000000001"],
+    [555, "Numeric code", "Garden", "SS25", 2.5, 23, "5000000000002"],
+    [777, "Another code", "Garden", "SS25", 3.5, 23, "5000000000003"],
+]
+ACTIVE_LIST = [["PLU Code", "Description"], ["0123", "Live item"], [555, "Live item"], [777, "Live item"]]
+
+
+def test_frame_matches_read_excel():
+    data = xlsx_bytes(UPLOAD)
+    _, header_row, df = read_upload(io.BytesIO(data), PRODUCT_HEADER_MAP)
+    expected = pd.read_excel(io.BytesIO(data), header=header_row)
+    expected.columns = df.columns
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_blank_row_kept_like_read_excel():
+    data = xlsx_bytes([["PLU Code"], [1], [None], [2]])
+    _, header_row, df = read_upload(io.BytesIO(data), {"plu_code": ["plu code"]})
+    expected = pd.read_excel(io.BytesIO(data), header=header_row)
+    expected.columns = df.columns
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_numeric_text_code_is_active_duplicate():
+    upload = load_upload(io.BytesIO(xlsx_bytes(UPLOAD)), "Product", "upload.xlsx")
+    active, _, _ = read_column(io.BytesIO(xlsx_bytes(ACTIVE_LIST)), POSSIBLE_PLU)
+    assert check_duplicates(upload.items, active, "plu_code") == {"123": 0, "555": 1, "777": 2}
+
+
+def test_xlsx_and_csv_uploads_agree():
+    csv = "\n".join(",".join(str(value) for value in row) for row in UPLOAD).encode()
+    from_xlsx = load_upload(io.BytesIO(xlsx_bytes(UPLOAD)), "Product", "upload.xlsx")
+    from_csv = load_upload(io.BytesIO(csv), "Product", "upload.csv")
+    assert [item.plu_code for item in from_xlsx.items] == [item.plu_code for item in from_csv.items]
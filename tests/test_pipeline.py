@@ -0,0 +1,39 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from conftest import xlsx_bytes
+from active_index import MappedActiveIndex
+from pipeline import run_pipeline
+from test_parser import UPLOAD
+
+
+def uploads(folder, count: int = 3) -> list:
+    fixable = [row[:] for row in UPLOAD]
+    fixable[2][1] = "Gardener's, 50% off"        # Gets a Description fix, so a fixed file is written
+    paths = [folder / f"upload-{i}.xlsx" for i in range(count)]
+    for path in paths:
+        path.write_bytes(xlsx_bytes(fixable))
+    return paths
+
+
+def run(paths, index_path, out_dir):
+    pipeline = run_pipeline(paths, "Product", index_path, out_dir, concurrency=1, queue_size=1)
+    return asyncio.run(asyncio.wait_for(pipeline, timeout=60))      # A hang fails the test instead of stalling it
+
+
+def test_pipeline_results(tmp_path):
+    index = MappedActiveIndex.build(["555"], tmp_path / "active.pluidx")
+    results = run(uploads(tmp_path), index.path, tmp_path)
+    assert [result["status"] for result in results] == ["issues"] * 3
+    assert all((tmp_path / result["fixed_file"]).exists() for result in results)
+
+
+def test_broken_worker_pool_raises(tmp_path):
+    with pytest.raises(BrokenProcessPool):
+        run(uploads(tmp_path), tmp_path / "missing.pluidx", tmp_path)      # Workers can't map the index
+
+
+def test_write_failure_raises(tmp_path):
+    index = MappedActiveIndex.build(["555"], tmp_path / "active.pluidx")
+    with pytest.raises(FileNotFoundError):
+        run(uploads(tmp_path), index.path, tmp_path / "no" / "such" / "folder")
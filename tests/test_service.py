@@ -0,0 +1,40 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+import pytest
+from conftest import xlsx_bytes
+from service import ValidationServer, WarmList
+from test_parser import UPLOAD, ACTIVE_LIST
+
+
+@pytest.fixture
+def server(tmp_path):
+    active_path = tmp_path / "active.xlsx"
+    active_path.write_bytes(xlsx_bytes(ACTIVE_LIST))
+    server = ValidationServer(("127.0.0.1", 0), {"Product": WarmList(active_path, "Product")}, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body: bytes, name: str) -> tuple[int, dict]:
+    request = urllib.request.Request(f"{server.url}/validate/Product?name={name}", data=body, method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_upload_validated(server):
+    status, body = post(server, xlsx_bytes(UPLOAD), "upload.xlsx")
+    assert status == 200
+    assert body["status"] == "issues" and body["rows"] == 3
+
+
+def test_garbage_upload_rejected(server):
+    status, body = post(server, b"garbage", "upload")
+    assert status == 422
+    assert "plu_code" in body["error"]
@@ -0,0 +1,40 @@
+import io
+import pandas as pd
+import pytest
+from conftest import xlsx_bytes
+from parser import read_upload
+from streaming import UploadStream, read_upload_with_progress
+from tools import PRODUCT_HEADER_MAP
+from test_parser import UPLOAD
+
+
+ROWS = UPLOAD + [["0888", "Late text code", "Garden", None, "4.5", 23, 5000000000004], [], [999, "After a blank row"]]
+
+
+@pytest.mark.parametrize("batch_rows", [1, 2, 3, 5000])
+@pytest.mark.parametrize("rows", [
+    [["PLU Code", "Description"], ["0012", "a"], ["0013", "b"], ["AB14", "c"], ["0015", "d"]],
+    [["PLU Code"], [1], [None], [2]],
+])
+def test_batch_sizes_match_read_upload(rows, batch_rows):
+    header_map = {"plu_code": ["plu code"], "description": ["description"]}
+    data = xlsx_bytes(rows)
+    _, _, expected = read_upload(io.BytesIO(data), header_map)
+    streamed = pd.concat(list(UploadStream(io.BytesIO(data), header_map).batches(batch_rows)))
+    pd.testing.assert_frame_equal(streamed, expected)
+
+
+def test_batches_match_read_upload():
+    data = xlsx_bytes(ROWS)
+    _, _, expected = read_upload(io.BytesIO(data), PRODUCT_HEADER_MAP)
+    upload = UploadStream(io.BytesIO(data), PRODUCT_HEADER_MAP)
+    streamed = pd.concat(list(upload.batches(batch_rows=2)))
+    pd.testing.assert_frame_equal(streamed, expected)
+    assert streamed["plucode"].tolist()[:4] == [123, 555, 777, 888]
+
+
+def test_progress_read_matches_read_upload():
+    data = xlsx_bytes(ROWS)
+    _, _, expected = read_upload(io.BytesIO(data), PRODUCT_HEADER_MAP)
+    _, _, df = read_upload_with_progress(io.BytesIO(data), PRODUCT_HEADER_MAP)
+    pd.testing.assert_frame_equal(df, expected)
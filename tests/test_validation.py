@@ -0,0 +1,10 @@
+import pytest
+from rules import RULES
+from validation import ERROR_TYPES, FILE_TYPES
+
+
+@pytest.mark.parametrize("file_type", list(FILE_TYPES))
+def test_every_check_has_success_message(file_type):
+    titles = [title for title, _, _ in RULES[file_type]]
+    assert titles
+    assert [title for title in titles if title not in ERROR_TYPES] == []
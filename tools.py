@@ -1,8 +1,10 @@
+import re
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 from decimal import Decimal
 from collections import Counter, defaultdict
-import streamlit as st
-import doctest
+import instrument
 
 
 BAD_CHARS = set("',%")
@@ -52,11 +54,29 @@ CLOTHING_HEADER_MAP = {
 }
 
 
+# Other active list columns indexed beside the code column, field -> possible names
+ACTIVE_LIST_COLUMNS = {
+    "barcode": PRODUCT_HEADER_MAP["barcode"],
+    "supplier_code": PRODUCT_HEADER_MAP["supplier_code"],
+}
+
+
 def normalizer(value):
     """ Given value is outputted as a string."""
     return str(value)
 
 
+def catalogue_key(value) -> str:
+    """ Barcode or supplier code as compared against the active list: whole numbers lose the .0 a float column
+        gives them, text loses surrounding spaces. Blank cells give ""
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
 def normalize_header(value):
     """ Given header is outputted in a normalized format"""
     return str(value).strip().lower().replace(" ", "").replace("_", "").replace("-", "")
@@ -65,46 +85,50 @@ def normalize_header(value):
 def read_column(file_path, possible_names) -> list:
     """Find the given column name and return that column as a list.
     Converts all objects to strings"""
+    codes, _, message, msg_type = read_columns(file_path, possible_names)
+    return codes, message, msg_type
+
+
+@instrument.timed("read active list")
+def read_columns(file_path, possible_names, columns: dict[str, list[str]] | None = None) -> tuple[list, dict[str, list[str]], str, str]:
+    """ read_column, plus the other columns (field -> possible names, e.g. ACTIVE_LIST_COLUMNS) from the same parse.
+        Each is aligned with the codes, as catalogue_key strings. Fields the sheet has no column for are left out.
+    """
     if isinstance(possible_names, str):
         possible_names = [possible_names]
     try:
         df = pd.read_excel(file_path)
         normalized_cols = {normalize_header(col): col for col in df.columns}
+        code_col, message, msg_type = match_column(normalized_cols, possible_names)
+        if code_col is None:
+            return [], {}, message, msg_type
+
+        rows = df[df[code_col].notna()]
+        found = {}
+        for field, names in (columns or {}).items():
+            col = next((normalized_cols[normalize_header(name)] for name in names if normalize_header(name) in normalized_cols), None)
+            if col is not None and col != code_col:     # Exact names only, a near miss could be any other column
+                found[field] = [catalogue_key(value) for value in rows[col].tolist()]
+        return rows[code_col].apply(normalizer).tolist(), found, message, msg_type
 
-    # Exact match with key map
-        for name in possible_names:
-            normalized = normalize_header(name)
-            if normalized in normalized_cols:
-                return df[normalized_cols[normalized]].dropna().apply(normalizer).tolist(), "", "skip"
+    except Exception as e:
+        return [], {}, f"Error reading {file_path}: {e}", "error"
 
-    # Char match
-        best_score = 0
-        best_possible = None
-        original_header = None
-        
-        for df_col_key, df_col_val in normalized_cols.items():
-                for expected_name in possible_names:
-                    score = char_match(expected_name, df_col_key)
-                    if score > best_score:
-                        best_score = score
-                        best_possible = expected_name
-                        original_header = df_col_val
-        
-        if best_score >= THRESHOLD:  # ← adjust threshold as needed
-            msg = f"CHAR_MATCH updated the column header '{original_header}' to '{best_possible}' to match template spreadsheet"
-            return df[best_possible].dropna().apply(normalizer).tolist(), msg, "alert"
-        return [], possible_names[0], "error"
 
-    except Exception as e:
-        return [], f"Error reading {file_path}: {e}", "error"
-    
+def item_fields(obj) -> list[tuple[str, object]]:
+    """ (name, value) for every attribute of an item. Works for slotted Product/Clothing where vars() doesn't"""
+    slots = getattr(type(obj), "__slots__", None)
+    if slots is None:
+        return list(vars(obj).items())
+    return [(name, getattr(obj, name, None)) for name in slots]
+
 
 def bad_char(obj, id_attr: str) -> str:
     """ The characters ',% can't be in any product variables. Check if they have any and return where.
         Input for id_attr should be the code/name of item preferred when returning an error message.
     """
     bad_fields = []
-    for field, value in vars(obj).items():     # Grab each variable and the value for the product
+    for field, value in item_fields(obj):      # Grab each variable and the value for the product
             if isinstance(value, str):          # Avoid type error
                 if any(char in value for char in BAD_CHARS):    # Check if any bad chars are in the value
                     bad_fields.append(field)
@@ -116,13 +140,29 @@ def bad_char(obj, id_attr: str) -> str:
 
 
 
+@instrument.timed()
+def bad_char_rows(table, id_attr: str) -> list[str]:
+    """ bad_char run over every text column of an ItemTable at once. Same messages, in line order."""
+    pattern = "[" + re.escape("".join(sorted(BAD_CHARS))) + "]"
+    flagged = np.zeros(len(table), dtype=bool)
+    for values in table.text_columns().values():
+        flagged |= values.str.contains(pattern, regex=True, na=False).to_numpy(dtype=bool)
+
+    ids = table.column(id_attr)
+    return [f"Line {table.lines[i]} \u00A0\u00A0|\u00A0\u00A0 {ids[i]} contains invalid character(s) {BAD_CHARS}"
+            for i in np.flatnonzero(flagged)]
+
+
+
 def find_column(df: pd.DataFrame, possible_names: dict):
     """ Identify column based on a possible names reference dictionary.
         If reference dictionary doesn't work, use char match. """
-
     normalized_cols = {normalize_header(col): col for col in df.columns}
-    for col in df.columns:
-            print(f"  - '{col}' → '{normalize_header(col)}'")
+    return match_column(normalized_cols, possible_names)
+
+
+def match_column(normalized_cols: dict, possible_names: list[str]):
+    """ find_column against columns that are already normalized (normalized header -> original header)"""
 
     # Main: Exact match
     for name in possible_names:
@@ -130,29 +170,67 @@ def find_column(df: pd.DataFrame, possible_names: dict):
         if key in normalized_cols:
             return normalized_cols[key], "", "skip"
 
-    # Back up: Char match
+    # Back up: Char match, every column against every name in one batch
+    instrument.count("fuzzy header matches")
+    instrument.count("fuzzy header scores", len(normalized_cols) * len(possible_names))
     best_score = 0
     best_possible = None
     original_header = None
 
-    for col_key in normalized_cols.keys():
-            for name in possible_names:
-                score = char_match(name, col_key)
-                # print(f"Comparing expected: {name} vs found: {col_key} → score {score:.2f}")
-
-                if score > best_score:
-                    best_score = score
-                    best_possible = name
-                    original_header = normalized_cols[col_key]
+    col_keys = list(normalized_cols.keys())
+    if col_keys:
+        scores = header_matcher(tuple(possible_names)).scores(col_keys)
+        col_i, name_i = np.unravel_index(np.argmax(scores), scores.shape)   # First best pair, columns then names
+        if scores[col_i, name_i] > best_score:
+            best_score = scores[col_i, name_i]
+            best_possible = possible_names[name_i]
+            original_header = normalized_cols[col_keys[col_i]]
     
     if best_score >= THRESHOLD:  # ← adjust threshold as needed
         msg = f"CHAR_MATCH updated the column header '{original_header}' to '{best_possible}' to match template spreadsheet"
         return original_header, msg, "alert"
     
-    print(f"No match found for key — returning None: {possible_names}")
     return None, possible_names[0], "error"
 
 
+MATCH_KINDS = {"skip": "exact", "alert": "fuzzy", "error": "missing"}
+
+
+class HeaderResolution:
+    """ Every field of a header map resolved against one DataFrame's columns, once.
+        Pass it to the loaders and fixers so they don't call find_column again for the same file.
+    """
+    @instrument.timed("resolve headers")
+    def __init__(self, df: pd.DataFrame, header_map: dict[str, list[str]]):
+        self.header_map = header_map
+        self.columns = {}     # field -> DataFrame column, None when not found
+        self.kinds = {}       # field -> "exact", "fuzzy" or "missing"
+        self.messages = []    # (message, type) for fuzzy and missing fields, as find_column reports them
+
+        normalized_cols = {normalize_header(col): col for col in df.columns}
+        for key, possible_names in header_map.items():
+            col, msg, msg_type = match_column(normalized_cols, possible_names)
+            self.columns[key] = col
+            self.kinds[key] = MATCH_KINDS[msg_type]
+            if msg:
+                self.messages.append((msg, msg_type))
+
+
+    def __repr__(self):
+        counts = Counter(self.kinds.values())
+        return f"HeaderResolution: {counts['exact']} exact, {counts['fuzzy']} fuzzy, {counts['missing']} missing"
+
+
+    def __getitem__(self, key: str) -> str | None:
+        return self.columns[key]
+
+
+    def column(self, df: pd.DataFrame, key: str) -> str | None:
+        """ Resolved column for key, or None if it wasn't found or isn't in df"""
+        col = self.columns.get(key)
+        return col if col is not None and col in df.columns else None
+
+
 def check_missing_columns(df: pd.DataFrame, header_map: dict[str, list[str]]) -> list[str]:
     """
     Checks for missing expected headers in a DataFrame using a HEADER_MAP.
@@ -175,41 +253,86 @@ def char_match(target: str, possible: str):
     """ Returns a score of how close two words are based on matching characters
     
     >>> char_match("costprice", "costp ricee")
-    0.9
+    0.9473684210526316
 
     >>> char_match("description", "descripshun")  # 2 wrong letters
-    0.6363636363636364
+    0.7272727272727273
 
     >>> char_match("vatcode", "vat-code")  # assuming normalize_header removes dashes
     1.0
 
     >>> char_match("productname", "product_id")
-    0.5384615384615384
+    0.7
 
     >>> char_match("name", "nmae")  # wrong order, but same letters
     1.0
 
     >>> char_match("three digit supplier", "3 digit supplier")
-    0.84375
+    0.8125
     """
     target = normalize_header(target)
     possible = normalize_header(possible)
-    target_list = list(target)
-    possible_list = list(possible)
-    unmatched_list = []
-
-    for char in possible_list:
-        if char in target_list:
-            target_list.remove(char)
-        else:
-            unmatched_list.append(char)
+    matched = sum((char_counts(target) & char_counts(possible)).values())   # Characters the two have in common
         
     total_possible = len(target) + len(possible)
-    total = len(unmatched_list) + len(target_list)
+    total = (len(possible) - matched) + (len(target) - matched)            # Unmatched in possible + left over in target
     score = 1 - (total / total_possible)
     return score
 
 
+@lru_cache(maxsize=4096)
+def char_counts(text: str) -> Counter:
+    """ Memoized character counts, header strings repeat across columns, rows and files"""
+    return Counter(text)
+
+
+class HeaderMatcher:
+    """ char_match for many headers against a fixed list of aliases at once.
+        The aliases' character counts are precomputed into a matrix, so scoring a batch of headers is
+        one numpy operation and gives exactly the scores char_match would.
+    """
+    def __init__(self, aliases: list[str]):
+        self.aliases = [normalize_header(alias) for alias in aliases]
+        self.alphabet = {char: i for i, char in enumerate(sorted(set("".join(self.aliases))))}
+        self.alias_counts = np.array([self.count_vector(alias) for alias in self.aliases], dtype=np.int64).reshape(len(self.aliases), len(self.alphabet))
+        self.alias_lens = np.array([len(alias) for alias in self.aliases], dtype=np.int64)
+        self.memo = {}    # header -> (count vector, length)
+
+
+    def count_vector(self, text: str) -> list[int]:
+        """ Character counts over the aliases' alphabet. Other characters can never match, they only add length"""
+        vector = [0] * len(self.alphabet)
+        for char in text:
+            if char in self.alphabet:
+                vector[self.alphabet[char]] += 1
+        return vector
+
+
+    def scores(self, headers: list[str]) -> np.ndarray:
+        """ (headers x aliases) array of char_match(alias, header) scores"""
+        rows = []
+        for header in headers:
+            if header not in self.memo:
+                normalized = normalize_header(header)
+                self.memo[header] = (self.count_vector(normalized), len(normalized))
+            rows.append(self.memo[header])
+
+        header_counts = np.array([vector for vector, _ in rows], dtype=np.int64).reshape(len(rows), len(self.alphabet))
+        header_lens = np.array([length for _, length in rows], dtype=np.int64)
+
+        matched = np.minimum(header_counts[:, None, :], self.alias_counts[None, :, :]).sum(axis=2)
+        total_possible = header_lens[:, None] + self.alias_lens[None, :]
+        total = (header_lens[:, None] - matched) + (self.alias_lens[None, :] - matched)
+        with np.errstate(invalid="ignore", divide="ignore"):    # Two empty strings give nan, not a match
+            return 1 - (total / total_possible)
+
+
+@lru_cache(maxsize=64)
+def header_matcher(aliases: tuple[str, ...]) -> HeaderMatcher:
+    """ One HeaderMatcher per alias list, built the first time that list is used"""
+    return HeaderMatcher(list(aliases))
+
+
 
 
     
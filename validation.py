@@ -0,0 +1,240 @@
+""" The checks run on every upload, registered as rules (see rules.py) so they share one pass over the data"""
+from parser import *
+from active_index import ActiveIndex
+from rules import rule, run_rules
+from product_class import plu_len_errors
+from clothing_class import style_len_errors
+
+
+def active_duplicate_errors(scan, noun: str, seen: set | None = None) -> list[str]:
+    """ Codes already in the active list. Each code is looked up once, in the order it first appears in the upload.
+        seen holds the codes earlier batches of a streamed upload already looked up.
+    """
+    codes = list(scan.code_groups(scan.id_attr))
+    if seen is not None:
+        codes = [code for code in codes if code not in seen]
+        seen.update(codes)
+    errors = []
+    for code, position in zip(codes, scan.active_index.first_many(codes).tolist()):
+        if position >= 0:
+            errors.append(f"Line: {position + 2} \u00A0\u00A0|\u00A0\u00A0 {noun} {code} is already in the system.")  # +2 to match Excel row (header + 0-indexed)
+    return errors
+
+
+def catalogue_barcode_errors(scan, noun: str) -> list[str]:
+    """ Uploaded barcodes the active list already has on a different code, with the code that owns them.
+        Each barcode is looked up once. Only looks at each row on its own, so a streamed upload checks batch by batch.
+    """
+    barcodes = scan.catalogue_keys("barcode")
+    owners = scan.active_index.owners("barcode", list(dict.fromkeys(barcode for barcode in barcodes if barcode)))
+    if not owners:
+        return []
+    lines, codes = scan.lines(), scan.codes(scan.id_attr)
+    errors = []
+    for i, barcode in enumerate(barcodes):
+        position, owner = owners.get(barcode, (None, codes[i]))
+        if owner != codes[i]:       # The item's own barcode is fine, the code itself is reported as already in the system
+            errors.append(f"Line {lines[i]} \u00A0\u00A0|\u00A0\u00A0 Barcode {barcode} on {codes[i]} already belongs to "
+                          f"{noun} {owner} (active list line {position + 2})")
+    return errors
+
+
+class ActiveDuplicateStream:
+    """ Streamed active list check, reporting each code the first time any batch holds it"""
+    def __init__(self, noun: str):
+        self.noun = noun
+        self.seen = set()
+
+
+    def feed(self, scan) -> list[str]:
+        return active_duplicate_errors(scan, self.noun, self.seen)
+
+
+    def finish(self) -> list[str]:
+        return []
+
+
+class GroupStream:
+    """ Streamed cross-row check: collects each batch's groups, reports on them once the upload ends"""
+    def __init__(self, collect, report):
+        self.collect = collect
+        self.report = report
+        self.groups = defaultdict(list)
+
+
+    def feed(self, scan) -> list[str]:
+        for key, entries in self.collect(scan).items():
+            self.groups[key] += entries
+        return []
+
+
+    def finish(self) -> list[str] | None:
+        return self.report(self.groups)
+
+
+# Groupings shared by the whole upload and streamed checks: collect builds them, report words them
+
+def code_lines(scan, only_repeats: bool = False) -> dict[str, list[int]]:
+    """ Normalized code -> Excel lines. A whole upload only needs only_repeats, a streamed batch needs every code"""
+    lines = scan.lines()
+    return {
+        code: [lines[i] for i in positions]
+        for code, positions in scan.code_groups(scan.id_attr).items() if len(positions) > 1 or not only_repeats
+    }
+
+
+def internal_duplicate_errors(groups: dict[str, list[int]]) -> list[str]:
+    """ check_internal_duplicates wording"""
+    return [f"Code: {code} appears {len(lines)} times on lines {lines}" for code, lines in groups.items() if len(lines) > 1]
+
+
+def barcode_items(scan, only_repeats: bool = False) -> dict[object, list[tuple[str, int]]]:
+    """ Barcode -> (normalized code, Excel line) of every item with it"""
+    lines, codes = scan.lines(), scan.codes(scan.id_attr)
+    return {
+        barcode: [(codes[i], lines[i]) for i in positions]
+        for barcode, positions in scan.groups("barcode").items() if len(positions) > 1 or not only_repeats
+    }
+
+
+def barcode_errors(groups: dict[object, list[tuple[str, int]]]) -> list[str] | None:
+    """ duplicate_barcodes wording. None when every barcode is unique, like duplicate_barcodes"""
+    errors = []
+    for barcode, items in groups.items():
+        if barcode and len(items) > 1:  # Skip empty or None
+            detail = ", ".join([f"{code} (line {line})" for code, line in items])
+            errors.append(f"Barcode {barcode} is shared by: {detail}")
+    return errors or None
+
+
+def clothing_item_lines(scan, only_repeats: bool = False) -> dict[tuple, list[int]]:
+    """ (style code, size, colour) -> Excel lines"""
+    lines = scan.lines()
+    return {
+        key: [lines[i] for i in positions]
+        for key, positions in scan.groups("style_code", "size", "colour").items() if len(positions) > 1 or not only_repeats
+    }
+
+
+def clothing_duplicate_errors(groups: dict[tuple, list[int]]) -> list[str]:
+    """ check_clothing_duplicates wording: every repeat after the first, in line order"""
+    repeats = sorted(
+        (line, style_code, size)
+        for (style_code, size, _), lines in groups.items()
+        for line in lines[1:]
+    )
+    return [f"Duplicate Style {style_code} with size {size} on line {line}" for line, style_code, size in repeats]
+
+
+# Product rules ----------
+
+@rule("Product", "Duplicate PLU Code Errors", stream=lambda: ActiveDuplicateStream("Product"))
+def duplicate_plus(scan):
+    return active_duplicate_errors(scan, "Product")
+
+
+@rule("Product", "Duplicate PLUs Within Uploaded File", stream=lambda: GroupStream(code_lines, internal_duplicate_errors))
+def internal_plus(scan):
+    return internal_duplicate_errors(code_lines(scan, only_repeats=True))
+
+
+@rule("Product", "PLU Code Length Errors")
+def plu_lengths(scan):
+    return plu_len_errors(scan.table)
+
+
+@rule("Product", "Unusable Character Errors")
+def product_bad_chars(scan):
+    return bad_char_rows(scan.table, "plu_code")
+
+
+@rule("Product", "Duplicate Barcode Errors", stream=lambda: GroupStream(barcode_items, barcode_errors))
+def product_barcodes(scan):
+    return barcode_errors(barcode_items(scan, only_repeats=True))
+
+
+@rule("Product", "Catalogue Barcode Errors")
+def product_catalogue_barcodes(scan):
+    return catalogue_barcode_errors(scan, "Product")
+
+
+# Clothing rules ----------
+
+@rule("Clothing", "All Duplicate Style Code Code Errors", stream=lambda: ActiveDuplicateStream("Item"))
+def duplicate_styles(scan):
+    return active_duplicate_errors(scan, "Item")
+
+
+@rule("Clothing", "Duplicate Style Codes Within Uploaded File", stream=lambda: GroupStream(clothing_item_lines, clothing_duplicate_errors))
+def internal_styles(scan):
+    return clothing_duplicate_errors(clothing_item_lines(scan, only_repeats=True))
+
+
+@rule("Clothing", "All Style Code Length Errors")
+def style_lengths(scan):
+    return style_len_errors(scan.table)
+
+
+@rule("Clothing", "All Unusable Character Errors")
+def clothing_bad_chars(scan):
+    return bad_char_rows(scan.table, "style_code")
+
+
+@rule("Clothing", "All Duplicate Barcode Errors", stream=lambda: GroupStream(barcode_items, barcode_errors))
+def clothing_barcodes(scan):
+    return barcode_errors(barcode_items(scan, only_repeats=True))
+
+
+@rule("Clothing", "All Catalogue Barcode Errors")
+def clothing_catalogue_barcodes(scan):
+    return catalogue_barcode_errors(scan, "Style")
+
+
+def product_checks(products: list[Product], plu_index: ActiveIndex, progress=None, on_result=None) -> dict[str, list[str]]:
+    """ Every product check, keyed by the title its results are shown under"""
+    results, _ = run_rules(products, plu_index, "Product", progress, on_result)
+    return results
+
+
+def clothing_checks(clothes: list[Clothing], style_index: ActiveIndex, progress=None, on_result=None) -> dict[str, list[str]]:
+    """ Every clothing check, keyed by the title its results are shown under"""
+    results, _ = run_rules(clothes, style_index, "Clothing", progress, on_result)
+    return results
+
+
+# Results titles and the message shown when that check finds nothing
+ERROR_TYPES = {
+    # Product checks
+    "Duplicate PLU Code Errors": "PLU Codes are all valid.", 
+    "Duplicate PLUs Within Uploaded File": "No Duplicate PLU Codes.",
+    "PLU Code Length Errors": "PLU Code lengths are all valid.",
+    "Product Description Length Errors": "Product descriptions are all valid.",
+    "Decimal Formatting Errors": "All numbers rounded correctly.",
+
+    # Shared
+    "Unusable Character Errors": "No unusable characters found.",
+    "Duplicate Barcode Errors": "All barcodes are valid.",
+    "Catalogue Barcode Errors": "No barcodes belong to other items in the active list.",
+
+    # Clothing checks
+    "Duplicate Style Code Code Errors": "Style Codes are all valid.",
+    "Duplicate Style Codes Within Uploaded File": "No Duplicate Style Codes.",
+    "Style Code Length Errors": "Style Code lengths are all valid.",
+    "Clothing Item Description Length Errors": "Descriptions are all valid.",
+    "All Duplicate Style Code Code Errors": "Style Codes are all valid.",
+    "All Style Code Length Errors": "Style Code lengths are all valid.",
+    "All Unusable Character Errors": "No unusable characters found.",
+    "All Duplicate Barcode Errors": "All barcodes are valid.",
+    "All Catalogue Barcode Errors": "No barcodes belong to other items in the active list.",
+}
+
+
+def success_message(title: str) -> str:
+    return ERROR_TYPES.get(title, f"{title} passed all checks.")
+
+
+# Per file type: header map, code attribute, active list column names, checks and auto-fixes
+FILE_TYPES = {
+    "Product": (PRODUCT_HEADER_MAP, "plu_code", POSSIBLE_PLU, product_checks, update_all_products),
+    "Clothing": (CLOTHING_HEADER_MAP, "style_code", CLOTHING_HEADER_MAP["style_code"], clothing_checks, update_all_clothing),
+}